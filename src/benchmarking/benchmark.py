@@ -1,5 +1,6 @@
 import asyncio, json, time
 from typing import List
+from src.clients.transport import closing_pools
 from src.orchestrator.multimodel_analyzer import MultiModelAnalyzer
 
 SAMPLE = [
@@ -8,19 +9,28 @@ SAMPLE = [
     "Acme Corp announces quarterly results and guidance",
 ]
 
-async def run_once(texts: List[str], providers: List[str]):
+async def run_once(texts: List[str], providers: List[str], concurrency: int = 1, pack: bool = False):
     mm = MultiModelAnalyzer()
     out = []
-    for t in texts:
-        for p in providers:
-            start = time.perf_counter()
-            res = await mm.analyze_with_routing(t, provider=p)
-            dt = (time.perf_counter()-start)*1000
+
+    async def per_provider(p: str):
+        start = time.perf_counter()
+        results = await mm.analyze_batch(texts, provider=p, concurrency=concurrency, pack=pack)
+        dt = (time.perf_counter()-start)*1000/max(1, len(texts))
+        return p, results, dt
+
+    for p, results, dt in await asyncio.gather(*(per_provider(p) for p in providers)):
+        for res in results:
             r = res["response"]
             out.append({
                 "provider": p, "model": r.get("model"), "ok": r.get("ok"),
+                "parse_ok": bool(r.get("ok")) and r.get("parsed") is not None,
+                "error_type": None if r.get("ok") else (r.get("error_type") or "Error"),
                 "latency_ms": r.get("latency_ms", dt), "cost_usd": r.get("cost_usd"),
-                "sentiment": (r.get("parsed") or {}).get("sentiment")
+                "sentiment": (r.get("parsed") or {}).get("sentiment"),
+                "packed": (r.get("packed") or {}).get("size", 1),
+                "prompt_tokens": (r.get("usage") or {}).get("prompt"),
+                "cached_prompt_tokens": (r.get("usage") or {}).get("cached_prompt"),
             })
     return out
 
@@ -29,14 +39,28 @@ def main():
     ap = argparse.ArgumentParser()
     ap.add_argument("--providers", nargs="+", default=["openai","anthropic","deepseek"])
     ap.add_argument("--texts", nargs="*", default=SAMPLE)
+    ap.add_argument("--concurrency", type=int, default=1)
+    ap.add_argument("--pack", action="store_true", help="several headlines per request (LLM_PACK_* budgets)")
+    ap.add_argument("--no-store", action="store_true", help="do not append the run to RESULTS_DB")
     args = ap.parse_args()
 
-    res = asyncio.run(run_once(args.texts, args.providers))
+    res = asyncio.run(closing_pools(run_once(args.texts, args.providers, args.concurrency, args.pack)))
     df = pd.DataFrame(res)
     print("\n== Summary ==")
     print(df.groupby("provider")[["latency_ms","cost_usd"]].mean().round(3))
-    df.to_csv("tests/quick_benchmark.csv", index=False)
-    print("\nSaved: tests/quick_benchmark.csv")
+    tok = df.groupby("provider")[["prompt_tokens","cached_prompt_tokens"]].sum()
+    print("\nPrompt cache hit ratio (cached / prompt tokens):")
+    print((tok["cached_prompt_tokens"]/tok["prompt_tokens"]).round(3).to_string())
+    # un fichero por ejecución: no se pisan resultados anteriores
+    out = time.strftime("tests/quick_benchmark_%Y%m%d-%H%M%S.csv")
+    df.to_csv(out, index=False)
+    print(f"\nSaved: {out}")
+    if not args.no_store:
+        from src.benchmarking.results_store import ResultsStore
+        store = ResultsStore()
+        run_id = store.record_run("benchmark", res, {"providers": args.providers, "texts": len(args.texts),
+                                                     "concurrency": args.concurrency, "pack": args.pack})
+        print(f"Stored: {run_id} in {store.path}  (python -m src.benchmarking.results_store compare {run_id})")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
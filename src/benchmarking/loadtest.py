@@ -0,0 +1,242 @@
+import os, csv, json, random, asyncio, time
+from datetime import datetime, timezone
+from typing import Any, Dict, List
+import numpy as np
+from src.benchmarking.benchmark import SAMPLE
+from src.clients.transport import closing_pools
+from src.orchestrator.multimodel_analyzer import MultiModelAnalyzer
+
+OUT_DIR = "benchmarks"
+
+async def _one(mm: MultiModelAnalyzer, target: str, text: str, t0: float) -> Dict[str, Any]:
+    start = time.perf_counter()
+    try:
+        res = await mm.analyze_with_routing(text, provider=target)
+        r = res["response"]
+        decision = res.get("router_decision")
+        meta = res.get("routing_meta") or {}
+    except Exception as e:
+        r = {"ok": False, "error": str(e), "error_type": type(e).__name__}
+        decision, meta = None, {}
+    end = time.perf_counter()
+    ok = bool(r.get("ok"))
+    # tokens de prompt facturados (un acierto de la caché de respuestas no llega al proveedor)
+    usage = (r.get("usage") or {}) if r.get("cache") != "hit" else {}
+    parsed_ok = ok and (r.get("parsed") is not None or r.get("provider") == "stub")
+    return {
+        "target": target,
+        "decision": decision,
+        "model": r.get("model"),
+        "ok": ok,
+        "parse_ok": parsed_ok,
+        "error_type": None if ok else (r.get("error_type") or "Error"),
+        "t_start_s": round(start - t0, 4),
+        "latency_ms": round((end - start)*1000, 1),
+        "provider_latency_ms": r.get("latency_ms"),
+        # streaming: tiempo hasta el primer token y si se cortó el stream tras el JSON
+        "ttft_ms": r.get("ttft_ms"),
+        "early_stop": (r.get("stream") or {}).get("early_stop"),
+        # hedged/cascade: coste de todas las llamadas lanzadas, no sólo de la que respondió
+        "cost_usd": meta.get("total_cost_usd", r.get("cost_usd")),
+        "prompt_tokens": usage.get("prompt"),
+        "cached_prompt_tokens": usage.get("cached_prompt"),
+        "stage": meta.get("stage"),
+    }
+
+async def closed_loop(mm, target, texts, *, concurrency, duration_s=None, requests=None) -> List[Dict]:
+    """`concurrency` workers, each sending its next request as soon as the previous one returns."""
+    out, t0 = [], time.perf_counter()
+    counter = iter(range(requests if requests is not None else 1 << 62))
+
+    async def worker():
+        for i in counter:
+            if duration_s is not None and time.perf_counter() - t0 >= duration_s:
+                return
+            out.append(await _one(mm, target, texts[i % len(texts)], t0))
+
+    await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+    return out
+
+async def open_loop(mm, target, texts, *, rate, duration_s=None, requests=None, seed=0) -> List[Dict]:
+    """Poisson arrivals at `rate` req/s, independent of how fast responses come back."""
+    rng = random.Random(seed)
+    tasks, t0, i = [], time.perf_counter(), 0
+    next_at = 0.0
+    while (requests is None or i < requests) and (duration_s is None or next_at < duration_s):
+        delay = next_at - (time.perf_counter() - t0)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(_one(mm, target, texts[i % len(texts)], t0)))
+        i += 1
+        next_at += rng.expovariate(rate)
+    return list(await asyncio.gather(*tasks))
+
+def _after_warmup(rows: List[Dict], warmup_s: float = 0.0, warmup_requests: int = 0) -> List[Dict]:
+    rows = sorted(rows, key=lambda r: r["t_start_s"])[warmup_requests:]
+    return [r for r in rows if r["t_start_s"] >= warmup_s]
+
+def summarize(rows: List[Dict], *, warmup_s: float = 0.0, warmup_requests: int = 0) -> Dict[str, Any]:
+    rows = _after_warmup(rows, warmup_s, warmup_requests)
+    if not rows:
+        return {"n": 0, "rps": None, "error_rate": None, "parse_fail_rate": None, "errors": {}, "mean_ms": None,
+                "p50_ms": None, "p90_ms": None, "p99_ms": None, "max_ms": None, "cost_per_1k_usd": None,
+                "prompt_cache_hit_ratio": None, "ttft_p50_ms": None, "stages": {}}
+    lat = np.array([r["latency_ms"] for r in rows], dtype=float)
+    ok_lat = np.array([r["latency_ms"] for r in rows if r["ok"]], dtype=float)
+    ends = [r["t_start_s"] + r["latency_ms"]/1000 for r in rows]
+    window = max(ends) - min(r["t_start_s"] for r in rows)
+    errors: Dict[str, int] = {}
+    for r in rows:
+        if r["error_type"]:
+            errors[r["error_type"]] = errors.get(r["error_type"], 0) + 1
+    stages: Dict[str, int] = {}
+    for r in rows:
+        if r.get("stage"):
+            stages[r["stage"]] = stages.get(r["stage"], 0) + 1
+    cost = sum(r["cost_usd"] or 0.0 for r in rows)
+    prompt_tok = sum(r.get("prompt_tokens") or 0 for r in rows)
+    cached_tok = sum(r.get("cached_prompt_tokens") or 0 for r in rows)
+    src = ok_lat if len(ok_lat) else lat
+    ttft = [r["ttft_ms"] for r in rows if r.get("ttft_ms") is not None]
+    return {
+        "n": len(rows),
+        "rps": round(len(rows)/window, 2) if window > 0 else None,
+        "error_rate": round(1 - len(ok_lat)/len(rows), 4),
+        "parse_fail_rate": round(sum(not r["parse_ok"] for r in rows)/len(rows), 4),
+        "errors": errors,
+        "mean_ms": round(float(src.mean()), 1),
+        "p50_ms": round(float(np.percentile(src, 50)), 1),
+        "p90_ms": round(float(np.percentile(src, 90)), 1),
+        "p99_ms": round(float(np.percentile(src, 99)), 1),
+        "max_ms": round(float(src.max()), 1),
+        "cost_per_1k_usd": round(cost/len(rows)*1000, 4),
+        # fracción de tokens de entrada servidos desde el prompt cache del proveedor
+        "prompt_cache_hit_ratio": round(cached_tok/prompt_tok, 4) if prompt_tok else None,
+        "ttft_p50_ms": round(float(np.percentile(ttft, 50)), 1) if ttft else None,
+        "stages": stages,
+    }
+
+def _append_csv(path: str, rows: List[Dict]) -> None:
+    """Append `rows` under the file's header. If they bring new columns (the summary gained
+    fields over time), the file is rewritten with the extended header; missing cells stay empty."""
+    if not rows:
+        return
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    cols = list(dict.fromkeys(k for r in rows for k in r))
+    header: List[str] = []
+    if os.path.exists(path):
+        with open(path, newline="", encoding="utf-8") as f:
+            header = next(csv.reader(f), [])
+    merged = header + [c for c in cols if c not in header]
+    if header and merged != header:
+        with open(path, newline="", encoding="utf-8") as f:
+            old = list(csv.DictReader(f))
+        with open(path + ".tmp", "w", newline="", encoding="utf-8") as f:
+            w = csv.DictWriter(f, fieldnames=merged, restval="")
+            w.writeheader()
+            w.writerows(old)
+        os.replace(path + ".tmp", path)
+    with open(path, "a", newline="", encoding="utf-8") as f:
+        w = csv.DictWriter(f, fieldnames=merged, restval="")
+        if not header:
+            w.writeheader()
+        w.writerows(rows)
+
+async def run_load(targets, texts, *, concurrency=8, rate=None, duration_s=None, requests=None,
+                   warmup_s=0.0, warmup_requests=0, use_cache=False) -> Dict[str, Any]:
+    mm = MultiModelAnalyzer(cache=use_cache)
+    per_target, all_rows = {}, []
+    for target in targets:
+        if rate:
+            rows = await open_loop(mm, target, texts, rate=rate, duration_s=duration_s, requests=requests)
+        else:
+            rows = await closed_loop(mm, target, texts, concurrency=concurrency, duration_s=duration_s, requests=requests)
+        per_target[target] = summarize(rows, warmup_s=warmup_s, warmup_requests=warmup_requests)
+        all_rows.extend(rows)
+    mm.save_stats()
+    return {"summary": per_target, "rows": all_rows, "router_stats": mm.stats.snapshot()}
+
+def main():
+    import argparse
+    ap = argparse.ArgumentParser(description="Concurrent load test per provider / routing mode.")
+    ap.add_argument("--targets", nargs="+", default=["openai", "anthropic", "deepseek", "auto", "cost-aware"],
+                    help="providers or routing modes (fastest, balanced, hedged, race, cascade, ...)")
+    ap.add_argument("--texts", nargs="*", default=SAMPLE)
+    ap.add_argument("--input", default=None, help="file with one headline per line (overrides --texts)")
+    mode = ap.add_mutually_exclusive_group()
+    mode.add_argument("--concurrency", type=int, default=8, help="closed loop: requests in flight")
+    mode.add_argument("--rate", type=float, default=None, help="open loop: arrivals per second")
+    ap.add_argument("--duration", type=float, default=None, help="seconds per target")
+    ap.add_argument("--requests", type=int, default=None, help="requests per target")
+    ap.add_argument("--warmup", type=float, default=0.0, help="exclude requests started in the first N seconds")
+    ap.add_argument("--warmup-requests", type=int, default=0, help="exclude the first N requests")
+    ap.add_argument("--cache", action="store_true", help="keep the response cache on (off by default)")
+    ap.add_argument("--out-dir", default=OUT_DIR)
+    ap.add_argument("--mock", action="store_true", help="run against the local mock LLM server (no network/keys)")
+    ap.add_argument("--mock-latency", default="lognormal:300,0.4")
+    ap.add_argument("--mock-p429", type=float, default=0.0)
+    ap.add_argument("--mock-p5xx", type=float, default=0.0)
+    ap.add_argument("--mock-token-ms", type=float, default=0.0, help="mock: pause between streamed deltas")
+    ap.add_argument("--mock-chatter", type=int, default=0, help="mock: words written after the JSON")
+    ap.add_argument("--metrics", action="store_true", help="record metrics/spans; writes metrics_<run_id>.json/.prom")
+    ap.add_argument("--no-store", action="store_true", help="do not append the run to RESULTS_DB")
+    args = ap.parse_args()
+    if args.metrics:
+        from src.observability import metrics
+        metrics.enable()
+    if args.duration is None and args.requests is None:
+        args.requests = 50
+
+    texts = args.texts
+    if args.input:
+        with open(args.input, encoding="utf-8") as f:
+            texts = [l.strip() for l in f if l.strip()]
+
+    mock = None
+    if args.mock:
+        from src.benchmarking.mock_server import MockConfig, use_mock_server
+        mock = use_mock_server(MockConfig(latency=args.mock_latency, p429=args.mock_p429, p5xx=args.mock_p5xx,
+                                          token_ms=args.mock_token_ms, chatter_words=args.mock_chatter))
+
+    res = asyncio.run(closing_pools(run_load(
+        args.targets, texts, concurrency=args.concurrency, rate=args.rate,
+        duration_s=args.duration, requests=args.requests,
+        warmup_s=args.warmup, warmup_requests=args.warmup_requests, use_cache=args.cache,
+    )))
+
+    if mock is not None:
+        mock.shutdown()
+        print("mock server:", mock.counters)
+
+    ts = datetime.now(timezone.utc)
+    run_id = ts.strftime("%Y%m%dT%H%M%SZ")
+    load = f"rate={args.rate}/s" if args.rate else f"concurrency={args.concurrency}"
+    summary_rows = [
+        {"run_id": run_id, "timestamp": ts.isoformat(), "target": t, "load": load,
+         **{k: (json.dumps(v) if isinstance(v, dict) else v) for k, v in s.items()}}
+        for t, s in res["summary"].items()
+    ]
+    print("\n== Load test summary ==")
+    for row in summary_rows:
+        print(row)
+    _append_csv(os.path.join(args.out_dir, "loadtest_summary.csv"), summary_rows)
+    _append_csv(os.path.join(args.out_dir, f"loadtest_{run_id}.csv"), [{"run_id": run_id, **r} for r in res["rows"]])
+    print(f"\nAppended: {args.out_dir}/loadtest_summary.csv  requests: {args.out_dir}/loadtest_{run_id}.csv")
+    if args.metrics:
+        metrics.write_snapshot(os.path.join(args.out_dir, f"metrics_{run_id}.json"))
+        metrics.write_prometheus(os.path.join(args.out_dir, f"metrics_{run_id}.prom"))
+        print(f"Metrics: {args.out_dir}/metrics_{run_id}.json  {args.out_dir}/metrics_{run_id}.prom")
+    if not args.no_store:
+        from src.benchmarking.results_store import ResultsStore
+        store = ResultsStore()
+        # filas tras el warm-up, las mismas que resume summarize()
+        kept = [r for t in args.targets for r in _after_warmup([r for r in res["rows"] if r["target"] == t],
+                                                                args.warmup, args.warmup_requests)]
+        store.record_run("loadtest", kept, {
+            "targets": args.targets, "load": load, "duration_s": args.duration, "requests": args.requests,
+            "texts": len(texts), "cache": args.cache, "mock": args.mock and args.mock_latency,
+        }, run_id=f"loadtest-{run_id}")
+        print(f"Stored: loadtest-{run_id} in {store.path}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,314 @@
+import os, re, json, math, time, random, threading
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional
+from src.orchestrator.router import estimate_tokens
+
+# Servidor local que imita los endpoints de OpenAI/DeepSeek (chat completions) y Anthropic (messages)
+# para ejecutar los clientes reales sin red ni claves.
+
+_POS = ["beat", "beats", "growth", "record", "surge", "bullish", "upgrade", "profit"]
+_NEG = ["miss", "misses", "downgrade", "loss", "decline", "bearish", "probe", "fraud"]
+
+def parse_latency(spec: str):
+    """'fixed:50' | 'uniform:20,200' | 'normal:150,40' | 'lognormal:150,0.5' (ms; lognormal = median,sigma)."""
+    kind, _, raw = spec.partition(":")
+    args = [float(x) for x in raw.split(",") if x]
+    rng = random.Random()
+    if kind == "fixed":
+        return lambda: args[0]
+    if kind == "uniform":
+        return lambda: rng.uniform(args[0], args[1])
+    if kind == "normal":
+        return lambda: max(0.0, rng.gauss(args[0], args[1]))
+    if kind == "lognormal":
+        mu = math.log(args[0])
+        return lambda: rng.lognormvariate(mu, args[1])
+    raise ValueError(f"unknown latency spec: {spec}")
+
+@dataclass
+class MockConfig:
+    latency: str = "fixed:0"
+    p429: float = 0.0
+    p5xx: float = 0.0
+    retry_after_ms: int = 50
+    seed: Optional[int] = None
+    # streaming: pausa entre deltas y palabras de "explicación" que el modelo escribe tras el JSON
+    token_ms: float = 0.0
+    chatter_words: int = 0
+
+def canned_analysis(text: str) -> Dict[str, Any]:
+    t = text.lower()
+    score = sum(w in t for w in _POS) - sum(w in t for w in _NEG)
+    sentiment = "bullish" if score > 0 else "bearish" if score < 0 else "neutral"
+    entities = sorted(set(re.findall(r"\b[A-Z][a-zA-Z&]+(?:\s+(?:Corp|Inc|Ltd|Group))?", text)))[:5]
+    return {
+        "sentiment": sentiment,
+        "confidence": round(min(0.95, 0.55 + 0.15*abs(score)), 2),
+        "key_entities": entities,
+        "impact_score": round(min(1.0, 0.2 + 0.2*abs(score)), 2),
+    }
+
+def _text_of(content) -> str:
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        return "".join(b.get("text", "") for b in content if isinstance(b, dict))
+    return ""
+
+def _packed_items(text: str):
+    # Petición empaquetada (src.clients.packing): array JSON de {"id", "text"} tras la instrucción
+    start = text.find("[")
+    if start < 0:
+        return None
+    try:
+        items = json.loads(text[start:])
+    except Exception:
+        return None
+    if isinstance(items, list) and items and all(isinstance(i, dict) and "id" in i and "text" in i for i in items):
+        return items
+    return None
+
+_CHATTER = ("The headline suggests this view because the reported figures and the tone of the "
+            "announcement point in that direction for investors over the near term").split()
+
+def chatter(n: int) -> str:
+    return ("\n\nExplanation: " + " ".join(_CHATTER[i % len(_CHATTER)] for i in range(n)) + ".") if n else ""
+
+def _pieces(text: str):
+    # deltas de tamaño "token": palabra + espacio siguiente
+    return re.findall(r"\S+\s*|\s+", text)
+
+def _extract_headline(text: str) -> str:
+    # Los clientes envuelven el titular entre '---'; si no, se usa el texto completo
+    parts = text.split("---")
+    return parts[-2].strip() if len(parts) >= 3 else text
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: "MockLLMServer"
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status: int, payload: Dict[str, Any], headers: Optional[Dict[str, str]] = None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # el cliente canceló la petición (hedge/ensemble): no es un error del mock
+            self.close_connection = True
+
+    def _sse(self, events) -> None:
+        """Server-sent events, paced by token_ms; the connection closes at the end. A client
+        that hangs up mid-stream (early termination) is counted, not treated as an error."""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        delay = self.server.config.token_ms/1000
+        try:
+            for name, data, pause in events:
+                if pause and delay:
+                    time.sleep(delay)
+                head = f"event: {name}\n" if name else ""
+                self.wfile.write(f"{head}data: {data if isinstance(data, str) else json.dumps(data)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            self.server.count("stream_aborted")
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        req = json.loads(self.rfile.read(length) or b"{}")
+        anthropic = self.path.rstrip("/").endswith("/messages")
+        if not anthropic and not self.path.rstrip("/").endswith("/chat/completions"):
+            return self._send(404, {"error": {"message": f"unknown path {self.path}"}})
+
+        srv = self.server
+        fault = srv.draw_fault()
+        time.sleep(srv.draw_latency()/1000)
+        srv.count("requests")
+        if fault == 429:
+            srv.count("429")
+            err = {"type": "rate_limit_error", "message": "mock rate limit"}
+            return self._send(429, {"type": "error", "error": err} if anthropic else {"error": err},
+                              {"retry-after-ms": str(srv.config.retry_after_ms)})
+        if fault:
+            srv.count("5xx")
+            err = {"type": "api_error", "message": "mock server error"}
+            return self._send(fault, {"type": "error", "error": err} if anthropic else {"error": err})
+
+        if anthropic:
+            prompt = _text_of(req.get("system")) + "".join(_text_of(m.get("content")) for m in req.get("messages", []))
+            user = _text_of((req.get("messages") or [{}])[-1].get("content"))
+        else:
+            msgs = req.get("messages", [])
+            prompt = "".join(_text_of(m.get("content")) for m in msgs)
+            user = _text_of(msgs[-1].get("content")) if msgs else ""
+        items = _packed_items(user)
+        if items is not None:
+            out = json.dumps({"results": [{"id": i["id"], **canned_analysis(i["text"])} for i in items]})
+        else:
+            out = json.dumps(canned_analysis(_extract_headline(user))) + chatter(srv.config.chatter_words)
+        p_tok, c_tok = estimate_tokens(prompt), estimate_tokens(out)
+        model = req.get("model", "mock")
+        stream = bool(req.get("stream"))
+        if stream:
+            srv.count("streams")
+        elif srv.config.token_ms:
+            # sin streaming el cliente espera a que se genere la respuesta completa
+            time.sleep(len(_pieces(out))*srv.config.token_ms/1000)
+
+        if anthropic:
+            # sólo se cachea el bloque de sistema marcado con cache_control
+            system = req.get("system")
+            cacheable = isinstance(system, list) and any(isinstance(b, dict) and b.get("cache_control") for b in system)
+            sys_tok = estimate_tokens(_text_of(system)) if cacheable else 0
+            seen = cacheable and srv.prefix_seen(model, _text_of(system))
+            read, written = (sys_tok, 0) if seen else (0, sys_tok)
+            usage = {"input_tokens": p_tok - read - written, "output_tokens": c_tok,
+                     "cache_read_input_tokens": read, "cache_creation_input_tokens": written}
+            message = {"id": "msg_mock", "type": "message", "role": "assistant", "model": model,
+                       "stop_reason": "end_turn", "stop_sequence": None}
+            if stream:
+                return self._sse([
+                    ("message_start", {"type": "message_start", "message": {
+                        **message, "content": [], "stop_reason": None, "usage": {**usage, "output_tokens": 1}}}, False),
+                    ("content_block_start", {"type": "content_block_start", "index": 0,
+                                             "content_block": {"type": "text", "text": ""}}, False),
+                    *(("content_block_delta", {"type": "content_block_delta", "index": 0,
+                                               "delta": {"type": "text_delta", "text": p}}, True) for p in _pieces(out)),
+                    ("content_block_stop", {"type": "content_block_stop", "index": 0}, False),
+                    ("message_delta", {"type": "message_delta", "delta": {"stop_reason": "end_turn", "stop_sequence": None},
+                                       "usage": {"output_tokens": c_tok}}, False),
+                    ("message_stop", {"type": "message_stop"}, False),
+                ])
+            return self._send(200, {**message, "content": [{"type": "text", "text": out}], "usage": usage})
+        # caché automática de prefijo (OpenAI / DeepSeek): el mensaje de sistema repetido se sirve de caché
+        system = "".join(_text_of(m.get("content")) for m in msgs if m.get("role") == "system")
+        cached = estimate_tokens(system) if system and srv.prefix_seen(model, system) else 0
+        usage = {"prompt_tokens": p_tok, "completion_tokens": c_tok, "total_tokens": p_tok + c_tok,
+                 "prompt_tokens_details": {"cached_tokens": cached},
+                 "prompt_cache_hit_tokens": cached, "prompt_cache_miss_tokens": p_tok - cached}
+        head = {"id": "chatcmpl-mock", "created": int(time.time()), "model": model}
+        if stream:
+            chunk = lambda delta, finish=None: {**head, "object": "chat.completion.chunk",
+                                                "choices": [{"index": 0, "delta": delta, "finish_reason": finish, "logprobs": None}]}
+            with_usage = bool((req.get("stream_options") or {}).get("include_usage"))
+            return self._sse([
+                (None, chunk({"role": "assistant", "content": ""}), False),
+                *((None, chunk({"content": p}), True) for p in _pieces(out)),
+                (None, chunk({}, "stop"), False),
+                *([(None, {**head, "object": "chat.completion.chunk", "choices": [], "usage": usage}, False)] if with_usage else []),
+                (None, "[DONE]", False),
+            ])
+        return self._send(200, {
+            **head, "object": "chat.completion",
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": out}, "finish_reason": "stop", "logprobs": None}],
+            "usage": usage,
+        })
+
+
+class MockLLMServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, config: MockConfig, host: str = "127.0.0.1", port: int = 0):
+        super().__init__((host, port), _Handler)
+        self.config = config
+        self._latency = parse_latency(config.latency)
+        self._rng = random.Random(config.seed)
+        self._lock = threading.Lock()
+        self.counters: Dict[str, int] = {"requests": 0, "429": 0, "5xx": 0, "streams": 0, "stream_aborted": 0}
+        self._prefixes = set()
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def draw_latency(self) -> float:
+        with self._lock:
+            return self._latency()
+
+    def draw_fault(self) -> int:
+        with self._lock:
+            r = self._rng.random()
+            if r < self.config.p429:
+                return 429
+            if r < self.config.p429 + self.config.p5xx:
+                return self._rng.choice([500, 502, 503])
+            return 0
+
+    def prefix_seen(self, model: str, prefix: str) -> bool:
+        """True if this (model, prefix) was sent before; records it otherwise."""
+        key = (model, prefix)
+        with self._lock:
+            if key in self._prefixes:
+                return True
+            self._prefixes.add(key)
+            return False
+
+    def count(self, key: str) -> None:
+        with self._lock:
+            self.counters[key] += 1
+
+def start_mock_server(config: Optional[MockConfig] = None, host: str = "127.0.0.1", port: int = 0) -> MockLLMServer:
+    """Start the mock in a daemon thread; stop it with `server.shutdown()`."""
+    srv = MockLLMServer(config or MockConfig(), host, port)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    return srv
+
+def mock_env(base_url: str) -> Dict[str, str]:
+    """Variables that point the three clients at the mock (with dummy keys)."""
+    return {
+        "OPENAI_API_KEY": "mock", "ANTHROPIC_API_KEY": "mock", "DEEPSEEK_API_KEY": "mock",
+        "OPENAI_BASE_URL": f"{base_url}/v1",
+        "ANTHROPIC_BASE_URL": base_url,
+        "DEEPSEEK_BASE_URL": base_url,
+    }
+
+def use_mock_server(config: Optional[MockConfig] = None) -> MockLLMServer:
+    srv = start_mock_server(config)
+    os.environ.update(mock_env(srv.base_url))
+    return srv
+
+def main():
+    import argparse
+    ap = argparse.ArgumentParser(description="Local OpenAI/Anthropic-compatible mock LLM server.")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8089)
+    ap.add_argument("--latency", default="lognormal:300,0.4", help="fixed:MS | uniform:A,B | normal:MEAN,SD | lognormal:MEDIAN,SIGMA")
+    ap.add_argument("--p429", type=float, default=0.0)
+    ap.add_argument("--p5xx", type=float, default=0.0)
+    ap.add_argument("--retry-after-ms", type=int, default=50)
+    ap.add_argument("--seed", type=int, default=None)
+    ap.add_argument("--token-ms", type=float, default=0.0, help="pause between streamed deltas")
+    ap.add_argument("--chatter-words", type=int, default=0, help="words of explanation written after the JSON")
+    args = ap.parse_args()
+
+    cfg = MockConfig(latency=args.latency, p429=args.p429, p5xx=args.p5xx,
+                     retry_after_ms=args.retry_after_ms, seed=args.seed,
+                     token_ms=args.token_ms, chatter_words=args.chatter_words)
+    srv = MockLLMServer(cfg, args.host, args.port)
+    print(f"Mock LLM server on {srv.base_url}")
+    for k, v in mock_env(srv.base_url).items():
+        print(f"  export {k}={v}")
+    try:
+        srv.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        srv.server_close()
+        print(json.dumps(srv.counters))
+
+if __name__ == "__main__":
+    main()
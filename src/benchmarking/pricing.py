@@ -1,18 +1,20 @@
 OPENAI_PRICES = {
-    "gpt-4o-mini": {"in": 0.60/1_000_000, "out": 2.40/1_000_000},
+    # prompt caching automático: los tokens de entrada servidos desde caché cuestan la mitad
+    "gpt-4o-mini": {"in": 0.60/1_000_000, "cached_in": 0.30/1_000_000, "out": 2.40/1_000_000},
 }
 
 ANTHROPIC_PRICES = {
-    "claude-3-5-haiku":  {"in": 0.80/1_000_000, "out": 4.00/1_000_000},
-    "claude-3-5-sonnet": {"in": 3.00/1_000_000, "out": 15.00/1_000_000},
-    "claude-3-7-sonnet": {"in": 3.00/1_000_000, "out": 15.00/1_000_000},
-    "claude-sonnet-4":   {"in": 3.00/1_000_000, "out": 15.00/1_000_000},
+    # cache_control: lectura de caché 0.1x la entrada, escritura 1.25x
+    "claude-3-5-haiku":  {"in": 0.80/1_000_000, "cached_in": 0.08/1_000_000, "cache_write": 1.00/1_000_000, "out": 4.00/1_000_000},
+    "claude-3-5-sonnet": {"in": 3.00/1_000_000, "cached_in": 0.30/1_000_000, "cache_write": 3.75/1_000_000, "out": 15.00/1_000_000},
+    "claude-3-7-sonnet": {"in": 3.00/1_000_000, "cached_in": 0.30/1_000_000, "cache_write": 3.75/1_000_000, "out": 15.00/1_000_000},
+    "claude-sonnet-4":   {"in": 3.00/1_000_000, "cached_in": 0.30/1_000_000, "cache_write": 3.75/1_000_000, "out": 15.00/1_000_000},
 }
 
 DEEPSEEK_PRICES = {
     # DeepSeek distinguishes between ‘cache miss’ and ‘cache hit’ at the entry point.
     "deepseek-chat":     {"in_miss": 0.27/1_000_000, "in_hit": 0.07/1_000_000, "out": 1.10/1_000_000},
-    "deepseek-reasoner": {"in_miss": 0.55/1_000_000,                           "out": 2.19/1_000_000},
+    "deepseek-reasoner": {"in_miss": 0.55/1_000_000, "in_hit": 0.14/1_000_000, "out": 2.19/1_000_000},
 }
 
 def _match_price(table: dict, model: str):
@@ -32,5 +34,25 @@ def price_for(provider: str, model: str, *, cache_hit: bool=False):
     if p == "deepseek":
         d = _match_price(DEEPSEEK_PRICES, model) or DEEPSEEK_PRICES["deepseek-chat"]
         in_price = d.get("in_hit" if cache_hit and "in_hit" in d else "in_miss")
-        return {"in": in_price, "out": d["out"]}
-    return None
\ No newline at end of file
+        return {"in": in_price, "cached_in": d.get("in_hit", d["in_miss"]), "out": d["out"]}
+    if p == "local":
+        # inferencia en CPU propia: sin coste marginal por token
+        return {"in": 0.0, "cached_in": 0.0, "out": 0.0}
+    return None
+
+def cost_breakdown(price: dict, usage: dict):
+    """Cost split by token class from a normalized usage dict: `prompt` (all input tokens,
+    cached included), `cached_prompt` (read from the provider's prompt cache), `cache_write`
+    (Anthropic cache creation) and `completion`. None if prompt/completion are unknown."""
+    if not price or usage.get("prompt") is None or usage.get("completion") is None:
+        return None
+    cached = usage.get("cached_prompt") or 0
+    written = usage.get("cache_write") or 0
+    out = {
+        "input_uncached": (usage["prompt"] - cached - written)*price["in"],
+        "input_cached": cached*price.get("cached_in", price["in"]),
+        "cache_write": written*price.get("cache_write", price["in"]),
+        "output": usage["completion"]*price["out"],
+    }
+    out["total"] = sum(out.values())
+    return out
\ No newline at end of file
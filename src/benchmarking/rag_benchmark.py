@@ -0,0 +1,60 @@
+import time, statistics
+from typing import Callable, Dict, List
+from src.benchmarking.benchmark import SAMPLE
+from src.pipelines.rag_index import BACKENDS, build_or_load_index, load_index, make_retriever
+
+def _per_query_rebuild(query: str, k: int = 3) -> List[str]:
+    # Comportamiento anterior: cliente Chroma + índice nuevos en cada consulta, sin la
+    # sincronización con el KB (que no existía) ni la síntesis del query engine
+    index = load_index()
+    nodes = index.as_retriever(similarity_top_k=k).retrieve(query)
+    return [n.get_text() for n in nodes[:k]]
+
+def _timed(fn: Callable[[str], List[str]], texts: List[str], rounds: int) -> Dict[str, float]:
+    lat = []
+    for _ in range(rounds):
+        for t in texts:
+            start = time.perf_counter()
+            fn(t)
+            lat.append((time.perf_counter()-start)*1000)
+    lat.sort()
+    return {
+        "n": len(lat),
+        "mean_ms": round(statistics.mean(lat), 2),
+        "p50_ms": round(lat[len(lat)//2], 2),
+        "max_ms": round(lat[-1], 2),
+    }
+
+def main():
+    import argparse
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--texts", nargs="*", default=SAMPLE)
+    ap.add_argument("--rounds", type=int, default=5)
+    ap.add_argument("--data-dir", default="kb")
+    ap.add_argument("--backends", nargs="+", default=list(BACKENDS), choices=BACKENDS)
+    ap.add_argument("--skip-rebuild", action="store_true", help="do not time the rebuild-per-query baseline")
+    args = ap.parse_args()
+
+    print("\n== RAG retrieval latency per query ==")
+    before = None
+    if not args.skip_rebuild and "llamaindex" in args.backends:
+        build_or_load_index(args.data_dir)
+        before = _timed(_per_query_rebuild, args.texts, args.rounds)
+        print(f"before (rebuild per query): {before}")
+    for backend in args.backends:
+        retriever = make_retriever(args.data_dir, backend=backend)
+        start = time.perf_counter()
+        retriever.warm_up()
+        warm_ms = (time.perf_counter()-start)*1000
+        after = _timed(retriever.retrieve, args.texts, args.rounds)
+        # lote completo en una sola llamada (una multiplicación de matrices en el backend numpy)
+        start = time.perf_counter()
+        retriever.retrieve_batch(args.texts*args.rounds)
+        batch_ms = (time.perf_counter()-start)*1000/max(1, len(args.texts)*args.rounds)
+        retriever.close()
+        print(f"{backend:>10} (cached retriever): {after}  batched: {batch_ms:.3f} ms/query  warm-up: {warm_ms:.1f} ms")
+        if before and after["mean_ms"] > 0:
+            print(f"{'':>10} speed-up vs rebuild (mean): x{before['mean_ms']/after['mean_ms']:.1f}")
+
+if __name__ == "__main__":
+    main()
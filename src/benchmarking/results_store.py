@@ -0,0 +1,295 @@
+import os, sys, json, sqlite3, platform, subprocess
+from dataclasses import dataclass, asdict
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import numpy as np
+
+# Histórico de ejecuciones (benchmark/loadtest) en SQLite: metadatos por run + una fila por petición
+RESULTS_DB = "benchmarks/results.sqlite"
+SDK_PACKAGES = ("openai", "anthropic", "httpx", "tenacity", "numpy")
+# variables que describen la configuración de la ejecución (nunca claves)
+ENV_PREFIXES = ("LLM_", "ROUTER_", "BREAKER_", "CASCADE_", "ENSEMBLE_", "RAG_", "HEDGE_")
+ENV_SECRET_MARKERS = ("KEY", "TOKEN", "SECRET")
+# claves de config que cambian lo que se mide (destinos, carga, mock): una baseline móvil solo
+# agrupa runs con los mismos valores; duración, nº de peticiones o de textos no cuentan
+CONFIG_KEYS = ("targets", "providers", "load", "concurrency", "pack", "cache", "mock")
+
+REQUEST_COLUMNS = ("target", "provider", "model", "ok", "parse_ok", "error_type", "latency_ms",
+                   "cost_usd", "prompt_tokens", "cached_prompt_tokens")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY, kind TEXT NOT NULL, ts REAL NOT NULL,
+    git_rev TEXT, git_dirty INTEGER, host TEXT, python TEXT,
+    config TEXT, models TEXT, packages TEXT, env TEXT, n INTEGER
+);
+CREATE TABLE IF NOT EXISTS requests (
+    run_id TEXT NOT NULL REFERENCES runs(run_id), seq INTEGER NOT NULL,
+    target TEXT, provider TEXT, model TEXT, ok INTEGER, parse_ok INTEGER, error_type TEXT,
+    latency_ms REAL, cost_usd REAL, prompt_tokens INTEGER, cached_prompt_tokens INTEGER, extra TEXT,
+    PRIMARY KEY (run_id, seq)
+);
+CREATE INDEX IF NOT EXISTS requests_target ON requests(run_id, target);
+CREATE INDEX IF NOT EXISTS runs_kind_ts ON runs(kind, ts);
+"""
+
+def _git(*args: str) -> Optional[str]:
+    try:
+        out = subprocess.run(["git", *args], capture_output=True, text=True, timeout=5)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return out.stdout.strip() if out.returncode == 0 else None
+
+def run_metadata() -> Dict[str, Any]:
+    """Git revision, host, interpreter, SDK versions and the non-secret tuning env vars."""
+    from importlib import metadata
+    packages = {}
+    for p in SDK_PACKAGES:
+        try:
+            packages[p] = metadata.version(p)
+        except metadata.PackageNotFoundError:
+            pass
+    status = _git("status", "--porcelain", "--untracked-files=no")
+    return {
+        "git_rev": _git("rev-parse", "HEAD"),
+        "git_dirty": None if status is None else int(bool(status)),
+        "host": platform.node(),
+        "python": platform.python_version(),
+        "packages": packages,
+        "env": {k: v for k, v in sorted(os.environ.items())
+                if k.startswith(ENV_PREFIXES) and not any(m in k for m in ENV_SECRET_MARKERS)},
+    }
+
+
+class ResultsStore:
+    """Append-only store of benchmark runs (RESULTS_DB, SQLite)."""
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or os.getenv("RESULTS_DB", RESULTS_DB)
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(self.path)
+        self._db.row_factory = sqlite3.Row
+        self._db.executescript(_SCHEMA)
+
+    def close(self) -> None:
+        self._db.close()
+
+    def record_run(self, kind: str, rows: Sequence[Dict[str, Any]], config: Optional[Dict[str, Any]] = None,
+                   run_id: Optional[str] = None) -> str:
+        """Store one run and its per-request rows; returns the run id."""
+        ts = datetime.now(timezone.utc)
+        run_id = run_id or f"{kind}-{ts.strftime('%Y%m%dT%H%M%S.%fZ')}"
+        meta = run_metadata()
+        models = sorted({f"{r.get('provider') or r.get('target')}:{r['model']}" for r in rows if r.get("model")})
+        with self._db:
+            self._db.execute(
+                "INSERT INTO runs VALUES (?,?,?,?,?,?,?,?,?,?,?,?)",
+                (run_id, kind, ts.timestamp(), meta["git_rev"], meta["git_dirty"], meta["host"], meta["python"],
+                 json.dumps(config or {}), json.dumps(models), json.dumps(meta["packages"]), json.dumps(meta["env"]),
+                 len(rows)),
+            )
+            self._db.executemany(
+                "INSERT INTO requests VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?)",
+                [(run_id, i, r.get("target") or r.get("provider"), r.get("provider"), r.get("model"),
+                  _bool(r.get("ok")), _bool(r.get("parse_ok")), r.get("error_type"), r.get("latency_ms"),
+                  r.get("cost_usd"), r.get("prompt_tokens"), r.get("cached_prompt_tokens"),
+                  json.dumps({k: v for k, v in r.items() if k not in REQUEST_COLUMNS}, default=str))
+                 for i, r in enumerate(rows)],
+            )
+        return run_id
+
+    def runs(self, kind: Optional[str] = None, limit: int = 20, before: Optional[float] = None) -> List[Dict[str, Any]]:
+        """Most recent runs first."""
+        q, args = "SELECT * FROM runs WHERE 1=1", []
+        if kind:
+            q += " AND kind = ?"; args.append(kind)
+        if before is not None:
+            q += " AND ts < ?"; args.append(before)
+        q += " ORDER BY ts DESC LIMIT ?"; args.append(limit)
+        return [_run(r) for r in self._db.execute(q, args)]
+
+    def baseline_runs(self, cand: Dict[str, Any], limit: int) -> Tuple[List[Dict[str, Any]], int]:
+        """Up to `limit` runs of the candidate's kind before it with the same config (CONFIG_KEYS),
+        most recent first, and how many earlier runs were skipped for a different config."""
+        key = config_key(cand["config"])
+        same, skipped = [], 0
+        q = "SELECT * FROM runs WHERE kind = ? AND ts < ? ORDER BY ts DESC"
+        for r in self._db.execute(q, (cand["kind"], cand["ts"])):
+            r = _run(r)
+            if config_key(r["config"]) != key:
+                skipped += 1
+            elif len(same) < limit:
+                same.append(r)
+            else:
+                break
+        return same, skipped
+
+    def run(self, run_id: str) -> Dict[str, Any]:
+        if run_id == "latest":
+            rows = self.runs(limit=1)
+            if not rows:
+                raise KeyError("no runs stored")
+            return rows[0]
+        r = self._db.execute("SELECT * FROM runs WHERE run_id = ?", (run_id,)).fetchone()
+        if r is None:
+            raise KeyError(run_id)
+        return _run(r)
+
+    def rows(self, run_ids: Sequence[str]) -> List[Dict[str, Any]]:
+        marks = ",".join("?"*len(run_ids))
+        cur = self._db.execute(f"SELECT * FROM requests WHERE run_id IN ({marks}) ORDER BY run_id, seq", list(run_ids))
+        return [dict(r) for r in cur]
+
+def config_key(config: Dict[str, Any]) -> str:
+    return json.dumps({k: config.get(k) for k in CONFIG_KEYS}, sort_keys=True, default=str)
+
+def _bool(v) -> Optional[int]:
+    return None if v is None else int(bool(v))
+
+def _run(r: sqlite3.Row) -> Dict[str, Any]:
+    d = dict(r)
+    for k in ("config", "models", "packages", "env"):
+        d[k] = json.loads(d[k]) if d.get(k) else {}
+    return d
+
+
+# ---- comparación ----
+@dataclass
+class Thresholds:
+    """Largest tolerated worsening before a change counts as a regression.
+
+    Latency and cost are relative (0.10 = +10 %); parse failures are absolute
+    (0.01 = one percentage point)."""
+    p50: float = 0.10
+    p90: float = 0.15
+    p99: float = 0.25
+    cost: float = 0.05
+    parse_fail: float = 0.01
+
+    @classmethod
+    def from_env(cls) -> "Thresholds":
+        d = cls()
+        return cls(**{k: float(os.getenv(f"BENCH_MAX_{k.upper()}_REGRESSION", v)) for k, v in asdict(d).items()})
+
+METRICS = ("p50", "p90", "p99", "cost", "parse_fail")
+
+def _stats(lat: np.ndarray, cost: np.ndarray, parse_ok: np.ndarray) -> np.ndarray:
+    """(..., 5) array: p50, p90, p99 latency, mean cost per item, parse-failure rate.
+    The last axis indexes resamples when the inputs are 2-D."""
+    p = np.percentile(lat, [50, 90, 99], axis=-1) if lat.shape[-1] else np.full((3,) + lat.shape[:-1], np.nan)
+    c = cost.mean(axis=-1) if cost.shape[-1] else np.full(cost.shape[:-1], np.nan)
+    f = 1 - parse_ok.mean(axis=-1) if parse_ok.shape[-1] else np.full(parse_ok.shape[:-1], np.nan)
+    return np.stack([p[0], p[1], p[2], c, f], axis=-1)
+
+def _arrays(rows: List[Dict[str, Any]]):
+    # latencia sólo de las peticiones correctas, como en loadtest.summarize
+    lat = np.array([r["latency_ms"] for r in rows if r["ok"] and r["latency_ms"] is not None], dtype=float)
+    cost = np.array([r["cost_usd"] or 0.0 for r in rows], dtype=float)
+    parse_ok = np.array([bool(r["parse_ok"]) if r["parse_ok"] is not None else bool(r["ok"]) for r in rows], dtype=float)
+    return lat, cost, parse_ok
+
+def _boot(a: np.ndarray, n_boot: int, rng: np.random.Generator) -> np.ndarray:
+    if not len(a):
+        return np.zeros((n_boot, 0))
+    return a[rng.integers(0, len(a), size=(n_boot, len(a)))]
+
+def compare_rows(base: List[Dict[str, Any]], cand: List[Dict[str, Any]], thresholds: Optional[Thresholds] = None,
+                 n_boot: int = 2000, alpha: float = 0.05, seed: int = 0) -> Dict[str, Any]:
+    """Per target and metric: baseline and candidate values, relative change and a bootstrap
+    (1-alpha) confidence interval of the difference.
+
+    A change is significant when the interval excludes 0, and a regression when it is
+    significant, worse and beyond its threshold.
+    """
+    thresholds = thresholds or Thresholds()
+    rng = np.random.default_rng(seed)
+    limits = asdict(thresholds)
+    out: Dict[str, Any] = {}
+    for target in sorted({r["target"] for r in base} & {r["target"] for r in cand}):
+        b = _arrays([r for r in base if r["target"] == target])
+        c = _arrays([r for r in cand if r["target"] == target])
+        point_b, point_c = _stats(*b), _stats(*c)
+        diffs = _stats(*(_boot(x, n_boot, rng) for x in c)) - _stats(*(_boot(x, n_boot, rng) for x in b))
+        lo, hi = np.nanpercentile(diffs, [100*alpha/2, 100*(1 - alpha/2)], axis=0) if n_boot else (diffs, diffs)
+        metrics = {}
+        for i, m in enumerate(METRICS):
+            vb, vc = float(point_b[i]), float(point_c[i])
+            change = vc - vb if m == "parse_fail" else ((vc - vb)/vb if vb else (0.0 if vc == vb else float("inf")))
+            significant = bool(lo[i] > 0 or hi[i] < 0)
+            metrics[m] = {
+                "base": _r(vb), "cand": _r(vc), "change": _r(change),
+                "ci": [_r(float(lo[i])), _r(float(hi[i]))],
+                "significant": significant,
+                "regression": bool(significant and change > limits[m]),
+            }
+        out[target] = {"n_base": len(b[1]), "n_cand": len(c[1]), "metrics": metrics}
+    return out
+
+def _r(v: float) -> Optional[float]:
+    return None if v is None or np.isnan(v) else round(v, 6)
+
+def regressions(report: Dict[str, Any]) -> List[str]:
+    return [f"{t}.{m}" for t, r in report.items() for m, v in r["metrics"].items() if v["regression"]]
+
+
+def main():
+    import argparse
+    ap = argparse.ArgumentParser(description="Benchmark history: list runs and compare them.")
+    ap.add_argument("--db", default=None, help=f"default: RESULTS_DB or {RESULTS_DB}")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    ls = sub.add_parser("list", help="most recent runs")
+    ls.add_argument("--kind", default=None)
+    ls.add_argument("--limit", type=int, default=20)
+    cmp_ = sub.add_parser("compare", help="candidate run vs a baseline run or a rolling baseline; exit 1 on regression")
+    cmp_.add_argument("candidate", nargs="?", default="latest")
+    base = cmp_.add_mutually_exclusive_group()
+    base.add_argument("--against", default=None, help="baseline run id")
+    base.add_argument("--rolling", type=int, default=5,
+                      help="pool the previous N runs of the same kind and config (targets, load, mock...; default)")
+    d = Thresholds.from_env()
+    for m in METRICS:
+        cmp_.add_argument(f"--max-{m.replace('_', '-')}", type=float, default=getattr(d, m), dest=m,
+                          help=f"allowed worsening (default {getattr(d, m)}{' absolute' if m == 'parse_fail' else ' relative'})")
+    cmp_.add_argument("--bootstrap", type=int, default=2000)
+    cmp_.add_argument("--alpha", type=float, default=0.05)
+    cmp_.add_argument("--json", action="store_true")
+    args = ap.parse_args()
+
+    store = ResultsStore(args.db)
+    if args.cmd == "list":
+        for r in store.runs(args.kind, args.limit):
+            when = datetime.fromtimestamp(r["ts"], timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+            rev = (r["git_rev"] or "-")[:10] + ("*" if r["git_dirty"] else "")
+            print(f"{r['run_id']:<40} {r['kind']:<10} {when}  {rev:<12} n={r['n']:<6} {json.dumps(r['config'])}")
+        return
+
+    cand = store.run(args.candidate)
+    if args.against:
+        base_ids = [store.run(args.against)["run_id"]]
+    else:
+        same, skipped = store.baseline_runs(cand, args.rolling)
+        base_ids = [r["run_id"] for r in same]
+        if skipped:
+            print(f"warning: skipped {skipped} earlier {cand['kind']} run(s) with a different config "
+                  f"than {cand['run_id']}", file=sys.stderr)
+    if not base_ids:
+        print(f"no baseline runs before {cand['run_id']} with the same config")
+        sys.exit(2)
+    report = compare_rows(store.rows(base_ids), store.rows([cand["run_id"]]),
+                          Thresholds(**{m: getattr(args, m) for m in METRICS}), args.bootstrap, args.alpha)
+    bad = regressions(report)
+    if args.json:
+        print(json.dumps({"candidate": cand["run_id"], "baseline": base_ids, "report": report, "regressions": bad}, indent=2))
+    else:
+        print(f"candidate: {cand['run_id']}  baseline: {', '.join(base_ids)}")
+        for target, r in report.items():
+            print(f"\n== {target} (n={r['n_base']} -> {r['n_cand']}) ==")
+            for m, v in r["metrics"].items():
+                flag = "REGRESSION" if v["regression"] else ("changed" if v["significant"] else "")
+                print(f"  {m:>10}: {v['base']} -> {v['cand']}  change={v['change']}  ci={v['ci']}  {flag}")
+    if bad:
+        print(f"\nRegressions: {', '.join(bad)}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+import os, sys, json, time, subprocess
+from typing import Dict, List
+import numpy as np
+
+# Cada escenario se ejecuta en un intérprete nuevo: mide arranque en frío (imports + construcción)
+HEAVY = ["openai", "anthropic", "tenacity", "httpx", "llama_index", "chromadb"]
+
+SCENARIOS: Dict[str, str] = {
+    "python": "pass",
+    "import_analyzer": "import src.pipelines.news_analyzer",
+    "stub_run": (
+        "import asyncio\n"
+        "from src.pipelines.news_analyzer import FinancialNewsAnalyzer\n"
+        "asyncio.run(FinancialNewsAnalyzer().analyze_sentiment('Acme beats estimates', provider='stub'))"
+    ),
+    "one_client": (
+        "from src.orchestrator.multimodel_analyzer import MultiModelAnalyzer\n"
+        "MultiModelAnalyzer(cache=False)._clients['openai']"
+    ),
+}
+
+_PROBE = "\nimport sys, json\nprint(json.dumps(sorted(m for m in {heavy} if m in sys.modules)))"
+
+def run_scenario(code: str, repeats: int = 5) -> Dict:
+    """Wall time (ms) of a fresh `python -c code` and the heavy modules it ended up importing."""
+    env = {**os.environ, "PYTHONDONTWRITEBYTECODE": "1"}
+    times, loaded = [], []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        out = subprocess.run([sys.executable, "-c", code + _PROBE.format(heavy=HEAVY)],
+                             capture_output=True, text=True, env=env)
+        times.append((time.perf_counter() - start)*1000)
+        if out.returncode != 0:
+            return {"error": out.stderr.strip().splitlines()[-1] if out.stderr else f"exit {out.returncode}"}
+        loaded = json.loads(out.stdout.strip().splitlines()[-1])
+    t = np.array(times)
+    return {"median_ms": round(float(np.median(t)), 1), "min_ms": round(float(t.min()), 1),
+            "max_ms": round(float(t.max()), 1), "heavy_modules": loaded}
+
+def main():
+    import argparse
+    ap = argparse.ArgumentParser(description="Cold-start (import + construction) time per scenario.")
+    ap.add_argument("--scenarios", nargs="+", default=list(SCENARIOS), choices=list(SCENARIOS))
+    ap.add_argument("--repeats", type=int, default=5)
+    args = ap.parse_args()
+
+    rows: List[Dict] = []
+    for name in args.scenarios:
+        res = run_scenario(SCENARIOS[name], args.repeats)
+        rows.append({"scenario": name, **res})
+        print(rows[-1])
+    base = next((r.get("median_ms") for r in rows if r["scenario"] == "python"), None)
+    if base:
+        print("\n== Over bare interpreter ==")
+        for r in rows:
+            if r.get("median_ms") is not None and r["scenario"] != "python":
+                print(f"{r['scenario']:>16}: +{r['median_ms'] - base:.1f} ms")
+
+if __name__ == "__main__":
+    main()
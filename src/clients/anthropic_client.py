@@ -1,105 +1,193 @@
-import os, asyncio, json, re, time
-from typing import Dict, Any, Optional
+import os, json, re, time
+from types import SimpleNamespace
+from typing import Dict, Any, List, Optional
 from tenacity import retry, wait_exponential, stop_after_attempt, retry_if_exception_type
 import anthropic
-from src.benchmarking.pricing import price_for
+from src.benchmarking.pricing import cost_breakdown, price_for
+from src.clients.base import SYSTEM_INSTR
+from src.clients.registry import default_model
+from src.clients.packing import analyze_pack_with, run_packed
+from src.clients.streaming import analyze_streamed, estimated_usage, read_json_stream, stream_enabled
+from src.clients.transport import shared_http_client
+from src.observability.metrics import on_retry, span
 
 class AnthropicClient:
-    def __init__(self, model: Optional[str] = None):
+    def __init__(self, model: Optional[str] = None, base_url: Optional[str] = None):
         self.api_key = os.getenv("ANTHROPIC_API_KEY")
-        self.model = model or os.getenv("ANTHROPIC_MODEL", "claude-3-5-haiku-latest")
-        self.client = anthropic.Anthropic(api_key=self.api_key) if self.api_key else None
+        self.model = model or default_model("anthropic")
+        self.base_url = base_url or os.getenv("ANTHROPIC_BASE_URL")
+        self.stream = stream_enabled("anthropic")
+        self.client = None
+        self._http = None
         self.price = price_for("anthropic", self.model)
 
+    def _client(self) -> anthropic.AsyncAnthropic:
+        http = shared_http_client("anthropic", anthropic.DefaultAsyncHttpxClient)
+        client = self.client
+        # se devuelve la referencia local: otro loop puede sustituir self.client entretanto
+        if client is None or self._http is not http:
+            client = anthropic.AsyncAnthropic(api_key=self.api_key, base_url=self.base_url, http_client=http)
+            self.client, self._http = client, http
+        return client
+
     def _instr(self) -> str:
-        return (
-            "You are a financial NLP assistant. "
-            "Respond ONLY with a valid JSON object using these fields: "
-            "sentiment (bullish|bearish|neutral), confidence (0..1), "
-            "key_entities (array of strings), impact_score (0..1)."
-        )
+        return SYSTEM_INSTR
+
+    @staticmethod
+    def _system(text: str):
+        # bloque de sistema marcado como cacheable: las llamadas siguientes leen el prefijo de caché
+        return [{"type": "text", "text": text, "cache_control": {"type": "ephemeral"}}]
 
     # Estilo 1: system + bloques (SDKs recientes)
     @retry(wait=wait_exponential(min=1, max=10), stop=stop_after_attempt(3),
-           retry=retry_if_exception_type((TypeError, anthropic.RateLimitError)))
-    def _call_style1(self, user_text: str):
+           retry=retry_if_exception_type((TypeError, anthropic.RateLimitError)),
+           before_sleep=on_retry("anthropic"))
+    async def _call_style1(self, user_text: str):
         start = time.perf_counter()
-        resp = self.client.messages.create(
-            model=self.model,
-            system=self._instr(),
-            max_tokens=200,
-            temperature=0,
-            messages=[{"role":"user","content":[{"type":"text","text": user_text}]}],
-        )
+        with span("llm.attempt", provider="anthropic", model=self.model):
+            resp = await self._client().messages.create(
+                model=self.model,
+                system=self._system(self._instr()),
+                max_tokens=200,
+                temperature=0,
+                messages=[{"role":"user","content":[{"type":"text","text": user_text}]}],
+            )
         return resp, (time.perf_counter()-start)*1000
 
     # Estilo 2: sin 'system', instrucciones inyectadas en el contenido (string)
-    def _call_style2(self, user_text: str):
+    async def _call_style2(self, user_text: str):
         start = time.perf_counter()
         merged = f"{self._instr()}\n\nAnalyze this financial text strictly as JSON:\n---\n{user_text}\n---"
-        resp = self.client.messages.create(
-            model=self.model,
-            max_tokens=200,
-            temperature=0,
-            messages=[{"role":"user","content": merged}],
-        )
+        with span("llm.attempt", provider="anthropic", model=self.model):
+            resp = await self._client().messages.create(
+                model=self.model,
+                max_tokens=200,
+                temperature=0,
+                messages=[{"role":"user","content": merged}],
+            )
         return resp, (time.perf_counter()-start)*1000
 
     # Estilo 3: bloques pero sin 'system' (otra variante aceptada por SDK intermedios)
-    def _call_style3(self, user_text: str):
+    async def _call_style3(self, user_text: str):
         start = time.perf_counter()
         merged = f"{self._instr()}\n\nAnalyze this financial text strictly as JSON:\n---\n{user_text}\n---"
-        resp = self.client.messages.create(
-            model=self.model,
-            max_tokens=200,
-            temperature=0,
-            messages=[{"role":"user","content":[{"type":"text","text": merged}]}],
-        )
+        with span("llm.attempt", provider="anthropic", model=self.model):
+            resp = await self._client().messages.create(
+                model=self.model,
+                max_tokens=200,
+                temperature=0,
+                messages=[{"role":"user","content":[{"type":"text","text": merged}]}],
+            )
         return resp, (time.perf_counter()-start)*1000
 
+    # Streaming (estilo 1): el stream se cierra en cuanto el JSON está completo
+    @retry(wait=wait_exponential(min=1, max=10), stop=stop_after_attempt(3),
+           retry=retry_if_exception_type(anthropic.RateLimitError),
+           before_sleep=on_retry("anthropic"))
+    async def _call_stream(self, user_text: str, max_tokens: int = 200):
+        start = time.perf_counter()
+        usage = {}
+        with span("llm.attempt", provider="anthropic", model=self.model, stream=True):
+            stream = await self._client().messages.create(
+                model=self.model,
+                system=self._system(self._instr()),
+                max_tokens=max_tokens,
+                temperature=0,
+                messages=[{"role":"user","content":[{"type":"text","text": user_text}]}],
+                stream=True,
+            )
+            try:
+                out = await read_json_stream(self._deltas(stream, usage), start, "anthropic", self.model)
+            finally:
+                await stream.close()
+        return out, usage
+
+    @staticmethod
+    async def _deltas(stream, usage):
+        # message_start trae el usage de entrada (caché incluida); message_delta, los tokens de salida
+        async for ev in stream:
+            kind = getattr(ev, "type", None)
+            if kind == "message_start":
+                usage["start"] = ev.message.usage
+            elif kind == "content_block_delta":
+                yield getattr(ev.delta, "text", None) or ""
+            elif kind == "message_delta":
+                usage["output_tokens"] = getattr(ev.usage, "output_tokens", None)
+
+    # Paquete de titulares: system propio y max_tokens según el número de ítems
+    @retry(wait=wait_exponential(min=1, max=10), stop=stop_after_attempt(3),
+           retry=retry_if_exception_type(anthropic.RateLimitError),
+           before_sleep=on_retry("anthropic"))
+    async def _call_packed(self, system: str, user_text: str, max_tokens: int):
+        start = time.perf_counter()
+        with span("llm.attempt", provider="anthropic", model=self.model):
+            resp = await self._client().messages.create(
+                model=self.model,
+                system=self._system(system),
+                max_tokens=max_tokens,
+                temperature=0,
+                messages=[{"role":"user","content":[{"type":"text","text": user_text}]}],
+            )
+        return resp, (time.perf_counter()-start)*1000
+
+    @staticmethod
+    def _text(resp) -> str:
+        # Extraer texto de bloques (SDKs Claude 3.x)
+        text = ""
+        if hasattr(resp, "content"):
+            for b in resp.content:
+                t = getattr(b, "text", None)
+                if t: text += t
+        if not text and hasattr(resp, "message"):
+            text = getattr(resp.message, "content", "") or ""
+        return text
+
+    def _usage_cost(self, resp):
+        # input_tokens excluye lo leído/escrito en caché: "prompt" es la suma de las tres partes
+        u = getattr(resp, "usage", None)
+        read = getattr(u, "cache_read_input_tokens", None) or 0
+        written = getattr(u, "cache_creation_input_tokens", None) or 0
+        usage = {
+            "prompt": (getattr(u, "input_tokens", 0) or 0) + read + written,
+            "cached_prompt": read,
+            "cache_write": written,
+            "completion": getattr(u, "output_tokens", None),
+            "total": ((getattr(u, "input_tokens", 0) or 0) + read + written + (getattr(u, "output_tokens", 0) or 0)),
+        } if u else {}
+        breakdown = cost_breakdown(self.price, usage)
+        return usage, breakdown
+
     async def analyze(self, prompt: str) -> Dict[str, Any]:
         if not self.api_key:
             return {"ok": False, "provider":"anthropic", "error":"ANTHROPIC_API_KEY missing"}
+        if self.stream:
+            return await self.analyze_stream(prompt)
         try:
             # Intento 1
             try:
-                resp, latency_ms = await asyncio.to_thread(self._call_style1, prompt)
+                resp, latency_ms = await self._call_style1(prompt)
             except TypeError:
                 # Intento 2
                 try:
-                    resp, latency_ms = await asyncio.to_thread(self._call_style2, prompt)
+                    resp, latency_ms = await self._call_style2(prompt)
                 except Exception:
                     # Intento 3
-                    resp, latency_ms = await asyncio.to_thread(self._call_style3, prompt)
+                    resp, latency_ms = await self._call_style3(prompt)
 
-            # Extraer texto de bloques (SDKs Claude 3.x)
-            text = ""
-            if hasattr(resp, "content"):
-                for b in resp.content:
-                    t = getattr(b, "text", None)
-                    if t: text += t
-            if not text and hasattr(resp, "message"):
-                text = getattr(resp.message, "content", "") or ""
+            text = self._text(resp)
 
             # Parse robusto
-            parsed = None
-            try:
-                parsed = json.loads(text)
-            except Exception:
-                m = re.search(r"\{.*\}", text, re.S)
-                if m: parsed = json.loads(m.group(0))
+            with span("llm.parse", provider="anthropic", model=self.model):
+                parsed = None
+                try:
+                    parsed = json.loads(text)
+                except Exception:
+                    m = re.search(r"\{.*\}", text, re.S)
+                    if m: parsed = json.loads(m.group(0))
 
             # Usage + coste
-            u = getattr(resp, "usage", None)
-            usage = {
-                "prompt": getattr(u, "input_tokens", None),
-                "completion": getattr(u, "output_tokens", None),
-                "total": ((getattr(u, "input_tokens", 0) or 0) + (getattr(u, "output_tokens", 0) or 0)),
-            } if u else {}
-
-            cost = None
-            if self.price and usage.get("prompt") is not None and usage.get("completion") is not None:
-                cost = usage["prompt"]*self.price["in"] + usage["completion"]*self.price["out"]
+            usage, breakdown = self._usage_cost(resp)
+            cost = breakdown["total"] if breakdown else None
 
             return {
                 "ok": True,
@@ -110,6 +198,47 @@ class AnthropicClient:
                 "usage": usage,
                 "latency_ms": round(latency_ms, 1),
                 "cost_usd": round(cost, 6) if cost is not None else None,
+                "cost_breakdown": {k: round(v, 8) for k, v in breakdown.items()} if breakdown else None,
             }
         except Exception as e:
             return {"ok": False, "provider": "anthropic", "model": self.model, "error": str(e), "error_type": type(e).__name__}
+
+    def _stream_usage_cost(self, out, su):
+        start_u = su.get("start")
+        if start_u is None:
+            return None
+        # sin message_delta (stream cortado) los tokens de salida se estiman
+        out_tok = su.get("output_tokens")
+        estimated = out_tok is None
+        if estimated:
+            out_tok = estimated_usage("", out.text)["completion"]
+        usage, breakdown = self._usage_cost(SimpleNamespace(usage=SimpleNamespace(
+            input_tokens=getattr(start_u, "input_tokens", 0),
+            cache_read_input_tokens=getattr(start_u, "cache_read_input_tokens", None),
+            cache_creation_input_tokens=getattr(start_u, "cache_creation_input_tokens", None),
+            output_tokens=out_tok,
+        )))
+        if estimated:
+            usage["estimated"] = True
+        return usage, breakdown
+
+    async def analyze_stream(self, prompt: str) -> Dict[str, Any]:
+        """Streamed `analyze`: stops reading once the JSON object is complete and valid."""
+        if not self.api_key:
+            return {"ok": False, "provider":"anthropic", "error":"ANTHROPIC_API_KEY missing"}
+        return await analyze_streamed("anthropic", self.model, self.price, f"{self._instr()}{prompt}",
+                                      lambda: self._call_stream(prompt), self._stream_usage_cost)
+
+    async def analyze_pack(self, texts: List[str]) -> List[Dict[str, Any]]:
+        """One request for several headlines; one result per text (missing items have ok=False)."""
+        if not self.api_key:
+            return [{"ok": False, "provider": "anthropic", "error": "ANTHROPIC_API_KEY missing"} for _ in texts]
+
+        async def call(system: str, user: str, max_tokens: int):
+            resp, latency_ms = await self._call_packed(system, user, max_tokens)
+            return (self._text(resp), *self._usage_cost(resp), latency_ms)
+
+        return await analyze_pack_with("anthropic", self.model, texts, call)
+
+    async def analyze_packed(self, texts: List[str], max_items: Optional[int] = None) -> List[Dict[str, Any]]:
+        return await run_packed(texts, self.analyze_pack, self.analyze, max_items=max_items)
@@ -1,6 +1,20 @@
 from typing import Dict, Any, Protocol
 
+# Subir cuando cambie la instrucción de sistema o el esquema JSON: invalida las respuestas cacheadas
+PROMPT_VERSION = "v1"
+
+# Prefijo estático idéntico en todas las llamadas (va siempre primero, el titular al final):
+# es lo que el prompt caching de cada proveedor puede reutilizar entre peticiones
+SYSTEM_INSTR = (
+    "You are a financial NLP assistant. "
+    "Respond ONLY with a valid JSON object using these fields: "
+    "sentiment (bullish|bearish|neutral), confidence (0..1), "
+    "key_entities (array of strings), impact_score (0..1)."
+)
+
 class LLMClient(Protocol):
+    model: str
+
     async def analyze(self, prompt: str) -> Dict[str, Any]:
         ...
 
@@ -8,3 +22,15 @@ def env_keys_status() -> Dict[str, str]:
     import os
     keys = ["OPENAI_API_KEY","ANTHROPIC_API_KEY","DEEPSEEK_API_KEY"]
     return {k: ("set" if os.getenv(k) else "missing") for k in keys}
+
+SENTIMENTS = {"bullish", "bearish", "neutral"}
+
+def validate_sentiment(parsed: Any) -> bool:
+    """True if `parsed` follows the sentiment/confidence/key_entities/impact_score schema."""
+    if not isinstance(parsed, dict) or parsed.get("sentiment") not in SENTIMENTS:
+        return False
+    for field in ("confidence", "impact_score"):
+        v = parsed.get(field)
+        if not isinstance(v, (int, float)) or isinstance(v, bool) or not 0 <= v <= 1:
+            return False
+    return isinstance(parsed.get("key_entities", []), list)
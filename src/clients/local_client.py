@@ -0,0 +1,294 @@
+import os, json, time, asyncio, threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+from src.clients.registry import default_model
+from src.observability.metrics import observe, span
+
+# Proveedor local: clasificador de secuencias (transformers) en CPU, sin coste por llamada.
+# Las peticiones concurrentes se agrupan en micro-lotes: una pasada del modelo por lote.
+
+# nombre de etiqueta del modelo -> sentimiento (FinBERT y similares)
+LABEL_ALIASES = {
+    "positive": "bullish", "bullish": "bullish", "pos": "bullish",
+    "negative": "bearish", "bearish": "bearish", "neg": "bearish",
+    "neutral": "neutral", "neu": "neutral",
+}
+# etiquetas genéricas LABEL_i (modelos sin id2label): orden negativo -> positivo
+ORDERED_LABELS = {2: ("bearish", "bullish"), 3: ("bearish", "neutral", "bullish")}
+
+@dataclass
+class LocalConfig:
+    """Local model settings (LOCAL_*).
+
+    A micro-batch closes when it holds `max_batch` texts or `max_wait_ms` after its first
+    text arrived. `quantize="int8"` applies dynamic int8 quantization to the Linear layers;
+    `threads` sets torch's intra-op threads (0 = torch default).
+    """
+    max_batch: int = 32
+    max_wait_ms: float = 5.0
+    max_length: int = 128
+    threads: int = 0
+    quantize: str = "off"
+
+    @classmethod
+    def from_env(cls) -> "LocalConfig":
+        return cls(
+            max_batch=int(os.getenv("LOCAL_MAX_BATCH", 32)),
+            max_wait_ms=float(os.getenv("LOCAL_MAX_WAIT_MS", 5)),
+            max_length=int(os.getenv("LOCAL_MAX_LENGTH", 128)),
+            threads=int(os.getenv("LOCAL_THREADS", 0)),
+            quantize=os.getenv("LOCAL_QUANTIZE", "off").lower(),
+        )
+
+
+def label_names(id2label: Dict[int, str]) -> List[str]:
+    """Sentiment for each output index of a classifier."""
+    names = [str(id2label[i]).lower() for i in range(len(id2label))]
+    if all(n in LABEL_ALIASES for n in names):
+        return [LABEL_ALIASES[n] for n in names]
+    if len(names) in ORDERED_LABELS:
+        return list(ORDERED_LABELS[len(names)])
+    raise ValueError(f"cannot map labels {names} onto bullish/bearish/neutral")
+
+def scores_to_parsed(probs: Sequence[float], labels: Sequence[str]) -> Dict[str, Any]:
+    """Class probabilities -> the sentiment JSON schema of the remote providers."""
+    by_label: Dict[str, float] = {}
+    for p, lab in zip(probs, labels):
+        by_label[lab] = by_label.get(lab, 0.0) + float(p)
+    sentiment = max(by_label, key=by_label.get)
+    return {
+        "sentiment": sentiment,
+        "confidence": round(by_label[sentiment], 4),
+        "key_entities": [],
+        # probabilidad de que la noticia mueva el precio en algún sentido
+        "impact_score": round(1.0 - by_label.get("neutral", 0.0), 4),
+    }
+
+def headline_of(prompt: str) -> str:
+    # con RAG el prompt es "CONTEXT:...\n\nTEXT:\n<titular>": el clasificador sólo ve el titular
+    head, sep, text = prompt.rpartition("TEXT:\n")
+    return text if sep and head.startswith("CONTEXT:") else prompt
+
+
+class LocalModel:
+    """Tokenizer + sequence-classification model loaded for CPU inference."""
+
+    def __init__(self, name: str, config: LocalConfig):
+        import torch
+        from transformers import AutoModelForSequenceClassification, AutoTokenizer
+        if config.threads > 0:
+            torch.set_num_threads(config.threads)
+        self.name = name
+        self.config = config
+        self.tokenizer = AutoTokenizer.from_pretrained(name)
+        model = AutoModelForSequenceClassification.from_pretrained(name).eval()
+        if config.quantize == "int8":
+            model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        self.model = model
+        self.labels = label_names(model.config.id2label)
+
+    def predict(self, texts: List[str]) -> List[Tuple[Dict[str, Any], int]]:
+        """(parsed, input tokens) per text, in one forward pass."""
+        import torch
+        enc = self.tokenizer(texts, padding=True, truncation=True, max_length=self.config.max_length,
+                             return_tensors="pt")
+        with torch.inference_mode():
+            probs = torch.softmax(self.model(**enc).logits.float(), dim=-1).tolist()
+        lengths = enc["attention_mask"].sum(dim=1).tolist()
+        return [(scores_to_parsed(p, self.labels), int(n)) for p, n in zip(probs, lengths)]
+
+_models: Dict[Tuple[str, str, int], LocalModel] = {}
+_models_lock = threading.Lock()
+
+def load_model(name: str, config: LocalConfig) -> LocalModel:
+    """Shared per (model, quantization, threads): every LocalClient of a process uses one copy."""
+    key = (name, config.quantize, config.threads)
+    with _models_lock:
+        if key not in _models:
+            _models[key] = LocalModel(name, config)
+        return _models[key]
+
+
+class MicroBatcher:
+    """Async queue that groups concurrent `submit` calls into `predict` batches.
+
+    The first queued text opens a batch; it is sent to `predict` (on a single worker thread,
+    off the event loop) when `max_batch` texts are queued or `max_wait_ms` has passed.
+    One batch runs at a time; texts arriving meanwhile form the next one.
+    """
+
+    def __init__(self, predict: Callable[[List[str]], List[Any]], max_batch: int = 32, max_wait_ms: float = 5.0,
+                 name: str = "local"):
+        self.predict = predict
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max_wait_ms/1000
+        self.name = name
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"{name}-batch")
+        # una cola y una tarea por event loop: un cliente compartido entre hilos con loops propios
+        # (asyncio.run por petición) no mezcla colas de loops distintos
+        self._lanes: Dict[asyncio.AbstractEventLoop, Tuple[asyncio.Queue, asyncio.Task]] = {}
+        self._lanes_lock = threading.Lock()
+
+    def _ensure(self) -> asyncio.Queue:
+        loop = asyncio.get_running_loop()
+        with self._lanes_lock:
+            lane = self._lanes.get(loop)
+            if lane is None or lane[1].done():
+                # loops ya cerrados: asyncio.run canceló su tarea al terminar, sólo queda soltarla
+                for old in [l for l in self._lanes if l.is_closed()]:
+                    del self._lanes[old]
+                queue: asyncio.Queue = asyncio.Queue()
+                lane = self._lanes[loop] = (queue, loop.create_task(self._run(queue)))
+            return lane[0]
+
+    async def submit(self, text: str) -> Tuple[Any, int]:
+        """Prediction for `text` and the size of the batch it ran in."""
+        fut = asyncio.get_running_loop().create_future()
+        await self._ensure().put((text, fut))
+        return await fut
+
+    async def _run(self, queue: asyncio.Queue) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(queue.get_nowait())
+                    continue
+                except asyncio.QueueEmpty:
+                    pass
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            # peticiones canceladas mientras esperaban: no se procesan
+            batch = [(t, f) for t, f in batch if not f.done()]
+            if not batch:
+                continue
+            observe("local_batch_size", len(batch), model=self.name)
+            try:
+                preds = await loop.run_in_executor(self._executor, self.predict, [t for t, _ in batch])
+            except Exception as e:
+                for _, f in batch:
+                    if not f.done():
+                        f.set_exception(e)
+                continue
+            for (_, f), p in zip(batch, preds):
+                if not f.done():
+                    f.set_result((p, len(batch)))
+
+    def close(self) -> None:
+        with self._lanes_lock:
+            lanes, self._lanes = self._lanes, {}
+        for loop, (_, task) in lanes.items():
+            if not task.done() and not loop.is_closed():
+                loop.call_soon_threadsafe(task.cancel)
+        self._executor.shutdown(wait=False)
+
+
+class LocalClient:
+    def __init__(self, model: Optional[str] = None, config: Optional[LocalConfig] = None):
+        self.model = model or default_model("local")
+        self.config = config or LocalConfig.from_env()
+        self._model: Optional[LocalModel] = None
+        self.batcher = MicroBatcher(self._predict, self.config.max_batch, self.config.max_wait_ms, name=self.model)
+
+    def _predict(self, texts: List[str]) -> List[Tuple[Dict[str, Any], int]]:
+        return self._model.predict(texts)
+
+    async def _ensure_model(self) -> None:
+        if self._model is None:
+            # la carga (y la cuantización) tarda segundos: fuera del event loop; load_model
+            # serializa las cargas concurrentes y devuelve la misma instancia
+            with span("local.load", model=self.model, quantize=self.config.quantize):
+                self._model = await asyncio.to_thread(load_model, self.model, self.config)
+
+    async def analyze(self, prompt: str) -> Dict[str, Any]:
+        try:
+            await self._ensure_model()
+            start = time.perf_counter()
+            with span("llm.attempt", provider="local", model=self.model):
+                (parsed, in_tokens), batch_size = await self.batcher.submit(headline_of(prompt))
+            latency_ms = (time.perf_counter()-start)*1000
+            return {
+                "ok": True,
+                "provider": "local",
+                "model": self.model,
+                "raw_text": json.dumps(parsed),
+                "parsed": parsed,
+                "usage": {"prompt": in_tokens, "cached_prompt": 0, "completion": 0, "total": in_tokens},
+                "latency_ms": round(latency_ms, 1),
+                "batch_size": batch_size,
+                "cost_usd": 0.0,
+                "cost_breakdown": None,
+            }
+        except Exception as e:
+            return {"ok": False, "provider": "local", "model": self.model, "error": str(e), "error_type": type(e).__name__}
+
+    async def analyze_pack(self, texts: List[str]) -> List[Dict[str, Any]]:
+        """Per-text results; concurrent submissions already share micro-batches."""
+        return list(await asyncio.gather(*(self.analyze(t) for t in texts)))
+
+    async def analyze_packed(self, texts: List[str], max_items: Optional[int] = None) -> List[Dict[str, Any]]:
+        return await self.analyze_pack(texts)
+
+
+def tiny_model(path: str, num_labels: int = 3, seed: int = 0) -> str:
+    """Write a tiny randomly initialized BERT classifier (and its tokenizer) to `path` and
+    return it, for LOCAL_MODEL=<path> in tests and benchmarks: nothing is downloaded and
+    the predictions are meaningless."""
+    import torch
+    from transformers import BertConfig, BertForSequenceClassification, BertTokenizerFast
+    os.makedirs(path, exist_ok=True)
+    words = ("beats misses profit loss revenue growth shares stock market earnings guidance raises cuts "
+             "record strong weak up down the a of and to in on for with q1 q2 q3 q4").split()
+    vocab = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + words + list("abcdefghijklmnopqrstuvwxyz0123456789")
+    vocab += ["##" + c for c in "abcdefghijklmnopqrstuvwxyz0123456789"]
+    with open(os.path.join(path, "vocab.txt"), "w", encoding="utf-8") as f:
+        f.write("\n".join(vocab) + "\n")
+    BertTokenizerFast(vocab_file=os.path.join(path, "vocab.txt"), do_lower_case=True).save_pretrained(path)
+    torch.manual_seed(seed)
+    labels = ORDERED_LABELS.get(num_labels) or tuple(f"label_{i}" for i in range(num_labels))
+    config = BertConfig(vocab_size=len(vocab), hidden_size=32, num_hidden_layers=2, num_attention_heads=2,
+                        intermediate_size=64, max_position_embeddings=128, num_labels=num_labels,
+                        id2label=dict(enumerate(labels)), label2id={l: i for i, l in enumerate(labels)})
+    BertForSequenceClassification(config).save_pretrained(path)
+    return path
+
+
+def main():
+    import argparse
+    ap = argparse.ArgumentParser(description="Throughput of the local provider (micro-batched CPU inference).")
+    ap.add_argument("--model", default=None, help="default: LOCAL_MODEL")
+    ap.add_argument("--tiny", default=None, metavar="DIR", help="create and use a tiny random model in DIR")
+    ap.add_argument("-n", type=int, default=512)
+    ap.add_argument("--concurrency", type=int, default=64)
+    args = ap.parse_args()
+    model = tiny_model(args.tiny) if args.tiny else args.model
+    client = LocalClient(model)
+    texts = [f"Company {i} beats Q{i % 4 + 1} earnings and raises guidance" for i in range(args.n)]
+
+    async def run():
+        await client.analyze(texts[0])
+        sem = asyncio.Semaphore(args.concurrency)
+        async def one(t):
+            async with sem:
+                return await client.analyze(t)
+        t0 = time.perf_counter()
+        res = await asyncio.gather(*(one(t) for t in texts))
+        return res, time.perf_counter() - t0
+
+    res, elapsed = asyncio.run(run())
+    sizes = [r.get("batch_size", 0) for r in res if r.get("ok")]
+    print(json.dumps({"model": client.model, "quantize": client.config.quantize, "n": len(res),
+                      "ok": len(sizes), "per_s": round(len(res)/elapsed, 1),
+                      "mean_batch": round(sum(sizes)/len(sizes), 1) if sizes else None}))
+    client.batcher.close()
+
+if __name__ == "__main__":
+    main()
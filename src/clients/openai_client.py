@@ -1,73 +1,162 @@
-import os, asyncio, json, re, time
-from typing import Dict, Any, Optional
+import os, json, re, time
+from typing import Dict, Any, List, Optional
 from tenacity import retry, wait_exponential, stop_after_attempt
-from openai import OpenAI
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
 
-from src.benchmarking.pricing import price_for
+from src.benchmarking.pricing import cost_breakdown, price_for
+from src.clients.base import SYSTEM_INSTR
+from src.clients.registry import default_model
+from src.clients.packing import analyze_pack_with, run_packed
+from src.clients.streaming import analyze_streamed, chat_deltas, read_json_stream, stream_enabled
+from src.clients.transport import shared_http_client
+from src.observability.metrics import on_retry, span
 
 class OpenAIClient:
-    def __init__(self, model: Optional[str] = None):
-        self.api_key = os.getenv("OPENAI_API_KEY")
-        self.model = model or os.getenv("OPENAI_MODEL", "gpt-4o-mini")
-        self.client = OpenAI(api_key=self.api_key) if self.api_key else None
+    """Chat Completions client. Also the base of OpenAI-compatible APIs (DeepSeek): a
+    subclass sets the provider and its env names, its retry policy and `_cached_tokens`."""
+    provider = "openai"
+    key_env = "OPENAI_API_KEY"
+    base_url_env = "OPENAI_BASE_URL"
+    default_base_url: Optional[str] = None
+
+    def __init__(self, model: Optional[str] = None, base_url: Optional[str] = None):
+        self.api_key = os.getenv(self.key_env)
+        self.model = model or default_model(self.provider)
+        self.base_url = base_url or os.getenv(self.base_url_env, self.default_base_url)
+        self.stream = stream_enabled(self.provider)
+        self.client = None
+        self._http = None
+        self.price = price_for(self.provider, self.model)
+
+    def _client(self) -> AsyncOpenAI:
+        http = shared_http_client(self.provider, DefaultAsyncHttpxClient)
+        client = self.client
+        # se devuelve la referencia local: otro loop puede sustituir self.client entretanto
+        if client is None or self._http is not http:
+            client = AsyncOpenAI(api_key=self.api_key, base_url=self.base_url, http_client=http)
+            self.client, self._http = client, http
+        return client
 
     def _user_msg(self, text: str):
-        system = (
-            "You are a financial NLP assistant. "
-            "Respond ONLY with a valid JSON object using these fields: "
-            "sentiment (bullish|bearish|neutral), confidence (0..1), "
-            "key_entities (array of strings), impact_score (0..1)."
-        )
         user = f"Analyze the following financial headline or news text:\n---\n{text}\n---"
-        return [{"role":"system","content":system},{"role":"user","content":user}]
+        return [{"role":"system","content":SYSTEM_INSTR},{"role":"user","content":user}]
 
-    @retry(wait=wait_exponential(min=1, max=8), stop=stop_after_attempt(3))
-    def _call(self, messages):
+    async def _request(self, messages, max_tokens: int = 200):
         start = time.perf_counter()
-        resp = self.client.chat.completions.create(
-            model=self.model,
-            messages=messages,
-            temperature=0,
-            max_tokens = 200,
-            response_format = {"type": "json_object"}
-        )
+        with span("llm.attempt", provider=self.provider, model=self.model):
+            resp = await self._client().chat.completions.create(
+                model=self.model,
+                messages=messages,
+                temperature=0,
+                max_tokens = max_tokens,
+                response_format = {"type": "json_object"}
+            )
         latency_ms = (time.perf_counter()-start)*1000
         return resp, latency_ms
 
+    async def _request_stream(self, messages, max_tokens: int = 200):
+        start = time.perf_counter()
+        last = {}
+        with span("llm.attempt", provider=self.provider, model=self.model, stream=True):
+            stream = await self._client().chat.completions.create(
+                model=self.model,
+                messages=messages,
+                temperature=0,
+                max_tokens=max_tokens,
+                response_format={"type": "json_object"},
+                stream=True,
+                stream_options={"include_usage": True},
+            )
+            try:
+                out = await read_json_stream(chat_deltas(stream, last), start, self.provider, self.model)
+            finally:
+                await stream.close()
+        # el último chunk (choices vacío) trae el usage; no llega si se cortó el stream antes
+        return out, last.get("usage_chunk")
+
+    @retry(wait=wait_exponential(min=1, max=8), stop=stop_after_attempt(3), before_sleep=on_retry("openai"))
+    async def _call(self, messages, max_tokens: int = 200):
+        return await self._request(messages, max_tokens)
+
+    @retry(wait=wait_exponential(min=1, max=8), stop=stop_after_attempt(3), before_sleep=on_retry("openai"))
+    async def _call_stream(self, messages, max_tokens: int = 200):
+        return await self._request_stream(messages, max_tokens)
+
+    @staticmethod
+    def _cached_tokens(u) -> int:
+        details = getattr(u, "prompt_tokens_details", None)
+        return getattr(details, "cached_tokens", None) or 0
+
+    def _usage_cost(self, resp):
+        u = getattr(resp, "usage", None)
+        usage = {
+            "prompt": getattr(u, "prompt_tokens", None),
+            "cached_prompt": self._cached_tokens(u),
+            "completion": getattr(u, "completion_tokens", None),
+            "total": getattr(u, "total_tokens", None),
+        } if u else {}
+        breakdown = cost_breakdown(self.price, usage)
+        return usage, breakdown
+
+    def _missing_key(self) -> Dict[str, Any]:
+        return {"ok": False, "provider": self.provider, "error": f"{self.key_env} missing"}
+
     async def analyze(self, prompt: str) -> Dict[str, Any]:
         if not self.api_key:
-            return {"ok": False, "provider":"openai", "error":"OPENAI_API_KEY missing"}
+            return self._missing_key()
+        if self.stream:
+            return await self.analyze_stream(prompt)
         try:
-            resp, latency_ms = await asyncio.to_thread(self._call, self._user_msg(prompt))
+            resp, latency_ms = await self._call(self._user_msg(prompt))
             text = resp.choices[0].message.content or ""
-            parsed = None
-            try:
-                parsed = json.loads(text)
-            except Exception:
-                m = re.search(r"\{.*\}", text, re.S)
-                if m:
-                    parsed = json.loads(m.group(0))
-            u = getattr(resp, "usage", None)
-            usage = {
-                "prompt": getattr(u, "prompt_tokens", None),
-                "completion": getattr(u, "completion_tokens", None),
-                "total": getattr(u, "total_tokens", None),
-            } if u else {}
-            price = price_for("openai", self.model)
-            cost = None
-            if price and usage.get("prompt") is not None and usage.get("completion") is not None:
-                cost = usage["prompt"]*price["in"] + usage["completion"] * price["out"]
+            with span("llm.parse", provider=self.provider, model=self.model):
+                parsed = None
+                try:
+                    parsed = json.loads(text)
+                except Exception:
+                    m = re.search(r"\{.*\}", text, re.S)
+                    if m:
+                        parsed = json.loads(m.group(0))
+            usage, breakdown = self._usage_cost(resp)
+            cost = breakdown["total"] if breakdown else None
 
             return {
-                "ok": True, 
-                "provider": "openai", 
+                "ok": True,
+                "provider": self.provider,
                 "model": self.model,
-                "raw_text": text, 
+                "raw_text": text,
                 "parsed": parsed,
                 "usage": usage,
                 "latency_ms": round(latency_ms, 1),
                 "cost_usd": round(cost, 6) if cost is not None else None,
+                "cost_breakdown": {k: round(v, 8) for k, v in breakdown.items()} if breakdown else None,
             }
-        
+
         except Exception as e:
-            return {"ok": False, "provider": "openai", "model": self.model, "error": str(e), "error_type": type(e).__name__}
\ No newline at end of file
+            return {"ok": False, "provider": self.provider, "model": self.model, "error": str(e), "error_type": type(e).__name__}
+
+    async def analyze_stream(self, prompt: str) -> Dict[str, Any]:
+        """Streamed `analyze`: stops reading once the JSON object is complete and valid."""
+        if not self.api_key:
+            return self._missing_key()
+        messages = self._user_msg(prompt)
+        return await analyze_streamed(
+            self.provider, self.model, self.price, "".join(m["content"] for m in messages),
+            lambda: self._call_stream(messages),
+            lambda out, usage_chunk: self._usage_cost(usage_chunk) if usage_chunk is not None else None,
+        )
+
+    async def analyze_pack(self, texts: List[str]) -> List[Dict[str, Any]]:
+        """One request for several headlines; one result per text (missing items have ok=False)."""
+        if not self.api_key:
+            return [self._missing_key() for _ in texts]
+
+        async def call(system: str, user: str, max_tokens: int):
+            resp, latency_ms = await self._call(
+                [{"role": "system", "content": system}, {"role": "user", "content": user}], max_tokens=max_tokens)
+            return (resp.choices[0].message.content or "", *self._usage_cost(resp), latency_ms)
+
+        return await analyze_pack_with(self.provider, self.model, texts, call)
+
+    async def analyze_packed(self, texts: List[str], max_items: Optional[int] = None) -> List[Dict[str, Any]]:
+        return await run_packed(texts, self.analyze_pack, self.analyze, max_items=max_items)
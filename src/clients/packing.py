@@ -0,0 +1,212 @@
+import os, json, re, asyncio
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from src.benchmarking.pricing import cost_breakdown, price_for
+from src.clients.base import validate_sentiment
+
+# Varios titulares por llamada: la instrucción de sistema se paga una vez por paquete
+PACKED_INSTR = (
+    "You are a financial NLP assistant. "
+    "You receive a JSON array of items with fields id and text. "
+    "Respond ONLY with a valid JSON object {\"results\": [...]} containing exactly one entry per item, "
+    "each with fields: id (copied from the item), sentiment (bullish|bearish|neutral), confidence (0..1), "
+    "key_entities (array of strings), impact_score (0..1)."
+)
+PACKED_INSTR_TOKENS = 90
+ITEM_OVERHEAD_TOKENS = 10   # {"id": n, "text": "..."} por ítem
+OUT_TOKENS_PER_ITEM = 60    # una entrada de "results" con 2-3 entidades
+OUT_TOKENS_SLACK = 40
+DEFAULT_MAX_ITEMS = 20
+DEFAULT_MAX_IN_TOKENS = 6000
+DEFAULT_MAX_OUT_TOKENS = 2000
+
+def _tokens(text: str) -> int:
+    # misma heurística que router.estimate_tokens (~1.3 tokens por palabra)
+    return max(1, int(len(text.split())*1.3))
+
+def pack_limits() -> Tuple[int, int, int]:
+    """(max items, max input tokens, max output tokens) per packed request, from LLM_PACK_*."""
+    return (
+        int(os.getenv("LLM_PACK_MAX_ITEMS", DEFAULT_MAX_ITEMS)),
+        int(os.getenv("LLM_PACK_MAX_IN_TOKENS", DEFAULT_MAX_IN_TOKENS)),
+        int(os.getenv("LLM_PACK_MAX_OUT_TOKENS", DEFAULT_MAX_OUT_TOKENS)),
+    )
+
+def plan_packs(
+    texts: List[str],
+    *,
+    max_items: Optional[int] = None,
+    max_in_tokens: Optional[int] = None,
+    max_out_tokens: Optional[int] = None,
+) -> List[List[int]]:
+    """Greedy split of `texts` (as indices, order kept) into packs that fit the item, input
+    and output token budgets. Long texts simply end up in smaller packs (possibly alone)."""
+    env_items, env_in, env_out = pack_limits()
+    max_items = max_items or env_items
+    max_in = (max_in_tokens or env_in) - PACKED_INSTR_TOKENS
+    max_n = max(1, min(max_items, ((max_out_tokens or env_out) - OUT_TOKENS_SLACK)//OUT_TOKENS_PER_ITEM))
+    packs, cur, cur_in = [], [], 0
+    for i, t in enumerate(texts):
+        cost = _tokens(t) + ITEM_OVERHEAD_TOKENS
+        if cur and (len(cur) >= max_n or cur_in + cost > max_in):
+            packs.append(cur)
+            cur, cur_in = [], 0
+        cur.append(i)
+        cur_in += cost
+    if cur:
+        packs.append(cur)
+    return packs
+
+def packed_prompt(texts: List[str]) -> Tuple[str, str, int]:
+    """(system, user, max_tokens) for one packed request; item ids are positions in `texts`."""
+    items = json.dumps([{"id": i, "text": t} for i, t in enumerate(texts)], ensure_ascii=False)
+    user = f"Analyze each of the following financial headlines or news texts:\n{items}"
+    return PACKED_INSTR, user, len(texts)*OUT_TOKENS_PER_ITEM + OUT_TOKENS_SLACK
+
+def split_results(text: str, n: int) -> List[Optional[Dict[str, Any]]]:
+    """Per-item parsed results (None if missing or invalid) from a packed response.
+
+    A truncated or otherwise broken response still yields the entries that are complete
+    JSON objects on their own.
+    """
+    entries: List[Any] = []
+    try:
+        doc = json.loads(text)
+        entries = doc.get("results", []) if isinstance(doc, dict) else doc
+    except Exception:
+        for m in re.finditer(r"\{[^{}]*\}", text):
+            try:
+                entries.append(json.loads(m.group(0)))
+            except Exception:
+                pass
+    out: List[Optional[Dict[str, Any]]] = [None]*n
+    for e in entries if isinstance(entries, list) else []:
+        if not isinstance(e, dict):
+            continue
+        try:
+            i = int(e.get("id"))
+        except (TypeError, ValueError):
+            continue
+        item = {k: v for k, v in e.items() if k != "id"}
+        if 0 <= i < n and out[i] is None and validate_sentiment(item):
+            out[i] = item
+    return out
+
+def prorate(texts: List[str], usage: Dict[str, Any], cost: Optional[float],
+            price: Optional[Dict[str, float]] = None) -> List[Tuple[Dict[str, Any], Optional[float]]]:
+    """Split a packed call's usage/cost across items: prompt tokens (and the shared
+    instruction) by each item's input size, completion tokens evenly. With `price`, each
+    item's cost is priced from its own share of tokens (output tokens cost more than input)
+    and scaled so the items add up to `cost`; without it, cost follows the token share."""
+    n = len(texts)
+    w = [_tokens(t) + ITEM_OVERHEAD_TOKENS for t in texts]
+    total_w = sum(w)
+    prompt, completion = usage.get("prompt"), usage.get("completion")
+    out = []
+    for wi in w:
+        share = wi/total_w
+        u = {
+            "prompt": round(prompt*share, 1) if prompt is not None else None,
+            "completion": round(completion/n, 1) if completion is not None else None,
+        }
+        for k in ("cached_prompt", "cache_write"):
+            if usage.get(k) is not None:
+                u[k] = round(usage[k]*share, 1)
+        u["total"] = round((u["prompt"] or 0) + (u["completion"] or 0), 1)
+        out.append((u, None))
+    if cost is None:
+        return out
+    priced = [cost_breakdown(price, u) for u, _ in out] if price else []
+    if priced and all(priced) and sum(b["total"] for b in priced) > 0:
+        # precio por clase de token de cada ítem, reescalado al coste real del paquete
+        scale = cost/sum(b["total"] for b in priced)
+        return [(u, b["total"]*scale) for (u, _), b in zip(out, priced)]
+    tok = (prompt or 0) + (completion or 0)
+    return [(u, cost*((u["total"]/tok) if tok else 1/n)) for u, _ in out]
+
+def item_results(
+    provider: str,
+    model: str,
+    texts: List[str],
+    raw_text: str,
+    usage: Dict[str, Any],
+    cost: Optional[float],
+    latency_ms: float,
+) -> List[Dict[str, Any]]:
+    """Client-shaped result per item of one packed response; missing/invalid items get ok=False."""
+    parsed = split_results(raw_text, len(texts))
+    out = []
+    for i, (p, (u, c)) in enumerate(zip(parsed, prorate(texts, usage, cost, price_for(provider, model)))):
+        base = {"provider": provider, "model": model, "usage": u,
+                "cost_usd": round(c, 8) if c is not None else None,
+                "latency_ms": round(latency_ms, 1), "packed": {"size": len(texts), "index": i}}
+        if p is None:
+            out.append({**base, "ok": False, "error": "item missing or invalid in packed response",
+                        "error_type": "PackedItemMissing"})
+        else:
+            out.append({**base, "ok": True, "parsed": p})
+    return out
+
+def pack_summary(provider: str, model: str, res: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """The per-item results of one packed request folded back into one client-shaped result
+    (summed usage and cost, the request's latency), for metrics and router statistics.
+    `parsed` is None if any item came back missing or invalid."""
+    ok = [r for r in res if r.get("ok")]
+    usage: Dict[str, Any] = {}
+    for r in res:
+        for k, v in (r.get("usage") or {}).items():
+            if v is not None:
+                usage[k] = round(usage.get(k, 0) + v, 1)
+    costs = [r["cost_usd"] for r in res if r.get("cost_usd") is not None]
+    first = res[0] if res else {}
+    out = {"ok": bool(ok), "provider": provider, "model": model, "usage": usage,
+           "latency_ms": first.get("latency_ms"), "cost_usd": round(sum(costs), 8) if costs else None,
+           "parsed": {"items": len(res)} if res and len(ok) == len(res) else None}
+    if not ok:
+        out.update(error=first.get("error"), error_type=first.get("error_type"))
+    return out
+
+async def analyze_pack_with(
+    provider: str,
+    model: str,
+    texts: List[str],
+    call: Callable[[str, str, int], Awaitable[Tuple[str, Dict[str, Any], Optional[Dict[str, float]], float]]],
+) -> List[Dict[str, Any]]:
+    """`analyze_pack` shared by the API clients: `call(system, user, max_tokens)` sends the
+    packed request and returns (text, usage, cost breakdown, latency_ms). An exception
+    gives every item the same error result."""
+    try:
+        system, user, max_tokens = packed_prompt(texts)
+        text, usage, breakdown, latency_ms = await call(system, user, max_tokens)
+        cost = breakdown["total"] if breakdown else None
+        return item_results(provider, model, texts, text, usage, cost, latency_ms)
+    except Exception as e:
+        return [{"ok": False, "provider": provider, "model": model, "error": str(e), "error_type": type(e).__name__}
+                for _ in texts]
+
+async def run_packed(
+    texts: List[str],
+    pack_fn: Callable[[List[str]], Awaitable[List[Dict[str, Any]]]],
+    single_fn: Callable[[str], Awaitable[Dict[str, Any]]],
+    *,
+    max_items: Optional[int] = None,
+) -> List[Dict[str, Any]]:
+    """Analyze `texts` in packed requests (run concurrently) and retry only the items that
+    came back missing or malformed through `single_fn`. Results keep input order."""
+    packs = plan_packs(texts, max_items=max_items)
+    out: List[Optional[Dict[str, Any]]] = [None]*len(texts)
+
+    async def one(idx: List[int]):
+        res = await pack_fn([texts[i] for i in idx])
+        for i, r in zip(idx, res):
+            out[i] = r
+
+    await asyncio.gather(*(one(p) for p in packs))
+    retry = [i for i, r in enumerate(out) if not (r and r.get("ok"))]
+    if retry:
+        singles = await asyncio.gather(*(single_fn(texts[i]) for i in retry))
+        for i, r in zip(retry, singles):
+            packed_cost = (out[i] or {}).get("cost_usd") or 0.0
+            # el reintento individual suma lo ya pagado por ese ítem en el paquete
+            out[i] = {**r, "packed_retry": True,
+                      "cost_usd": round((r.get("cost_usd") or 0.0) + packed_cost, 8)}
+    return out
@@ -0,0 +1,91 @@
+import os, importlib, threading
+from collections.abc import Mapping
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, List, Optional
+
+@dataclass(frozen=True)
+class ProviderSpec:
+    module: str
+    cls: str
+    key_env: str
+    model_env: str
+    default_model: str
+
+# Sólo metadatos: el SDK de cada proveedor (openai, anthropic, tenacity, ...) se importa al
+# construir su cliente por primera vez
+PROVIDERS: Dict[str, ProviderSpec] = {
+    "openai":    ProviderSpec("src.clients.openai_client", "OpenAIClient", "OPENAI_API_KEY", "OPENAI_MODEL", "gpt-4o-mini"),
+    "anthropic": ProviderSpec("src.clients.anthropic_client", "AnthropicClient", "ANTHROPIC_API_KEY", "ANTHROPIC_MODEL", "claude-3-5-haiku-latest"),
+    "deepseek":  ProviderSpec("src.clients.deepseek_client", "DeepkSeekClient", "DEEPSEEK_API_KEY", "DEEPSEEK_MODEL", "deepseek-chat"),
+    # modelo local en CPU (transformers): sin API key, se activa con LOCAL_MODEL_ENABLED=1
+    "local":     ProviderSpec("src.clients.local_client", "LocalClient", "LOCAL_MODEL_ENABLED", "LOCAL_MODEL", "ProsusAI/finbert"),
+}
+
+_env_lock = threading.Lock()
+_env_loaded = False
+
+def load_env(path: str = ".env") -> None:
+    """Load `.env` once per process (later calls are no-ops)."""
+    global _env_loaded
+    with _env_lock:
+        if _env_loaded:
+            return
+        from dotenv import load_dotenv
+        load_dotenv(path, override=True)
+        _env_loaded = True
+
+def default_model(provider: str) -> str:
+    spec = PROVIDERS[provider]
+    return os.getenv(spec.model_env, spec.default_model)
+
+def has_key(provider: str) -> bool:
+    return os.getenv(PROVIDERS[provider].key_env, "").lower() not in {"", "0", "off", "false", "no"}
+
+def configured() -> List[str]:
+    """Providers with an API key set, in registry order."""
+    return [p for p in PROVIDERS if has_key(p)]
+
+def client_class(provider: str):
+    spec = PROVIDERS[provider]
+    return getattr(importlib.import_module(spec.module), spec.cls)
+
+
+class ClientRegistry(Mapping):
+    """provider -> client, built (and its SDK imported) on first access.
+
+    Iteration and `in` only look at the registered names, so code that lists providers
+    never triggers an import; `model()` answers without building the client either.
+    """
+
+    def __init__(self, providers: Optional[List[str]] = None):
+        self._names = list(providers or PROVIDERS)
+        self._built: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    def __getitem__(self, provider: str):
+        if provider not in self._names:
+            raise KeyError(provider)
+        client = self._built.get(provider)
+        if client is None:
+            with self._lock:
+                client = self._built.get(provider)
+                if client is None:
+                    client = client_class(provider)()
+                    self._built[provider] = client
+        return client
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._names)
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def __contains__(self, provider: object) -> bool:
+        return provider in self._names
+
+    def model(self, provider: str) -> str:
+        client = self._built.get(provider)
+        return client.model if client is not None else default_model(provider)
+
+    def loaded(self) -> List[str]:
+        return list(self._built)
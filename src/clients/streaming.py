@@ -0,0 +1,194 @@
+import os, json, time
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional, Tuple
+from src.benchmarking.pricing import cost_breakdown
+from src.clients.base import validate_sentiment
+from src.observability.metrics import inc, observe, span
+
+# Modo streaming: el JSON se analiza según llegan los tokens y el stream se cierra en cuanto
+# el objeto de primer nivel está completo y cumple el esquema (lo que el modelo escriba después
+# ya no se espera ni se genera)
+
+def stream_enabled(provider: str) -> bool:
+    """PROVIDER_STREAM takes precedence over LLM_STREAM (default off)."""
+    raw = os.getenv(f"{provider.upper()}_STREAM") or os.getenv("LLM_STREAM", "off")
+    return raw.lower() in {"1", "on", "true", "yes"}
+
+
+class JsonObjectScanner:
+    """Incremental brace matcher over streamed text.
+
+    `feed(chunk)` returns the first complete top-level `{...}` seen so far (or None).
+    Braces inside JSON strings, and escaped quotes, are ignored; text before the first
+    "{" (prose, a ```json fence) is skipped. Work is linear in the streamed length.
+    """
+
+    def __init__(self):
+        self.buf = ""
+        self._pos = 0
+        self._start = -1
+        self._depth = 0
+        self._in_str = False
+        self._esc = False
+
+    def rest(self) -> str:
+        """Text after the last object returned."""
+        return self.buf[self._pos:]
+
+    def feed(self, chunk: str) -> Optional[str]:
+        self.buf += chunk
+        buf = self.buf
+        i = self._pos
+        while i < len(buf):
+            c = buf[i]
+            if self._in_str:
+                if self._esc:
+                    self._esc = False
+                elif c == "\\":
+                    self._esc = True
+                elif c == '"':
+                    self._in_str = False
+            elif c == '"' and self._depth:
+                self._in_str = True
+            elif c == "{":
+                if not self._depth:
+                    self._start = i
+                self._depth += 1
+            elif c == "}" and self._depth:
+                self._depth -= 1
+                if not self._depth:
+                    self._pos = i + 1
+                    return buf[self._start:i + 1]
+            i += 1
+        self._pos = i
+        return None
+
+
+@dataclass
+class StreamOutcome:
+    text: str
+    parsed: Optional[Dict[str, Any]]
+    ttft_ms: Optional[float]
+    latency_ms: float
+    early_stop: bool
+
+async def read_json_stream(deltas: AsyncIterator[str], start: float, provider: str, model: str) -> StreamOutcome:
+    """Consume text deltas until a schema-valid top-level JSON object is complete.
+
+    `start` is the perf_counter() taken before the request was sent. Once the object is
+    valid, the stream is cut at the first delta that carries more text; if the model
+    stops there instead, the stream runs to its end so the provider's usage arrives.
+    A complete object that fails validation does not stop the stream. The delta iterator
+    is closed on return.
+    """
+    scanner = JsonObjectScanner()
+    ttft = None
+    parsed = None
+    early = False
+    try:
+        async for piece in deltas:
+            if not piece:
+                continue
+            if parsed is not None:
+                if piece.strip():
+                    early = True
+                    break
+                continue
+            if ttft is None:
+                ttft = (time.perf_counter() - start)*1000
+            obj = scanner.feed(piece)
+            while obj is not None:
+                try:
+                    cand = json.loads(obj)
+                except ValueError:
+                    cand = None
+                if validate_sentiment(cand):
+                    parsed = cand
+                    break
+                obj = scanner.feed("")
+            if parsed is not None and scanner.rest().strip():
+                # el mismo delta ya trae texto tras el objeto
+                early = True
+                break
+    finally:
+        await deltas.aclose()
+    latency = (time.perf_counter() - start)*1000
+    lbl = {"provider": provider, "model": model}
+    if ttft is not None:
+        observe("llm_ttft_ms", ttft, **lbl)
+    inc("llm_stream_total", outcome="early_stop" if early else "complete", **lbl)
+    return StreamOutcome(scanner.buf, parsed, ttft, latency, early)
+
+def estimated_usage(prompt: str, completion: str) -> Dict[str, Any]:
+    """Usage when the stream was closed before the provider reported it (router estimator)."""
+    from src.orchestrator.router import estimate_tokens
+    p, c = estimate_tokens(prompt), estimate_tokens(completion)
+    return {"prompt": p, "cached_prompt": 0, "completion": c, "total": p + c, "estimated": True}
+
+def parse_text(text: str) -> Optional[Dict[str, Any]]:
+    """Whole-text fallback when no valid object was seen while streaming: json.loads, then
+    the first balanced object (not the greedy first-"{"-to-last-"}" span)."""
+    try:
+        return json.loads(text)
+    except ValueError:
+        pass
+    scanner = JsonObjectScanner()
+    obj = scanner.feed(text)
+    while obj is not None:
+        try:
+            return json.loads(obj)
+        except ValueError:
+            obj = scanner.feed("")
+    return None
+
+async def chat_deltas(stream, last: Dict[str, Any]) -> AsyncIterator[str]:
+    """Text deltas of an OpenAI-compatible chat stream (OpenAI, DeepSeek). The chunk that
+    carries `usage` (the last one, with empty choices) is kept in last["usage_chunk"]."""
+    async for chunk in stream:
+        if getattr(chunk, "usage", None):
+            last["usage_chunk"] = chunk
+        if chunk.choices:
+            yield chunk.choices[0].delta.content or ""
+
+async def analyze_streamed(
+    provider: str,
+    model: str,
+    price: Optional[Dict[str, float]],
+    prompt: str,
+    call: Callable[[], Awaitable[Tuple[StreamOutcome, Any]]],
+    usage_cost: Callable[[StreamOutcome, Any], Optional[Tuple[Dict[str, Any], Optional[Dict[str, float]]]]],
+) -> Dict[str, Any]:
+    """Result of a streamed `analyze`, shared by the API clients.
+
+    `call()` sends the request and returns (outcome, the provider's usage payload);
+    `usage_cost(outcome, payload)` is the only provider-specific part: (usage, cost
+    breakdown), or None if the stream was cut before usage arrived, in which case it is
+    estimated from `prompt` and the streamed text.
+    """
+    try:
+        out, payload = await call()
+        parsed = out.parsed
+        if parsed is None:
+            with span("llm.parse", provider=provider, model=model):
+                parsed = parse_text(out.text)
+        uc = usage_cost(out, payload)
+        if uc is None:
+            usage = estimated_usage(prompt, out.text)
+            uc = usage, cost_breakdown(price, usage)
+        usage, breakdown = uc
+        cost = breakdown["total"] if breakdown else None
+        return {
+            "ok": True,
+            "provider": provider,
+            "model": model,
+            "raw_text": out.text,
+            "parsed": parsed,
+            "usage": usage,
+            "latency_ms": round(out.latency_ms, 1),
+            "ttft_ms": round(out.ttft_ms, 1) if out.ttft_ms is not None else None,
+            "stream": {"early_stop": out.early_stop},
+            "cost_usd": round(cost, 6) if cost is not None else None,
+            "cost_breakdown": {k: round(v, 8) for k, v in breakdown.items()} if breakdown else None,
+        }
+    except Exception as e:
+        return {"ok": False, "provider": provider, "model": model, "error": str(e), "error_type": type(e).__name__}
@@ -0,0 +1,83 @@
+import os, asyncio, importlib, threading
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Tuple
+
+@dataclass(frozen=True)
+class PoolConfig:
+    max_connections: int = 200
+    max_keepalive: int = 50
+    keepalive_expiry: float = 30.0
+    connect_timeout: float = 10.0
+    read_timeout: float = 60.0
+
+    @classmethod
+    def from_env(cls, provider: str) -> "PoolConfig":
+        # PROVIDER_* tiene prioridad sobre LLM_* (p.ej. OPENAI_MAX_CONNECTIONS > LLM_MAX_CONNECTIONS)
+        def _get(name, cast, default):
+            raw = os.getenv(f"{provider.upper()}_{name}") or os.getenv(f"LLM_{name}")
+            return cast(raw) if raw else default
+        d = cls()
+        return cls(
+            max_connections=_get("MAX_CONNECTIONS", int, d.max_connections),
+            max_keepalive=_get("MAX_KEEPALIVE", int, d.max_keepalive),
+            keepalive_expiry=_get("KEEPALIVE_EXPIRY", float, d.keepalive_expiry),
+            connect_timeout=_get("CONNECT_TIMEOUT", float, d.connect_timeout),
+            read_timeout=_get("READ_TIMEOUT", float, d.read_timeout),
+        )
+
+    def client_kwargs(self, http) -> Dict[str, Any]:
+        return {
+            "limits": http.Limits(max_connections=self.max_connections,
+                                  max_keepalive_connections=self.max_keepalive,
+                                  keepalive_expiry=self.keepalive_expiry),
+            "timeout": http.Timeout(self.read_timeout, connect=self.connect_timeout),
+        }
+
+
+def _http_module(client_cls):
+    # Los SDK validan que el cliente HTTP sea del mismo paquete que usan (httpx o su sucesor):
+    # se toma Limits/Timeout del módulo base de su DefaultAsyncHttpxClient
+    for base in client_cls.__mro__[1:]:
+        mod = importlib.import_module(base.__module__.partition(".")[0])
+        if hasattr(mod, "Limits") and hasattr(mod, "Timeout"):
+            return mod
+    raise TypeError(f"cannot find the HTTP package behind {client_cls!r}")
+
+
+# Un pool por (proveedor, event loop): las conexiones de httpx quedan ligadas al loop que las
+# abrió, y cada loop cierra sólo los suyos al terminar (closing_pools)
+_POOLS: Dict[Tuple[str, asyncio.AbstractEventLoop], Any] = {}
+_pools_lock = threading.Lock()
+
+def shared_http_client(provider: str, client_cls, config: Optional[PoolConfig] = None):
+    """Pooled async HTTP client for `provider` on the running loop; `client_cls` is the SDK's
+    DefaultAsyncHttpxClient."""
+    loop = asyncio.get_running_loop()
+    with _pools_lock:
+        client = _POOLS.get((provider, loop))
+        if client is not None and not client.is_closed:
+            return client
+        # pools de loops ya cerrados sin closing_pools: sus sockets no se pueden cerrar desde
+        # otro loop, sólo se suelta la referencia
+        for key in [k for k in _POOLS if k[1].is_closed()]:
+            del _POOLS[key]
+        cfg = config or PoolConfig.from_env(provider)
+        client = client_cls(**cfg.client_kwargs(_http_module(client_cls)))
+        _POOLS[(provider, loop)] = client
+        return client
+
+async def aclose_pools() -> None:
+    """Close the pools opened on the running loop (other loops' pools are left alone)."""
+    loop = asyncio.get_running_loop()
+    with _pools_lock:
+        mine = [(k, _POOLS.pop(k)) for k in list(_POOLS) if k[1] is loop]
+    for _, client in mine:
+        await client.aclose()
+
+async def closing_pools(coro):
+    """Await `coro` and then close this loop's pools: wrap asyncio.run entry points with it,
+    e.g. asyncio.run(closing_pools(main()))."""
+    try:
+        return await coro
+    finally:
+        await aclose_pools()
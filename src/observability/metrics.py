@@ -0,0 +1,287 @@
+import os, json, time, uuid, bisect, asyncio, functools, threading, contextvars
+from collections import deque
+from typing import Any, Dict, List, Optional, Tuple
+
+# Instrumentación en proceso: contadores, histogramas y spans etiquetados por proveedor/modelo.
+# Desactivada por defecto (METRICS=on para activarla): cada llamada vuelve tras comprobar un bool.
+
+LATENCY_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+DESCRIPTIONS = {
+    "span_duration_ms": "Duration of instrumented stages",
+    "llm_requests_total": "Provider calls by outcome",
+    "llm_request_latency_ms": "Provider call latency as reported by the client (last attempt)",
+    "llm_tokens_total": "Tokens billed by kind (prompt, cached_prompt, completion)",
+    "llm_cost_usd_total": "Estimated spend in USD",
+    "llm_retries_total": "SDK call retries (tenacity), by exception type",
+    "llm_parse_failures_total": "Responses without parseable JSON",
+    "llm_ttft_ms": "Time to first streamed token",
+    "llm_stream_total": "Streamed calls by outcome (early_stop: closed once the JSON was complete)",
+    "response_cache_total": "Response cache lookups by result",
+    "rate_limit_wait_ms": "Time spent waiting on the RPM/TPM token buckets",
+    "breaker_rejections_total": "Calls rejected by an open circuit",
+    "router_decisions_total": "Provider chosen by the router, by target",
+    "rag_threadpool_queue_ms": "Time a retrieval waited for a worker thread",
+    "rag_query_embed_cache_total": "Query embedding LRU lookups (numpy backend) by result",
+    "kb_sync_files_total": "KB files seen by an incremental sync, by change kind",
+    "dedup_total": "Headlines assigned to a near-duplicate group (new group or duplicate)",
+    "local_batch_size": "Texts per forward pass of the local model (micro-batching)",
+}
+
+_Labels = Tuple[Tuple[str, str], ...]
+
+def _labels(labels: Dict[str, Any]) -> _Labels:
+    return tuple(sorted((k, "" if v is None else str(v)) for k, v in labels.items()))
+
+def _fmt_labels(labels: _Labels, extra: Optional[Tuple[str, str]] = None) -> str:
+    items = list(labels) + ([extra] if extra else [])
+    if not items:
+        return ""
+    esc = lambda v: v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in items) + "}"
+
+
+class Registry:
+    def __init__(self, enabled: bool = False, buckets=LATENCY_BUCKETS_MS, max_spans: int = 1000):
+        self.enabled = enabled
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[_Labels, float]] = {}
+        # nombre -> etiquetas -> [cuentas por bucket..., +Inf], suma, n
+        self._hists: Dict[str, Dict[_Labels, List]] = {}
+        self.spans: deque = deque(maxlen=max_spans)
+
+    def inc(self, name: str, value: float = 1.0, **labels) -> None:
+        if not self.enabled:
+            return
+        key = _labels(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0.0) + value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        if not self.enabled:
+            return
+        key = _labels(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._hists.setdefault(name, {})
+            h = series.get(key)
+            if h is None:
+                h = series[key] = [[0]*(len(self.buckets) + 1), 0.0, 0]
+            h[0][i] += 1
+            h[1] += value
+            h[2] += 1
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counters.clear()
+            self._hists.clear()
+            self.spans.clear()
+
+    def snapshot(self) -> Dict[str, Any]:
+        """JSON-friendly copy: counters, histograms (cumulative buckets, sum, count, approx.
+        p50/p90/p99) and the most recent spans."""
+        with self._lock:
+            counters = {n: [{"labels": dict(k), "value": v} for k, v in s.items()] for n, s in self._counters.items()}
+            hists = {}
+            for n, s in self._hists.items():
+                hists[n] = []
+                for k, (counts, total, cnt) in s.items():
+                    cum, acc = [], 0
+                    for c in counts:
+                        acc += c
+                        cum.append(acc)
+                    hists[n].append({
+                        "labels": dict(k), "count": cnt, "sum": round(total, 3),
+                        "buckets": dict(zip([str(b) for b in self.buckets] + ["+Inf"], cum)),
+                        **{f"p{q}": self._quantile(cum, cnt, q/100) for q in (50, 90, 99)},
+                    })
+            spans = list(self.spans)
+        return {"enabled": self.enabled, "ts": time.time(), "counters": counters, "histograms": hists, "spans": spans}
+
+    def _quantile(self, cum: List[int], n: int, q: float) -> Optional[float]:
+        # límite superior del bucket que contiene el cuantil (None si cae en +Inf)
+        if not n:
+            return None
+        i = bisect.bisect_left(cum, q*n)
+        return float(self.buckets[i]) if i < len(self.buckets) else None
+
+    def to_prometheus(self) -> str:
+        """Prometheus text exposition format (v0.0.4)."""
+        lines: List[str] = []
+        with self._lock:
+            for n, s in sorted(self._counters.items()):
+                if n in DESCRIPTIONS:
+                    lines.append(f"# HELP {n} {DESCRIPTIONS[n]}")
+                lines.append(f"# TYPE {n} counter")
+                for k, v in s.items():
+                    lines.append(f"{n}{_fmt_labels(k)} {v:g}")
+            for n, s in sorted(self._hists.items()):
+                if n in DESCRIPTIONS:
+                    lines.append(f"# HELP {n} {DESCRIPTIONS[n]}")
+                lines.append(f"# TYPE {n} histogram")
+                for k, (counts, total, cnt) in s.items():
+                    acc = 0
+                    for b, c in zip(list(self.buckets) + ["+Inf"], counts):
+                        acc += c
+                        lines.append(f"{n}_bucket{_fmt_labels(k, ('le', str(b)))} {acc}")
+                    lines.append(f"{n}_sum{_fmt_labels(k)} {total:g}")
+                    lines.append(f"{n}_count{_fmt_labels(k)} {cnt}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry(enabled=os.getenv("METRICS", "off").lower() in {"1", "on", "true", "yes"})
+
+def enable(on: bool = True) -> Registry:
+    REGISTRY.enabled = on
+    return REGISTRY
+
+def inc(name: str, value: float = 1.0, **labels) -> None:
+    REGISTRY.inc(name, value, **labels)
+
+def observe(name: str, value: float, **labels) -> None:
+    REGISTRY.observe(name, value, **labels)
+
+
+# ---- spans ----
+_current: contextvars.ContextVar = contextvars.ContextVar("current_span", default=None)
+
+class _NullSpan:
+    __slots__ = ()
+    def __enter__(self): return self
+    def __exit__(self, *exc): return False
+    def set(self, **labels): pass
+
+_NULL_SPAN = _NullSpan()
+
+class Span:
+    """Timed stage; nested spans (also across awaited tasks) share the trace id."""
+    __slots__ = ("name", "labels", "trace_id", "span_id", "parent_id", "_start", "_wall", "_token")
+
+    def __init__(self, name: str, labels: Dict[str, Any]):
+        parent = _current.get()
+        self.name = name
+        self.labels = labels
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent else None
+        self.span_id = uuid.uuid4().hex[:8]
+
+    def set(self, **labels) -> None:
+        self.labels.update(labels)
+
+    def __enter__(self):
+        self._token = _current.set(self)
+        self._wall = time.time()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        ms = (time.perf_counter() - self._start)*1000
+        _current.reset(self._token)
+        REGISTRY.observe("span_duration_ms", ms, span=self.name, **self.labels)
+        REGISTRY.spans.append({
+            "trace_id": self.trace_id, "span_id": self.span_id, "parent_id": self.parent_id,
+            "name": self.name, "labels": {k: v for k, v in self.labels.items()}, "start": self._wall,
+            "duration_ms": round(ms, 3), "error": exc_type.__name__ if exc_type else None,
+        })
+        return False
+
+def span(name: str, **labels):
+    """`with span("rag.retrieve", k=3): ...` — a no-op object when metrics are disabled."""
+    if not REGISTRY.enabled:
+        return _NULL_SPAN
+    return Span(name, labels)
+
+
+def traced(name: str, **labels):
+    """Decorator: run the (sync or async) function inside `span(name, **labels)`."""
+    def deco(fn):
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def awrapper(*args, **kwargs):
+                if not REGISTRY.enabled:
+                    return await fn(*args, **kwargs)
+                with Span(name, dict(labels)):
+                    return await fn(*args, **kwargs)
+            return awrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not REGISTRY.enabled:
+                return fn(*args, **kwargs)
+            with Span(name, dict(labels)):
+                return fn(*args, **kwargs)
+        return wrapper
+    return deco
+
+
+# ---- enganches comunes ----
+def on_retry(provider: str):
+    """tenacity `before_sleep` callback counting retries of a client method."""
+    def _hook(retry_state):
+        if not REGISTRY.enabled:
+            return
+        client = retry_state.args[0] if retry_state.args else None
+        exc = retry_state.outcome.exception() if retry_state.outcome else None
+        REGISTRY.inc("llm_retries_total", provider=provider, model=getattr(client, "model", None),
+                     error=type(exc).__name__ if exc else None)
+    return _hook
+
+def record_llm_result(res: Dict[str, Any]) -> None:
+    """Counters/histograms from a client-shaped result (ok, latency, usage, cost, parsed)."""
+    if not REGISTRY.enabled:
+        return
+    lbl = {"provider": res.get("provider"), "model": res.get("model")}
+    ok = bool(res.get("ok"))
+    REGISTRY.inc("llm_requests_total", outcome="ok" if ok else (res.get("error_type") or "error"), **lbl)
+    if not ok:
+        return
+    if res.get("latency_ms") is not None:
+        REGISTRY.observe("llm_request_latency_ms", res["latency_ms"], **lbl)
+    u = res.get("usage") or {}
+    for kind in ("prompt", "cached_prompt", "completion"):
+        if u.get(kind):
+            REGISTRY.inc("llm_tokens_total", u[kind], kind=kind, **lbl)
+    if res.get("cost_usd"):
+        REGISTRY.inc("llm_cost_usd_total", res["cost_usd"], **lbl)
+    if res.get("parsed") is None:
+        REGISTRY.inc("llm_parse_failures_total", **lbl)
+
+
+# ---- exportadores ----
+def write_snapshot(path: str) -> None:
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(REGISTRY.snapshot(), f, indent=2)
+
+def write_prometheus(path: str) -> None:
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(REGISTRY.to_prometheus())
+
+def serve_prometheus(port: int = 9464, host: str = "0.0.0.0"):
+    """Expose GET /metrics (Prometheus) and /metrics.json in a daemon thread."""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class _Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.startswith("/metrics.json"):
+                body, ctype = json.dumps(REGISTRY.snapshot()).encode(), "application/json"
+            elif self.path.startswith("/metrics"):
+                body, ctype = REGISTRY.to_prometheus().encode(), "text/plain; version=0.0.4"
+            else:
+                self.send_response(404); self.end_headers(); return
+            self.send_response(200)
+            self.send_header("Content-Type", ctype)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    srv = ThreadingHTTPServer((host, port), _Handler)
+    srv.daemon_threads = True
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    return srv
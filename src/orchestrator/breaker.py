@@ -0,0 +1,125 @@
+import os, time, threading
+from collections import deque
+from typing import Any, Callable, Dict, List
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+class CircuitBreaker:
+    """Per-provider circuit breaker.
+
+    closed -> open when the failure rate over the last `window` calls reaches
+    `failure_threshold` (after at least `min_calls`). open -> half_open once `open_s`
+    has elapsed; then up to `half_open_probes` calls are let through. A successful
+    probe closes the circuit, a failed one re-opens it.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        *,
+        failure_threshold: float = 0.5,
+        window: int = 20,
+        min_calls: int = 5,
+        open_s: float = 30.0,
+        half_open_probes: int = 1,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.min_calls = min_calls
+        self.open_s = open_s
+        self.half_open_probes = half_open_probes
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._results = deque(maxlen=window)
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probes = 0
+        self.transitions: Dict[str, int] = {}
+        self.history = deque(maxlen=50)
+        self.rejected = 0
+
+    @classmethod
+    def from_env(cls, name: str) -> "CircuitBreaker":
+        def _get(key, cast, default):
+            raw = os.getenv(f"{name.upper()}_BREAKER_{key}") or os.getenv(f"BREAKER_{key}")
+            return cast(raw) if raw else default
+        return cls(
+            name,
+            failure_threshold=_get("FAILURE_RATE", float, 0.5),
+            window=_get("WINDOW", int, 20),
+            min_calls=_get("MIN_CALLS", int, 5),
+            open_s=_get("OPEN_S", float, 30.0),
+            half_open_probes=_get("PROBES", int, 1),
+        )
+
+    def _move(self, state: str) -> None:
+        key = f"{self._state}->{state}"
+        self.transitions[key] = self.transitions.get(key, 0) + 1
+        self.history.append({"t": time.time(), "from": self._state, "to": state})
+        self._state = state
+        if state == OPEN:
+            self._opened_at = self._clock()
+            self._probes = 0
+        elif state == CLOSED:
+            self._results.clear()
+
+    def _tick(self) -> None:
+        if self._state == OPEN and self._clock() - self._opened_at >= self.open_s:
+            self._move(HALF_OPEN)
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            self._tick()
+            return self._state
+
+    def is_open(self) -> bool:
+        """True while calls are being rejected (open and not yet due for a probe)."""
+        return self.state == OPEN
+
+    def allow(self) -> bool:
+        with self._lock:
+            self._tick()
+            if self._state == CLOSED:
+                return True
+            if self._state == HALF_OPEN and self._probes < self.half_open_probes:
+                self._probes += 1
+                return True
+            self.rejected += 1
+            return False
+
+    def record(self, ok: bool) -> None:
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._move(CLOSED if ok else OPEN)
+                return
+            if self._state == OPEN:
+                return
+            self._results.append(ok)
+            n = len(self._results)
+            if n >= self.min_calls and self._results.count(False)/n >= self.failure_threshold:
+                self._move(OPEN)
+
+    def release(self) -> None:
+        # llamada admitida que no llegó a completarse (p.ej. cancelada por un hedge)
+        with self._lock:
+            if self._state == HALF_OPEN and self._probes > 0:
+                self._probes -= 1
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            self._tick()
+            n = len(self._results)
+            return {
+                "state": self._state,
+                "failure_rate": round(self._results.count(False)/n, 4) if n else 0.0,
+                "window_calls": n,
+                "rejected": self.rejected,
+                "transitions": dict(self.transitions),
+                "recent_transitions": list(self.history)[-5:],
+            }
+
+
+def breakers_for(providers: List[str]) -> Dict[str, CircuitBreaker]:
+    return {p: CircuitBreaker.from_env(p) for p in providers}
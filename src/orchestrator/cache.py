@@ -0,0 +1,229 @@
+import os, json, time, asyncio, sqlite3, hashlib, threading, unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+from src.clients.base import PROMPT_VERSION
+
+def normalize_text(text: str) -> str:
+    return " ".join(unicodedata.normalize("NFKC", text).split())
+
+# campos de la llamada original que no describen una respuesta servida desde caché
+STALE_ON_HIT = ("usage", "cost_usd", "cost_breakdown", "latency_ms", "ttft_ms", "rate_limit_wait_ms", "stream")
+
+def as_hit(cached: Dict[str, Any], latency_ms: float) -> Dict[str, Any]:
+    """Cached response as returned on a hit: no cost, no tokens, the lookup's latency.
+    The original call's usage/cost/timings stay under `cached_from` for reference."""
+    res = {k: v for k, v in cached.items() if k not in STALE_ON_HIT}
+    res["cached_from"] = {k: cached[k] for k in STALE_ON_HIT if cached.get(k) is not None}
+    res.update(cache="hit", usage=None, cost_usd=0.0, cost_breakdown=None, latency_ms=latency_ms)
+    return res
+
+class ResponseCache:
+    """Two-tier cache for deterministic (temperature=0) provider responses.
+
+    Memory tier: LRU bounded by entry count and approximate size in bytes, with TTL.
+    Disk tier (optional): SQLite table that survives restarts; hits are promoted to memory.
+    Disk writes are queued and committed in batches by a background thread (every
+    `flush_s` or `flush_every` puts; flush_every=1 commits inside `put`, for callers that
+    must not lose a paid response on a crash); `aget` reads the disk in a worker thread. Disk
+    errors (e.g. a locked database shared by several processes) are counted, not raised:
+    a failed read is a miss and a failed write only loses that entry.
+    """
+
+    def __init__(
+        self,
+        *,
+        max_entries: int = 10_000,
+        max_bytes: int = 64 * 1024 * 1024,
+        ttl_s: Optional[float] = 7 * 24 * 3600,
+        sqlite_path: Optional[str] = None,
+        flush_s: float = 0.2,
+        flush_every: int = 64,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_s = ttl_s
+        self.flush_s = flush_s
+        self.flush_every = flush_every
+        self._lock = threading.Lock()
+        self._mem: "OrderedDict[str, Tuple[float, int, str]]" = OrderedDict()
+        self._mem_bytes = 0
+        self._counts = {"hits": 0, "mem_hits": 0, "disk_hits": 0, "misses": 0, "puts": 0, "evictions": 0,
+                        "expired": 0, "disk_errors": 0}
+        self._db = None
+        # la conexión tiene su propio lock: una lectura lenta en disco no bloquea el tier de memoria
+        self._db_lock = threading.Lock()
+        self._pending: List[Tuple[str, float, str]] = []
+        self._wake = threading.Event()
+        self._writer: Optional[threading.Thread] = None
+        if sqlite_path:
+            os.makedirs(os.path.dirname(sqlite_path) or ".", exist_ok=True)
+            self._db = sqlite3.connect(sqlite_path, check_same_thread=False, timeout=10)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, created REAL NOT NULL, value TEXT NOT NULL)"
+            )
+            self._db.commit()
+            self._writer = threading.Thread(target=self._write_loop, name="response-cache-writer", daemon=True)
+            self._writer.start()
+
+    @classmethod
+    def from_env(cls) -> Optional["ResponseCache"]:
+        if os.getenv("LLM_CACHE", "on").lower() in {"0", "off", "false", "no"}:
+            return None
+        ttl = float(os.getenv("LLM_CACHE_TTL_S", 7 * 24 * 3600))
+        return cls(
+            max_entries=int(os.getenv("LLM_CACHE_MAX_ENTRIES", 10_000)),
+            max_bytes=int(os.getenv("LLM_CACHE_MAX_MB", 64)) * 1024 * 1024,
+            ttl_s=ttl if ttl > 0 else None,
+            sqlite_path=os.getenv("LLM_CACHE_PATH") or None,
+        )
+
+    @staticmethod
+    def key(provider: str, model: Optional[str], text: str, prompt_version: str = PROMPT_VERSION) -> str:
+        raw = "\x1f".join([provider, model or "", prompt_version, normalize_text(text)])
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _expired(self, created: float, now: float) -> bool:
+        return self.ttl_s is not None and now - created > self.ttl_s
+
+    def _mem_put(self, key: str, created: float, blob: str) -> None:
+        old = self._mem.pop(key, None)
+        if old:
+            self._mem_bytes -= old[1]
+        self._mem[key] = (created, len(blob), blob)
+        self._mem_bytes += len(blob)
+        while self._mem and (len(self._mem) > self.max_entries or self._mem_bytes > self.max_bytes):
+            _, (_, size, _) = self._mem.popitem(last=False)
+            self._mem_bytes -= size
+            self._counts["evictions"] += 1
+
+    def _mem_get(self, key: str, now: float) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            item = self._mem.get(key)
+            if item is None:
+                return None
+            if self._expired(item[0], now):
+                self._mem.pop(key)
+                self._mem_bytes -= item[1]
+                self._counts["expired"] += 1
+                return None
+            self._mem.move_to_end(key)
+            self._counts["hits"] += 1; self._counts["mem_hits"] += 1
+            return json.loads(item[2])
+
+    def _disk_get(self, key: str, now: float) -> Optional[Dict[str, Any]]:
+        row = None
+        try:
+            with self._db_lock:
+                if self._db is not None:
+                    row = self._db.execute("SELECT created, value FROM responses WHERE key = ?", (key,)).fetchone()
+                    if row is not None and self._expired(row[0], now):
+                        self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                        self._db.commit()
+                        with self._lock:
+                            self._counts["expired"] += 1
+                        row = None
+        except sqlite3.Error:
+            row = None
+            with self._lock:
+                self._counts["disk_errors"] += 1
+        with self._lock:
+            if row is None:
+                self._counts["misses"] += 1
+                return None
+            self._mem_put(key, row[0], row[1])
+            self._counts["hits"] += 1; self._counts["disk_hits"] += 1
+        return json.loads(row[1])
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Blocking lookup (memory, then disk); from async code use `aget`."""
+        now = time.time()
+        hit = self._mem_get(key, now)
+        return hit if hit is not None else self._disk_get(key, now)
+
+    async def aget(self, key: str) -> Optional[Dict[str, Any]]:
+        """Lookup for the event loop: memory inline, the SQLite read in a worker thread."""
+        now = time.time()
+        hit = self._mem_get(key, now)
+        if hit is not None or self._db is None:
+            if hit is None:
+                with self._lock:
+                    self._counts["misses"] += 1
+            return hit
+        return await asyncio.to_thread(self._disk_get, key, now)
+
+    def put(self, key: str, value: Dict[str, Any]) -> None:
+        """Store in memory now; the disk write is queued for the writer thread."""
+        blob = json.dumps(value, ensure_ascii=False, default=str)
+        created = time.time()
+        with self._lock:
+            self._mem_put(key, created, blob)
+            self._counts["puts"] += 1
+            if self._db is None:
+                return
+            self._pending.append((key, created, blob))
+            full = len(self._pending) >= self.flush_every
+        if self.flush_every <= 1:
+            self.flush()
+        elif full:
+            self._wake.set()
+
+    def _write_loop(self) -> None:
+        while self._db is not None:
+            self._wake.wait(self.flush_s)
+            self._wake.clear()
+            self.flush()
+
+    def flush(self) -> None:
+        """Commit the queued disk writes (one transaction). Failures are counted and dropped."""
+        with self._lock:
+            batch, self._pending = self._pending, []
+        if not batch:
+            return
+        try:
+            # la comprobación de _db va dentro del lock: close() la pone a None bajo el mismo lock
+            with self._db_lock:
+                if self._db is None:
+                    return
+                self._db.executemany("INSERT OR REPLACE INTO responses (key, created, value) VALUES (?, ?, ?)", batch)
+                self._db.commit()
+        except sqlite3.Error:
+            with self._lock:
+                self._counts["disk_errors"] += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._mem.clear()
+            self._mem_bytes = 0
+            self._pending = []
+        with self._db_lock:
+            if self._db is not None:
+                self._db.execute("DELETE FROM responses")
+                self._db.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            c = dict(self._counts)
+            lookups = c["hits"] + c["misses"]
+            c["hit_ratio"] = round(c["hits"] / lookups, 4) if lookups else 0.0
+            c["mem_entries"] = len(self._mem)
+            c["mem_bytes"] = self._mem_bytes
+            c["pending_writes"] = len(self._pending)
+        with self._db_lock:
+            if self._db is not None:
+                try:
+                    c["disk_entries"] = self._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+                except sqlite3.Error:
+                    c["disk_entries"] = None
+        return c
+
+    def close(self) -> None:
+        """Flush queued writes and close the database."""
+        self.flush()
+        with self._db_lock:
+            db, self._db = self._db, None
+        self._wake.set()
+        if self._writer is not None and self._writer is not threading.current_thread():
+            self._writer.join(timeout=2)
+        if db is not None:
+            db.close()
@@ -0,0 +1,61 @@
+import os, time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+from src.clients.base import validate_sentiment
+from src.observability.metrics import span
+
+# Etapas por defecto: reglas -> modelo más barato según pricing.py -> modelo fuerte
+DEFAULT_STAGES = ["rule", "cheap", "anthropic:claude-sonnet-4-20250514"]
+
+@dataclass
+class CascadeConfig:
+    """Escalation stages for provider="cascade".
+
+    Each stage is "rule" (lexicon scorer, no call), "cheap" (cheapest available model
+    by estimated cost) or "provider[:model]". A stage answers when its result is valid
+    and confident enough; otherwise the item moves on to the next stage.
+    """
+    stages: List[str] = field(default_factory=lambda: list(DEFAULT_STAGES))
+    rule_confidence: float = 0.6
+    min_confidence: float = 0.7
+
+    @classmethod
+    def from_env(cls) -> "CascadeConfig":
+        raw = os.getenv("CASCADE_STAGES")
+        return cls(
+            stages=[s.strip() for s in raw.split(",") if s.strip()] if raw else list(DEFAULT_STAGES),
+            rule_confidence=float(os.getenv("CASCADE_RULE_CONFIDENCE", 0.6)),
+            min_confidence=float(os.getenv("CASCADE_MIN_CONFIDENCE", 0.7)),
+        )
+
+def rule_response(text: str) -> Dict[str, Any]:
+    """Lexicon verdict shaped like a client response (ok/parsed/cost/latency)."""
+    from src.pipelines.lexicon import default_lexicon
+    start = time.perf_counter()
+    with span("cascade.rule"):
+        r = default_lexicon().score(text)
+    return {
+        "ok": True,
+        "provider": "rule",
+        "model": "lexicon",
+        "latency_ms": round((time.perf_counter()-start)*1000, 3),
+        "parsed": {
+            "sentiment": r["sentiment"],
+            "confidence": r["confidence"],
+            "key_entities": [],
+            "impact_score": round(min(1.0, abs(r["score"])/4), 3),
+        },
+        "hits": r["hits"],
+        "cost_usd": 0.0,
+    }
+
+def escalation_reason(res: Dict[str, Any], min_confidence: float) -> Optional[str]:
+    """None if `res` can be returned as is, otherwise why the cascade must go on."""
+    if not res.get("ok"):
+        return res.get("error_type") or "error"
+    parsed = res.get("parsed")
+    if not validate_sentiment(parsed):
+        return "invalid_json"
+    if parsed["confidence"] < min_confidence:
+        return "low_confidence"
+    return None
@@ -0,0 +1,141 @@
+import os, json, math
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from src.clients.base import SENTIMENTS
+
+# Pesos históricos del voto de la UI; se sustituyen por los calibrados si ENSEMBLE_WEIGHTS_PATH existe
+DEFAULT_WEIGHTS = {"openai": 0.4, "anthropic": 0.35, "deepseek": 0.25}
+DEFAULT_WEIGHT = 0.3
+DEFAULT_QUORUM = 2
+
+def vote(weight: float, confidence: float) -> float:
+    # la confianza modula el voto entre la mitad y el peso completo
+    return weight*(0.5 + 0.5*confidence)
+
+def tally(votes: Dict[str, Tuple[str, float]], weights: Optional[Dict[str, float]] = None) -> Dict[str, Any]:
+    """Weighted vote over {provider: (label, confidence)}: winning label, per-label scores and
+    reliability (margin between the two best labels)."""
+    weights = weights or DEFAULT_WEIGHTS
+    scores = {s: 0.0 for s in ("bullish", "bearish", "neutral")}
+    for prov, (label, conf) in votes.items():
+        if label in scores:
+            scores[label] += vote(weights.get(prov, DEFAULT_WEIGHT), float(conf))
+    ranked = sorted(scores.values(), reverse=True)
+    label = max(scores, key=scores.get)
+    return {"label": label, "reliability": round(ranked[0] - ranked[1], 3),
+            "scores": {k: round(v, 3) for k, v in scores.items()}}
+
+def stop_reason(
+    votes: Dict[str, Tuple[str, float]],
+    pending: Iterable[str],
+    weights: Dict[str, float],
+    quorum: int = DEFAULT_QUORUM,
+) -> Optional[str]:
+    """Why the ensemble can stop now, or None if it must wait for more providers.
+
+    "quorum": at least `quorum` providers agree on the leading label.
+    "unassailable": even if every pending provider voted for the runner-up with full
+    confidence, the leader would still win.
+    """
+    if not votes:
+        return None
+    t = tally(votes, weights)
+    counts: Dict[str, int] = {}
+    for label, _ in votes.values():
+        counts[label] = counts.get(label, 0) + 1
+    if quorum and counts.get(t["label"], 0) >= quorum:
+        return "quorum"
+    ranked = sorted(t["scores"].values(), reverse=True)
+    if ranked[0] - ranked[1] > sum(vote(weights.get(p, DEFAULT_WEIGHT), 1.0) for p in pending):
+        return "unassailable"
+    return None
+
+def calibrate_weights(records: Iterable[Tuple[str, Optional[str], str]], prior: float = 1.0) -> Dict[str, float]:
+    """Weights from historical (provider, predicted, gold) records.
+
+    Each provider's weight is the log-odds of its (Laplace-smoothed) accuracy against
+    chance for three classes, so a provider no better than chance gets ~0.
+    """
+    hits: Dict[str, float] = {}
+    n: Dict[str, float] = {}
+    for prov, pred, gold in records:
+        n[prov] = n.get(prov, 0) + 1
+        hits[prov] = hits.get(prov, 0) + (pred == gold)
+    chance = 1/len(SENTIMENTS)
+    out = {}
+    for prov in n:
+        acc = (hits[prov] + prior*chance)/(n[prov] + prior)
+        acc = min(acc, 0.999)
+        out[prov] = round(max(0.0, math.log(acc/(1 - acc)) - math.log(chance/(1 - chance))), 4)
+    total = sum(out.values())
+    return {p: round(w/total, 4) for p, w in out.items()} if total else dict(DEFAULT_WEIGHTS)
+
+def load_weights(path: Optional[str] = None) -> Dict[str, float]:
+    """Calibrated weights (ENSEMBLE_WEIGHTS_PATH) over DEFAULT_WEIGHTS for the providers the
+    calibration did not see, renormalized to sum 1 so both sets are on the same scale."""
+    path = path or os.getenv("ENSEMBLE_WEIGHTS_PATH")
+    if path and os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            merged = {**DEFAULT_WEIGHTS, **json.load(f).get("weights", {})}
+        total = sum(merged.values())
+        return {p: round(w/total, 4) for p, w in merged.items()} if total else dict(DEFAULT_WEIGHTS)
+    return dict(DEFAULT_WEIGHTS)
+
+def save_weights(weights: Dict[str, float], path: str, **meta) -> None:
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"weights": weights, **meta}, f, indent=2)
+    os.replace(tmp, path)
+
+def merge_parsed(votes: Dict[str, Dict[str, Any]], label: str, scores: Dict[str, float]) -> Dict[str, Any]:
+    """Schema-valid answer from the providers that voted for `label`."""
+    agree = [p for p in votes.values() if p.get("sentiment") == label]
+    entities: List[str] = []
+    for p in agree:
+        for e in p.get("key_entities") or []:
+            if e not in entities:
+                entities.append(e)
+    total = sum(scores.values())
+    return {
+        "sentiment": label,
+        "confidence": round(scores[label]/total, 3) if total else 0.0,
+        "key_entities": entities,
+        "impact_score": round(sum(float(p.get("impact_score", 0.0)) for p in agree)/len(agree), 3) if agree else 0.0,
+    }
+
+
+def main():
+    """Calibrate weights: run every available provider over a labelled JSONL ({"text", "label"})."""
+    import argparse, asyncio
+    from src.orchestrator.multimodel_analyzer import MultiModelAnalyzer
+    from src.clients.transport import closing_pools
+    ap = argparse.ArgumentParser(description="Calibrate ensemble weights from labelled headlines.")
+    ap.add_argument("labels", help="JSONL with fields text and label (bullish|bearish|neutral)")
+    ap.add_argument("--out", default=os.getenv("ENSEMBLE_WEIGHTS_PATH", "storage/ensemble_weights.json"))
+    ap.add_argument("--concurrency", type=int, default=4)
+    args = ap.parse_args()
+
+    with open(args.labels, encoding="utf-8") as f:
+        rows = [json.loads(l) for l in f if l.strip()]
+    mm = MultiModelAnalyzer()
+
+    async def run():
+        sem = asyncio.Semaphore(max(1, args.concurrency))
+        async def one(row):
+            async with sem:
+                res = await mm.analyze_all_providers(row["text"])
+            return [(p, (r.get("parsed") or {}).get("sentiment"), row["label"]) for p, r in res["results"].items()]
+        return [rec for recs in await asyncio.gather(*(one(r) for r in rows)) for rec in recs]
+
+    records = asyncio.run(closing_pools(run()))
+    weights = calibrate_weights(records)
+    counts: Dict[str, List[int]] = {}
+    for p, pred, gold in records:
+        c = counts.setdefault(p, [0, 0]); c[0] += pred == gold; c[1] += 1
+    accuracy = {p: round(h/n, 4) for p, (h, n) in counts.items()}
+    save_weights(weights, args.out, n=len(rows), accuracy=accuracy)
+    print(json.dumps({"weights": weights, "accuracy": accuracy}, indent=2))
+    print(f"Saved: {args.out}")
+
+if __name__ == "__main__":
+    main()
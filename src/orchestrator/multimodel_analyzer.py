@@ -1,68 +1,453 @@
-import asyncio
-from typing import Dict, Any, List
-from dotenv import load_dotenv
-from src.clients.base import env_keys_status
-from src.clients.openai_client import OpenAIClient
-from src.clients.deepseek_client import DeepkSeekClient
-from src.clients.anthropic_client import AnthropicClient
+import os, asyncio, time
+from typing import Dict, Any, List, Optional, Sequence, Tuple, Union
+from src.clients.base import env_keys_status, validate_sentiment
+from src.clients.packing import PACKED_INSTR_TOKENS, pack_summary, run_packed
+from src.clients.registry import ClientRegistry, client_class, has_key, load_env
 
-from src.orchestrator.router import choose_provider
+from src.observability.metrics import inc, observe, record_llm_result, span, traced
+from src.orchestrator.breaker import CircuitBreaker, breakers_for
+from src.orchestrator.cache import ResponseCache, as_hit
+from src.orchestrator.cascade import CascadeConfig, escalation_reason, rule_response
+from src.orchestrator.ensemble import DEFAULT_QUORUM, load_weights, merge_parsed, stop_reason, tally
+from src.orchestrator.ratelimit import ProviderLimiter, limiters_from_env
+from src.orchestrator.router import ProviderStats, choose_provider, estimate_cost, estimate_tokens
+
+# Tokens fijos de instrucción de sistema + envoltorio, y salida esperada, para reservar cupo TPM
+PROMPT_OVERHEAD_TOKENS = 80
+EXPECTED_OUT_TOKENS = 120
+# Orden de preferencia de "auto" (y de los modos hedged/race)
+AUTO_ORDER = ["openai", "deepseek", "anthropic", "local"]
+# Retardo del hedge si no hay HEDGE_DELAY_MS ni muestras suficientes para el p95
+DEFAULT_HEDGE_DELAY_MS = 1500.0
+# Modos de routing -> target de router.choose_provider
+ROUTING_TARGETS = {"cost-aware": "cheapest", "fastest": "fastest",
+                   "cheapest-under-slo": "cheapest-under-slo", "balanced": "balanced"}
 
 class MultiModelAnalyzer:
-    def __init__(self):
-        load_dotenv(".env", override=True)
+    def __init__(
+        self,
+        cache: Union[ResponseCache, bool, None] = True,
+        limiters: Optional[Dict[str, ProviderLimiter]] = None,
+        stats: Optional[ProviderStats] = None,
+        breakers: Optional[Dict[str, CircuitBreaker]] = None,
+        cascade: Optional[CascadeConfig] = None,
+    ):
+        load_env()
         self.keys = env_keys_status()
-        self.openai = OpenAIClient()
-        self.deepseek = DeepkSeekClient()
-        self.anthropic = AnthropicClient()
-    
+        # Clientes perezosos: el SDK de un proveedor se importa la primera vez que se le llama
+        self._clients = ClientRegistry()
+        # True -> configuración desde entorno (LLM_CACHE*); False/None -> sin caché
+        self.cache: Optional[ResponseCache] = ResponseCache.from_env() if cache is True else (cache or None)
+        # Límites por proveedor (OPENAI_RPM / OPENAI_TPM, ...); sin configurar -> sin límite
+        self.limiters = limiters if limiters is not None else limiters_from_env(self._clients)
+        # Estadísticas vivas por (proveedor, modelo); ROUTER_STATS_PATH las persiste entre ejecuciones
+        self.stats_path = os.getenv("ROUTER_STATS_PATH")
+        self.stats = stats if stats is not None else ProviderStats.load(self.stats_path)
+        # Circuit breaker por proveedor: con el circuito abierto se falla/cambia de proveedor al instante
+        self.breakers = breakers if breakers is not None else breakers_for(list(self._clients))
+        # Cascada reglas -> barato -> fuerte (CASCADE_STAGES, CASCADE_*_CONFIDENCE)
+        self.cascade = cascade or CascadeConfig.from_env()
+        self._dedup = None
+        self._model_clients: Dict[Tuple[str, str], Any] = {}
+        # Pesos del voto del ensemble (calibrados si ENSEMBLE_WEIGHTS_PATH existe) y quorum
+        self.ensemble_weights = load_weights()
+        self.ensemble_quorum = int(os.getenv("ENSEMBLE_QUORUM", DEFAULT_QUORUM))
+
     def _available(self) -> List[str]:
-        avail = []
-        if getattr(self.openai, "api_key", None):     avail.append("openai")
-        if getattr(self.anthropic, "api_key", None):  avail.append("anthropic")
-        if getattr(self.deepseek, "api_key", None):   avail.append("deepseek")
-        return avail
-    
+        avail = [p for p in ("openai", "anthropic", "deepseek", "local") if has_key(p)]
+        return [p for p in avail if not self.breakers[p].is_open()]
+
+    def breaker_metrics(self) -> Dict[str, Dict[str, Any]]:
+        return {p: b.metrics() for p, b in self.breakers.items()}
+
+    def _client_for(self, provider: str, model: Optional[str] = None):
+        # otro modelo del mismo proveedor: cliente propio, pero breaker/limiter/stats del proveedor
+        if not model or model == self._clients.model(provider):
+            return self._clients[provider]
+        key = (provider, model)
+        if key not in self._model_clients:
+            self._model_clients[key] = client_class(provider)(model=model)
+        return self._model_clients[key]
+
+    async def _call_guarded(self, provider: str, query: str, client=None) -> Dict[str, Any]:
+        client = client or self._clients[provider]
+        breaker = self.breakers[provider]
+        if not breaker.allow():
+            inc("breaker_rejections_total", provider=provider)
+            return {"ok": False, "provider": provider, "model": client.model,
+                    "error": f"circuit open for {provider}", "error_type": "CircuitOpen"}
+        try:
+            res = await self._call_observed(provider, query, client)
+        except asyncio.CancelledError:
+            breaker.release()
+            raise
+        breaker.record(bool(res.get("ok")))
+        return res
+
+    async def _call_limited(self, provider: str, query: str, client=None) -> Dict[str, Any]:
+        client = client or self._clients[provider]
+        limiter = self.limiters.get(provider)
+        if limiter is None:
+            return await client.analyze(query)
+        est = estimate_tokens(query) + PROMPT_OVERHEAD_TOKENS + EXPECTED_OUT_TOKENS
+        waited = await limiter.acquire(est)
+        observe("rate_limit_wait_ms", waited*1000, provider=provider)
+        # cancelada (hedge perdedor, ensemble ya decidido) o con excepción: se devuelve la reserva
+        actual = 0
+        try:
+            res = await client.analyze(query)
+            actual = (res.get("usage") or {}).get("total")
+        finally:
+            limiter.settle(est, actual)
+        if waited:
+            res["rate_limit_wait_ms"] = round(waited*1000, 1)
+        return res
+
+    async def _call_observed(self, provider: str, query: str, client=None) -> Dict[str, Any]:
+        client = client or self._clients[provider]
+        # incluye esperas de rate limit, reintentos y parseo (los intentos sueltos son llm.attempt)
+        with span("mm.call", provider=provider, model=client.model):
+            res = await self._call_limited(provider, query, client)
+        record_llm_result(res)
+        self.stats.observe(
+            provider, client.model,
+            ok=bool(res.get("ok")),
+            latency_ms=res.get("latency_ms"),
+            est_in_tokens=estimate_tokens(query) + PROMPT_OVERHEAD_TOKENS,
+            actual_in_tokens=(res.get("usage") or {}).get("prompt"),
+        )
+        return res
+
+    def save_stats(self, path: Optional[str] = None) -> None:
+        path = path or self.stats_path
+        if path:
+            self.stats.save(path)
+
+    async def _run(self, provider: str, query: str, client=None) -> Dict[str, Any]:
+        client = client or self._clients[provider]
+        if self.cache is None:
+            return await self._call_guarded(provider, query, client)
+        start = time.perf_counter()
+        key = self.cache.key(provider, client.model, query)
+        hit = await self.cache.aget(key)
+        inc("response_cache_total", result="hit" if hit is not None else "miss", provider=provider, model=client.model)
+        if hit is not None:
+            return as_hit(hit, round((time.perf_counter()-start)*1000, 3))
+        res = await self._call_guarded(provider, query, client)
+        res["cache"] = "miss"
+        if res.get("ok") and res.get("parsed") is not None:
+            self.cache.put(key, res)
+        return res
+
+    def cache_stats(self) -> Dict[str, Any]:
+        return self.cache.stats() if self.cache is not None else {}
+
+    def hedge_delay_ms(self, provider: str) -> float:
+        fixed = os.getenv("HEDGE_DELAY_MS")
+        if fixed:
+            return float(fixed)
+        e = self.stats.get(provider, self._clients.model(provider))
+        if e is None or e["p95_latency_ms"] is None:
+            return DEFAULT_HEDGE_DELAY_MS
+        return e["p95_latency_ms"]
+
+    @traced("mm.hedged")
+    async def analyze_hedged(
+        self,
+        query: str,
+        providers: Optional[List[str]] = None,
+        *,
+        delay_ms: Optional[float] = None,
+        max_hedges: int = 1,
+    ) -> Tuple[Optional[Dict[str, Any]], Dict[str, Any]]:
+        """Send to the preferred provider; if it has not answered after `delay_ms` (default: its
+        observed p95) or fails, send to the next one. The first valid parsed response wins and the
+        rest are cancelled. delay_ms=0 races all candidates at once."""
+        avail = self._available()
+        order = [p for p in (providers or AUTO_ORDER) if p in avail][:max_hedges + 1]
+        if not order:
+            return None, {"winner": None, "launched": [], "reason": "no provider available"}
+
+        in_tok = estimate_tokens(query) + PROMPT_OVERHEAD_TOKENS
+        pending: Dict[asyncio.Task, str] = {}
+        launched: List[str] = []
+        finished: Dict[str, Dict[str, Any]] = {}
+        winner = None
+
+        def launch():
+            p = order[len(launched)]
+            launched.append(p)
+            pending[asyncio.create_task(self._run(p, query))] = p
+
+        launch()
+        if delay_ms == 0:
+            while len(launched) < len(order):
+                launch()
+        delay = delay_ms if delay_ms is not None else self.hedge_delay_ms(order[0])
+        try:
+            while pending:
+                can_hedge = len(launched) < len(order)
+                done, _ = await asyncio.wait(pending, timeout=delay/1000 if can_hedge else None,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    launch()
+                    continue
+                for task in done:
+                    p = pending.pop(task)
+                    res = task.result()
+                    finished[p] = res
+                    if winner is None and res.get("ok") and validate_sentiment(res.get("parsed")):
+                        winner = p
+                if winner is not None:
+                    break
+                # respuesta fallida o inválida: se pasa al siguiente sin esperar el retardo
+                if len(launched) < len(order):
+                    launch()
+        finally:
+            cancelled = list(pending.values())
+            for task in pending:
+                task.cancel()
+            # se espera a que terminen de cancelarse (liberan breaker y conexión)
+            await asyncio.gather(*pending, return_exceptions=True)
+
+        chosen = winner or launched[0]
+        # las peticiones canceladas en vuelo pueden facturarse igualmente: se estima su coste
+        hedge_cost = 0.0
+        for p in launched:
+            if p == chosen:
+                continue
+            if p in finished:
+                hedge_cost += finished[p].get("cost_usd") or 0.0
+            else:
+                hedge_cost += estimate_cost(p, self._clients.model(p), in_tok, EXPECTED_OUT_TOKENS) or 0.0
+        res = finished.get(chosen)
+        win_cost = (res or {}).get("cost_usd") or 0.0
+        meta = {
+            "winner": winner,
+            "launched": launched,
+            "cancelled": cancelled,
+            "delay_ms": round(delay, 1),
+            "hedge_cost_usd": round(hedge_cost, 6),
+            "total_cost_usd": round(win_cost + hedge_cost, 6),
+        }
+        if res is None:
+            res = {"ok": False, "provider": chosen, "error": "no valid response from any provider", "error_type": "HedgeFailed"}
+        return res, meta
+
+    @traced("mm.ensemble")
+    async def analyze_ensemble(
+        self,
+        query: str,
+        providers: Optional[List[str]] = None,
+        *,
+        quorum: Optional[int] = None,
+        weights: Optional[Dict[str, float]] = None,
+    ) -> Tuple[Optional[Dict[str, Any]], Dict[str, Any]]:
+        """Weighted vote across providers that stops as soon as the outcome is decided.
+
+        All providers start at once; each valid answer is counted as it arrives. The vote ends
+        when `quorum` providers agree or the pending ones can no longer change the leading
+        label, and the remaining calls are cancelled (their cost is estimated, as in hedging).
+        """
+        weights = weights or self.ensemble_weights
+        quorum = self.ensemble_quorum if quorum is None else quorum
+        avail = self._available()
+        order = [p for p in (providers or AUTO_ORDER) if p in avail]
+        if not order:
+            return None, {"decided_by": None, "launched": [], "reason": "no provider available"}
+
+        start = time.perf_counter()
+        pending = {asyncio.create_task(self._run(p, query)): p for p in order}
+        finished: Dict[str, Dict[str, Any]] = {}
+        votes: Dict[str, Dict[str, Any]] = {}
+        decided_by = None
+        try:
+            while pending:
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    p = pending.pop(task)
+                    res = task.result()
+                    finished[p] = res
+                    if res.get("ok") and validate_sentiment(res.get("parsed")):
+                        votes[p] = res["parsed"]
+                decided_by = stop_reason({p: (v["sentiment"], v["confidence"]) for p, v in votes.items()},
+                                         pending.values(), weights, quorum)
+                if decided_by:
+                    break
+        finally:
+            cancelled = list(pending.values())
+            for task in pending:
+                task.cancel()
+            # se espera a que terminen de cancelarse (liberan breaker, limitador y conexión)
+            await asyncio.gather(*pending, return_exceptions=True)
+
+        in_tok = estimate_tokens(query) + PROMPT_OVERHEAD_TOKENS
+        cost = sum(r.get("cost_usd") or 0.0 for r in finished.values())
+        cost += sum(estimate_cost(p, self._clients.model(p), in_tok, EXPECTED_OUT_TOKENS) or 0.0 for p in cancelled)
+        meta = {
+            "decided_by": decided_by or ("all" if votes else None),
+            "finished": list(finished),
+            "cancelled": cancelled,
+            "votes": {p: v["sentiment"] for p, v in votes.items()},
+            "weights": {p: weights.get(p) for p in order},
+            "total_cost_usd": round(cost, 6),
+        }
+        if not votes:
+            return {"ok": False, "provider": "ensemble", "error": "no valid response from any provider",
+                    "error_type": "EnsembleFailed"}, meta
+        t = tally({p: (v["sentiment"], v["confidence"]) for p, v in votes.items()}, weights)
+        meta.update(reliability=t["reliability"], scores=t["scores"])
+        return {
+            "ok": True,
+            "provider": "ensemble",
+            "model": "+".join(votes),
+            "parsed": merge_parsed(votes, t["label"], t["scores"]),
+            "latency_ms": round((time.perf_counter()-start)*1000, 1),
+            "cost_usd": round(cost, 6),
+        }, meta
+
+    def _pick(self, provider: str, query: str, exclude: List[str]) -> Tuple[str, Optional[Dict[str, Any]]]:
+        avail = [p for p in self._available() if p not in exclude]
+        if provider == "auto":
+            for cand in AUTO_ORDER:
+                if cand in avail:
+                    return cand, None
+            return "stub", None
+        available = [(p, self._clients.model(p)) for p in ("openai", "deepseek", "anthropic", "local") if p in avail]
+        if not available:
+            return "stub", None
+        slo = os.getenv("ROUTER_LATENCY_SLO_MS")
+        choice = choose_provider(
+            query, available, target=ROUTING_TARGETS[provider], stats=self.stats,
+            latency_slo_ms=float(slo) if slo else None,
+            cost_weight=float(os.getenv("ROUTER_COST_WEIGHT", 0.5)),
+        )
+        inc("router_decisions_total", target=ROUTING_TARGETS[provider], provider=choice["provider"])
+        return choice["provider"], choice
 
+    @traced("mm.cascade")
+    async def analyze_cascade(self, query: str) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """Run the cascade stages in order and stop at the first valid, confident answer.
+
+        Returns (response, meta); meta has the answering `stage`, every stage tried with the
+        reason it escalated, and the cost/latency summed over all of them. If no stage is
+        confident, the last valid response wins (stage marked `exhausted`).
+        """
+        cfg = self.cascade
+        tried: List[Dict[str, Any]] = []
+        best: Optional[Tuple[str, Dict[str, Any]]] = None
+        answered = None
+        total_cost = total_ms = 0.0
+        for i, stage in enumerate(cfg.stages):
+            last = i == len(cfg.stages) - 1
+            if stage == "rule":
+                res = rule_response(query)
+                # sin términos del léxico no hay señal: se escala aunque sea la última etapa
+                threshold = cfg.rule_confidence if res["hits"] else float("inf")
+            else:
+                if stage == "cheap":
+                    provider, _ = self._pick("cost-aware", query, exclude=[])
+                    model = None
+                else:
+                    provider, _, model = stage.partition(":")
+                if provider not in self._available():
+                    tried.append({"stage": stage, "skipped": "unavailable"})
+                    continue
+                res = await self._run(provider, query, self._client_for(provider, model or None))
+                threshold = cfg.min_confidence
+            total_cost += res.get("cost_usd") or 0.0
+            total_ms += res.get("latency_ms") or 0.0
+            reason = escalation_reason(res, threshold)
+            tried.append({"stage": stage, "provider": res.get("provider"), "model": res.get("model"),
+                          "escalated": reason if reason else None})
+            if reason in (None, "low_confidence"):
+                best = (stage, res)
+            if reason is None:
+                answered = stage
+                break
+        stage, res = best if best is not None else (None, None)
+        if res is None:
+            res = {"ok": False, "provider": "cascade", "error": "no stage produced a valid response", "error_type": "CascadeFailed"}
+        meta = {
+            "stage": answered or ("exhausted" if stage else None),
+            "answered_by": stage,
+            "stages": tried,
+            "total_cost_usd": round(total_cost, 6),
+            "total_latency_ms": round(total_ms, 1),
+        }
+        return res, meta
+
+    @traced("mm.analyze_with_routing")
     async def analyze_with_routing(
     self,
     query: str,
     task_type: str = "news",
-    provider: str = "stub",        # "openai" | "anthropic" | "deepseek" | "auto" | "cost-aware" | "stub"
+    provider: str = "stub",        # "openai" | "anthropic" | "deepseek" | "local" | "auto" | "cost-aware" | "fastest"
+                                   # | "cheapest-under-slo" | "balanced" | "hedged" | "race" | "cascade"
+                                   # | "ensemble" | "stub"
     ) -> Dict[str, Any]:
 
         decision = provider
         routing_meta = None
 
-        # Selección automática por disponibilidad
-        if provider == "auto":
-            for cand in ["openai", "deepseek", "anthropic"]:
-                if cand in self._available():
-                    decision = cand
-                    break
-            else:
-                decision = "stub"
+        # Selección automática (por disponibilidad) o por coste/latencia; descarta circuitos abiertos
+        if provider == "auto" or provider in ROUTING_TARGETS:
+            decision, routing_meta = self._pick(provider, query, exclude=[])
 
-        # Selección optimizada por coste 
-        elif provider == "cost-aware":
-            available = []
-            if getattr(self.openai, "api_key", None):     available.append(("openai", self.openai.model))
-            if getattr(self.deepseek, "api_key", None):   available.append(("deepseek", self.deepseek.model))
-            if getattr(self.anthropic, "api_key", None):  available.append(("anthropic", self.anthropic.model))
-            if available:
-                choice = choose_provider(query, available, target="cheapest")
-                decision = choice["provider"]
-                routing_meta = choice
+        # Cascada: reglas -> modelo barato -> modelo fuerte, escalando sólo si falta confianza
+        elif provider == "cascade":
+            res, routing_meta = await self.analyze_cascade(query)
+            return {
+                "router_decision": res.get("provider", provider),
+                "response": res,
+                "keys_status": env_keys_status(),
+                "routing_meta": routing_meta,
+                "task_type": task_type,
+            }
+
+        # Ensemble: voto ponderado que termina en cuanto hay quorum o el resultado ya no puede cambiar
+        elif provider == "ensemble":
+            res, routing_meta = await self.analyze_ensemble(query)
+            if res is None:
+                decision = "stub"
             else:
+                return {
+                    "router_decision": "ensemble",
+                    "response": res,
+                    "keys_status": env_keys_status(),
+                    "routing_meta": routing_meta,
+                    "task_type": task_type,
+                }
+
+        # Hedged: backup tras un retardo; race: todos a la vez. Gana la primera respuesta válida
+        elif provider in ("hedged", "race"):
+            race = provider == "race"
+            res, routing_meta = await self.analyze_hedged(
+                query, delay_ms=0 if race else None, max_hedges=len(AUTO_ORDER) if race else 1)
+            if res is None:
                 decision = "stub"
+            else:
+                return {
+                    "router_decision": routing_meta["winner"] or provider,
+                    "response": res,
+                    "keys_status": env_keys_status(),
+                    "routing_meta": routing_meta,
+                    "task_type": task_type,
+                }
 
-        # Ejecutamos la decisión
-        if decision == "openai":
-            res = await self.openai.analyze(query)
-        elif decision == "anthropic":
-            res = await self.anthropic.analyze(query)
-        elif decision == "deepseek":
-            res = await self.deepseek.analyze(query)
+        # Ejecutamos la decisión; en auto/routing, si falla se pasa al siguiente candidato sin esperar
+        if decision in self._clients:
+            res = await self._run(decision, query)
+            failed = []
+            while not res.get("ok") and (provider == "auto" or provider in ROUTING_TARGETS):
+                failed.append(decision)
+                nxt, meta = self._pick(provider, query, exclude=failed)
+                if nxt not in self._clients:
+                    break
+                decision, routing_meta = nxt, meta
+                res = await self._run(decision, query)
+            if failed:
+                routing_meta = {**(routing_meta or {}), "failover_from": failed}
         else:
             return {
                 "router_decision": "stub",
@@ -81,12 +466,8 @@ class MultiModelAnalyzer:
     
     async def analyze_all_providers(self, query: str) -> Dict[str, Any]:
         tasks, providers = [], []
-        if getattr(self.openai, "api_key", None):
-            tasks.append(self.openai.analyze(query)); providers.append("openai")
-        if getattr(self.anthropic, "api_key", None):
-            tasks.append(self.anthropic.analyze(query)); providers.append("anthropic")
-        if getattr(self.deepseek, "api_key", None):
-            tasks.append(self.deepseek.analyze(query)); providers.append("deepseek")
+        for p in self._available():
+            tasks.append(self._run(p, query)); providers.append(p)
 
         if not tasks:
             return {"available": [], "results": {}, "keys_status": env_keys_status()}
@@ -98,3 +479,159 @@ class MultiModelAnalyzer:
             "keys_status": env_keys_status()
         }
 
+    async def _pack_guarded(self, provider: str, client, texts: List[str]) -> List[Dict[str, Any]]:
+        # un paquete = una petición: un permiso del breaker y una reserva RPM/TPM para todo el paquete
+        breaker = self.breakers[provider]
+        if not breaker.allow():
+            return [{"ok": False, "provider": provider, "model": client.model,
+                     "error": f"circuit open for {provider}", "error_type": "CircuitOpen"} for _ in texts]
+        limiter = self.limiters.get(provider)
+        est = PACKED_INSTR_TOKENS + sum(estimate_tokens(t) for t in texts) + len(texts)*EXPECTED_OUT_TOKENS
+        reserved, actual = False, 0
+        try:
+            if limiter is not None:
+                await limiter.acquire(est)
+                reserved = True
+            with span("mm.call", provider=provider, model=client.model, packed=len(texts)):
+                res = await client.analyze_pack(texts)
+            actual = sum((r.get("usage") or {}).get("total") or 0 for r in res) or None
+        except asyncio.CancelledError:
+            breaker.release()
+            raise
+        finally:
+            if reserved:
+                limiter.settle(est, actual)
+        breaker.record(any(r.get("ok") for r in res))
+        # una observación por petición empaquetada (métricas de peticiones/tokens/coste y router)
+        summary = pack_summary(provider, client.model, res)
+        record_llm_result(summary)
+        self.stats.observe(
+            provider, client.model,
+            ok=summary["ok"],
+            latency_ms=summary.get("latency_ms"),
+            est_in_tokens=PACKED_INSTR_TOKENS + sum(estimate_tokens(t) for t in texts),
+            actual_in_tokens=summary["usage"].get("prompt"),
+        )
+        return res
+
+    @traced("mm.packed")
+    async def analyze_packed(
+        self,
+        texts: List[str],
+        provider: str = "auto",
+        *,
+        max_items: Optional[int] = None,
+        concurrency: int = 8,
+    ) -> Tuple[str, List[Dict[str, Any]]]:
+        """Analyze `texts` with several headlines per request (one provider for the batch).
+
+        Cached items are answered from the cache; the rest go out in packs sized by the
+        LLM_PACK_* budgets, and items missing or malformed in a packed answer are retried
+        one by one. Returns (provider, per-item responses in input order).
+        """
+        decision = provider
+        if provider == "auto" or provider in ROUTING_TARGETS:
+            decision, _ = self._pick(provider, texts[0] if texts else "", exclude=[])
+        if decision not in self._clients:
+            return "stub", [{"ok": True, "provider": "stub", "msg": "no external calls"} for _ in texts]
+        client = self._clients[decision]
+
+        out: List[Optional[Dict[str, Any]]] = [None]*len(texts)
+        keys = [None]*len(texts)
+        if self.cache is not None:
+            for i, t in enumerate(texts):
+                keys[i] = self.cache.key(decision, client.model, t)
+                hit = await self.cache.aget(keys[i])
+                if hit is not None:
+                    out[i] = as_hit(hit, 0.0)
+        todo = [i for i, r in enumerate(out) if r is None]
+
+        sem = asyncio.Semaphore(max(1, concurrency))
+        async def pack_fn(batch):
+            async with sem:
+                return await self._pack_guarded(decision, client, batch)
+        async def single_fn(text):
+            async with sem:
+                return await self._run(decision, text)
+
+        res = await run_packed([texts[i] for i in todo], pack_fn, single_fn, max_items=max_items)
+        for i, r in zip(todo, res):
+            if self.cache is not None and not r.get("packed_retry"):
+                r["cache"] = "miss"
+                if r.get("ok") and r.get("parsed") is not None:
+                    self.cache.put(keys[i], r)
+            out[i] = r
+        return decision, out
+
+    async def analyze_batch(
+        self,
+        texts: List[str],
+        provider: str = "stub",
+        concurrency: int = 8,
+        task_type: str = "news",
+        pack: bool = False,
+        dedup: Any = False,
+        timestamps: Optional[Sequence[Optional[float]]] = None,
+    ) -> List[Dict[str, Any]]:
+        """analyze_with_routing over `texts` with at most `concurrency` calls in flight.
+
+        Results keep input order; a failing item yields an error response instead of
+        aborting the batch. pack=True sends several texts per request (see analyze_packed).
+        dedup=True (or a NearDupIndex) calls the model once per group of near-duplicate
+        headlines and copies the result to the other members (see pipelines.dedup);
+        `timestamps` (epoch seconds per text) measure its window in publication time.
+        """
+        if dedup:
+            return await self._analyze_batch_dedup(texts, provider, concurrency, task_type, pack, dedup, timestamps)
+        if pack and provider not in ("stub", "hedged", "race", "cascade", "ensemble"):
+            decision, results = await self.analyze_packed(texts, provider, concurrency=concurrency)
+            return [{"router_decision": decision, "response": r, "keys_status": env_keys_status(), "task_type": task_type}
+                    for r in results]
+        sem = asyncio.Semaphore(max(1, concurrency))
+
+        async def one(text: str) -> Dict[str, Any]:
+            async with sem:
+                try:
+                    return await self.analyze_with_routing(text, task_type=task_type, provider=provider)
+                except Exception as e:
+                    return {
+                        "router_decision": provider,
+                        "response": {"ok": False, "provider": provider, "error": str(e), "error_type": type(e).__name__},
+                        "task_type": task_type,
+                    }
+
+        return await asyncio.gather(*(one(t) for t in texts))
+
+    def dedup_index(self):
+        """Near-duplicate index shared by this analyzer's batches (DEDUP_* settings)."""
+        if self._dedup is None:
+            from src.pipelines.dedup import NearDupIndex
+            self._dedup = NearDupIndex()
+        return self._dedup
+
+    async def _analyze_batch_dedup(self, texts, provider, concurrency, task_type, pack, dedup,
+                                   timestamps=None) -> List[Dict[str, Any]]:
+        from src.pipelines.dedup import member_result
+        index = dedup if dedup is not True else self.dedup_index()
+        groups = [gid for gid, _ in index.assign_batch(texts, ts=timestamps)]
+        # representante = primer miembro del lote cuyo grupo no tiene ya un resultado guardado
+        reps: Dict[str, int] = {}
+        known: Dict[str, Dict[str, Any]] = {}
+        for i, gid in enumerate(groups):
+            if gid in reps or gid in known:
+                continue
+            stored = index.result(gid)
+            if stored is None:
+                reps[gid] = i
+            else:
+                known[gid] = stored
+        fresh = await self.analyze_batch([texts[i] for i in reps.values()], provider, concurrency, task_type, pack)
+        for gid, res in zip(reps, fresh):
+            known[gid] = res
+            if (res.get("response") or {}).get("ok"):
+                index.remember(gid, res)
+        return [
+            {**known[gid], "dedup": {"group": gid, "representative": True}} if reps.get(gid) == i
+            else member_result(known[gid], gid)
+            for i, gid in enumerate(groups)
+        ]
@@ -0,0 +1,119 @@
+import os, asyncio, time
+from typing import Dict, Optional
+
+class TokenBucket:
+    """Async token bucket refilled continuously at `rate_per_min`.
+
+    `acquire` reserves `amount` tokens immediately and sleeps until the bucket
+    would have refilled them, so waiters are served in arrival order without a lock.
+    `adjust` charges or refunds tokens once the real consumption is known.
+    """
+
+    def __init__(self, rate_per_min: float, capacity: Optional[float] = None):
+        self.rate = rate_per_min / 60.0
+        self.capacity = capacity if capacity is not None else rate_per_min
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount: float = 1.0) -> float:
+        self._refill()
+        self.tokens -= min(amount, self.capacity)
+        if self.tokens >= 0:
+            return 0.0
+        delay = -self.tokens / self.rate
+        await asyncio.sleep(delay)
+        return delay
+
+    def adjust(self, amount: float) -> None:
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens - amount)
+
+
+class SharedTokenBucket(TokenBucket):
+    """TokenBucket whose state lives in shared memory, so every process that inherits it
+    (multiprocessing initargs) draws from the same budget.
+
+    Reservations take a cross-process lock for a few arithmetic operations; the sleep
+    happens outside it. time.monotonic() is system-wide, so all processes agree on refills.
+    """
+
+    def __init__(self, rate_per_min: float, capacity: Optional[float] = None, ctx=None):
+        import multiprocessing as mp
+        self.rate = rate_per_min / 60.0
+        self.capacity = capacity if capacity is not None else rate_per_min
+        # [tokens, updated]
+        self._state = (ctx or mp).Array("d", [self.capacity, time.monotonic()])
+
+    def _take(self, amount: float) -> float:
+        with self._state.get_lock():
+            st = self._state
+            now = time.monotonic()
+            st[0] = min(self.capacity, st[0] + (now - st[1]) * self.rate) - amount
+            st[1] = now
+            return st[0]
+
+    @property
+    def tokens(self) -> float:
+        return self._take(0.0)
+
+    async def acquire(self, amount: float = 1.0) -> float:
+        left = self._take(min(amount, self.capacity))
+        if left >= 0:
+            return 0.0
+        delay = -left / self.rate
+        await asyncio.sleep(delay)
+        return delay
+
+    def adjust(self, amount: float) -> None:
+        with self._state.get_lock():
+            self._take(0.0)
+            self._state[0] = min(self.capacity, self._state[0] - amount)
+
+
+class ProviderLimiter:
+    """Requests/min + tokens/min limits for one provider (either may be None = unlimited)."""
+
+    def __init__(self, rpm: Optional[float] = None, tpm: Optional[float] = None, bucket=TokenBucket):
+        self.requests = bucket(rpm) if rpm else None
+        self.tokens = bucket(tpm) if tpm else None
+
+    @classmethod
+    def from_env(cls, provider: str, bucket=TokenBucket) -> Optional["ProviderLimiter"]:
+        rpm = os.getenv(f"{provider.upper()}_RPM")
+        tpm = os.getenv(f"{provider.upper()}_TPM")
+        if not rpm and not tpm:
+            return None
+        return cls(float(rpm) if rpm else None, float(tpm) if tpm else None, bucket)
+
+    async def acquire(self, est_tokens: int) -> float:
+        waited = 0.0
+        if self.requests is not None:
+            waited += await self.requests.acquire(1)
+        if self.tokens is not None:
+            try:
+                waited += await self.tokens.acquire(est_tokens)
+            except asyncio.CancelledError:
+                # cancelada durante la espera: el bucket ya había descontado la reserva
+                self.tokens.adjust(-min(est_tokens, self.tokens.capacity))
+                raise
+        return waited
+
+    def settle(self, est_tokens: int, actual_tokens: Optional[int]) -> None:
+        if self.tokens is not None and actual_tokens is not None:
+            self.tokens.adjust(actual_tokens - est_tokens)
+
+
+def limiters_from_env(providers, shared: bool = False) -> Dict[str, ProviderLimiter]:
+    """Limiters for the providers with PROVIDER_RPM/TPM set. `shared=True` builds them on
+    SharedTokenBucket: create them in the parent and hand them to worker processes."""
+    out = {}
+    for p in providers:
+        lim = ProviderLimiter.from_env(p, SharedTokenBucket if shared else TokenBucket)
+        if lim is not None:
+            out[p] = lim
+    return out
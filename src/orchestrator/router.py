@@ -1,5 +1,13 @@
+import os, json, threading
+from collections import deque
 from typing import Dict, List, Optional, Tuple
 from src.benchmarking.pricing import price_for
+from src.observability.metrics import traced
+
+# Latencias de partida (ms) hasta tener observaciones propias (tests/quick_benchmark.csv)
+PRIOR_LATENCY_MS = {"openai": 1900.0, "anthropic": 1450.0, "deepseek": 5500.0, "local": 60.0}
+DEFAULT_PRIOR_LATENCY_MS = 2000.0
+MIN_TAIL_SAMPLES = 20
 
 def estimate_tokens (text: str) -> int:
     # ~ 1.3 token per word
@@ -10,6 +18,116 @@ def estimate_cost (provider:str, model: str, in_tokens: int, out_tokens: int, *,
     if not p: return None
     return in_tokens * p["in"] + out_tokens * p["out"]
 
+
+class ProviderStats:
+    """Online, decaying statistics per (provider, model), fed from real responses.
+
+    EWMA latency, error rate and actual/estimated prompt-token ratio, plus a sliding
+    window of recent latencies for tail percentiles. Persistable as JSON.
+    """
+
+    def __init__(self, alpha: float = 0.2, window: int = 200):
+        self.alpha = alpha
+        self.window = window
+        self._lock = threading.Lock()
+        self._s: Dict[str, Dict] = {}
+
+    @staticmethod
+    def _key(provider: str, model: Optional[str]) -> str:
+        return f"{provider}:{model or ''}"
+
+    def _entry(self, key: str) -> Dict:
+        e = self._s.get(key)
+        if e is None:
+            e = {"n": 0, "errors": 0, "ewma_latency_ms": None, "error_rate": 0.0,
+                 "token_ratio": 1.0, "recent": deque(maxlen=self.window)}
+            self._s[key] = e
+        return e
+
+    def _ewma(self, old: Optional[float], x: float) -> float:
+        return x if old is None else (1 - self.alpha)*old + self.alpha*x
+
+    def observe(
+        self,
+        provider: str,
+        model: Optional[str],
+        *,
+        ok: bool,
+        latency_ms: Optional[float] = None,
+        est_in_tokens: Optional[int] = None,
+        actual_in_tokens: Optional[int] = None,
+    ) -> None:
+        with self._lock:
+            e = self._entry(self._key(provider, model))
+            e["n"] += 1
+            e["error_rate"] = self._ewma(e["error_rate"], 0.0 if ok else 1.0)
+            if not ok:
+                e["errors"] += 1
+                return
+            if latency_ms is not None:
+                e["ewma_latency_ms"] = self._ewma(e["ewma_latency_ms"], float(latency_ms))
+                e["recent"].append(float(latency_ms))
+            if est_in_tokens and actual_in_tokens:
+                e["token_ratio"] = self._ewma(e["token_ratio"], actual_in_tokens/est_in_tokens)
+
+    def get(self, provider: str, model: Optional[str]) -> Optional[Dict]:
+        with self._lock:
+            e = self._s.get(self._key(provider, model))
+            if e is None:
+                return None
+            out = {k: v for k, v in e.items() if k != "recent"}
+            lat = sorted(e["recent"])
+            out["p95_latency_ms"] = lat[int(0.95*(len(lat)-1))] if len(lat) >= MIN_TAIL_SAMPLES else None
+            return out
+
+    def expected_latency_ms(self, provider: str, model: Optional[str]) -> float:
+        e = self.get(provider, model)
+        if e is None or e["ewma_latency_ms"] is None:
+            return PRIOR_LATENCY_MS.get(provider, DEFAULT_PRIOR_LATENCY_MS)
+        return e["ewma_latency_ms"]
+
+    def tail_latency_ms(self, provider: str, model: Optional[str]) -> float:
+        e = self.get(provider, model)
+        if e is not None and e["p95_latency_ms"] is not None:
+            return e["p95_latency_ms"]
+        # sin muestras suficientes: aproximación conservadora
+        return 2.0*self.expected_latency_ms(provider, model)
+
+    def snapshot(self) -> Dict[str, Dict]:
+        with self._lock:
+            keys = list(self._s)
+        out = {}
+        for k in keys:
+            provider, _, model = k.partition(":")
+            e = self.get(provider, model)
+            out[k] = {kk: (round(v, 4) if isinstance(v, float) else v) for kk, v in e.items()}
+        return out
+
+    def save(self, path: str) -> None:
+        with self._lock:
+            state = {"alpha": self.alpha, "window": self.window,
+                     "stats": {k: {**{kk: vv for kk, vv in e.items() if kk != "recent"}, "recent": list(e["recent"])}
+                               for k, e in self._s.items()}}
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: Optional[str]) -> "ProviderStats":
+        if not path or not os.path.exists(path):
+            return cls()
+        with open(path, encoding="utf-8") as f:
+            state = json.load(f)
+        st = cls(alpha=state.get("alpha", 0.2), window=state.get("window", 200))
+        for k, e in state.get("stats", {}).items():
+            e["recent"] = deque(e.get("recent", []), maxlen=st.window)
+            st._s[k] = e
+        return st
+
+
+@traced("router.choose_provider")
 def choose_provider (
         text: str,
         available: List[Tuple[str, str]],
@@ -18,28 +136,60 @@ def choose_provider (
         expected_out_tokens: int = 120,
         sensitive: bool = False,
         budget_per_call_usd: Optional[float] = None,
+        stats: Optional[ProviderStats] = None,
+        latency_slo_ms: Optional[float] = None,
+        cost_weight: float = 0.5,
 ) -> Dict:
+    """target: "cheapest" | "fastest" | "cheapest-under-slo" (needs latency_slo_ms) | "balanced"
+    (cost_weight*cost + (1-cost_weight)*latency, each normalized to the best candidate)."""
     if sensitive:
         for prov, model in available:
             if prov == "anthropic":
                 in_tok = estimate_tokens(text)
                 cost = estimate_cost(prov, model, in_tok, expected_out_tokens) or 0.0
                 return {"provider": prov, "model": model, "reason": "sensitive->anthropic", "est_cost_usd": round(cost, 6)}
-    
+
     in_tok = estimate_tokens(text)
-    scores = []
+    cands = []
     for prov, model in available:
-        cost = estimate_cost(prov, model, in_tok, expected_out_tokens) or 1e9
+        e = stats.get(prov, model) if stats is not None else None
+        ratio = e["token_ratio"] if e else 1.0
+        cost = estimate_cost(prov, model, int(in_tok*ratio), expected_out_tokens)
+        # sin precio conocido: último recurso (un coste 0.0 es válido: proveedor local)
+        cost = 1e9 if cost is None else cost
         if budget_per_call_usd is not None and cost > budget_per_call_usd:
             continue
+        # coste/latencia esperados por llamada con éxito: los reintentos por error también cuentan
+        success = max(0.05, 1.0 - (e["error_rate"] if e else 0.0))
+        lat = stats.expected_latency_ms(prov, model) if stats is not None else PRIOR_LATENCY_MS.get(prov, DEFAULT_PRIOR_LATENCY_MS)
+        tail = stats.tail_latency_ms(prov, model) if stats is not None else 2.0*lat
         lat_bonus = 0.0
-        if prov == "openai": lat_bonus = -0.00003
-        if prov == "anthropic": lat_bonus  =-0.00002
-        scores.append((cost + lat_bonus, prov, model, cost))
+        if e is None:
+            # sin observaciones: se mantiene el desempate fijo histórico
+            if prov == "openai": lat_bonus = -0.00003
+            if prov == "anthropic": lat_bonus  =-0.00002
+        cands.append({"provider": prov, "model": model, "cost": cost, "exp_cost": cost/success + lat_bonus,
+                      "lat": lat/success, "tail": tail})
 
-    if not scores:
+    if not cands:
         return {"provider": "stub", "model": None, "reason": "no provider within budget", "est_cost_usd": 0.0}
-    
-    scores.sort(key=lambda x: x[0])
-    best = scores[0]
-    return {"provider": best[1], "model": best[2], "reason": f"{target}", "est_cost_usd": round(best[3], 6)}
\ No newline at end of file
+
+    reason = target
+    if target == "fastest":
+        best = min(cands, key=lambda c: c["lat"])
+    elif target == "cheapest-under-slo":
+        slo = latency_slo_ms if latency_slo_ms is not None else float("inf")
+        within = [c for c in cands if c["tail"] <= slo]
+        if within:
+            best = min(within, key=lambda c: c["exp_cost"])
+        else:
+            best = min(cands, key=lambda c: c["tail"])
+            reason = f"{target}: no provider meets {slo:.0f} ms, fastest tail"
+    elif target == "balanced":
+        min_cost = min(max(c["cost"], 1e-12) for c in cands)
+        min_lat = min(max(c["lat"], 1e-6) for c in cands)
+        best = min(cands, key=lambda c: cost_weight*c["cost"]/min_cost + (1-cost_weight)*c["lat"]/min_lat)
+    else:
+        best = min(cands, key=lambda c: c["exp_cost"])
+    return {"provider": best["provider"], "model": best["model"], "reason": reason,
+            "est_cost_usd": round(best["cost"], 6), "est_latency_ms": round(best["lat"], 1)}
@@ -0,0 +1,323 @@
+import io, os, sys, json, time, asyncio
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, List, Optional
+from src.clients.transport import closing_pools
+from src.pipelines.stream import READ_ERROR, Checkpoint, read_records, run_stream
+
+# Reprocesado de archivos históricos en paralelo: el JSONL de entrada se parte en rangos de bytes
+# (shards) alineados a líneas y cada proceso del pool ejecuta run_stream sobre un shard con su
+# propio event loop, analizador y checkpoint. Los límites RPM/TPM se comparten entre procesos.
+# Con RAG el índice se construye/sincroniza una vez en el proceso padre; los workers sólo lo abren.
+PLAN_FILE = "plan.json"
+
+@dataclass
+class Shard:
+    index: int
+    start: int
+    end: int
+
+    @property
+    def name(self) -> str:
+        return f"shard-{self.index:05d}"
+
+
+def plan_shards(path: str, n: int) -> List[Shard]:
+    """Split `path` into at most `n` byte ranges that start at line boundaries."""
+    size = os.path.getsize(path)
+    cuts = [0]
+    with open(path, "rb") as f:
+        for i in range(1, max(1, n)):
+            f.seek(max(size*i//n, cuts[-1]))
+            if f.tell():
+                # el corte cae dentro de una línea: se avanza al comienzo de la siguiente
+                f.seek(f.tell() - 1)
+                f.readline()
+            pos = f.tell()
+            if cuts[-1] < pos < size:
+                cuts.append(pos)
+    cuts.append(size)
+    return [Shard(i, a, b) for i, (a, b) in enumerate(zip(cuts, cuts[1:]))]
+
+def load_plan(input_path: str, out_dir: str, shards: int) -> List[Shard]:
+    """Shard plan of a backfill directory; created on the first run and reused on resume.
+    Resuming against a different input (path, size or mtime) is refused."""
+    st = os.stat(input_path)
+    ident = {"input": os.path.abspath(input_path), "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+    path = os.path.join(out_dir, PLAN_FILE)
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            plan = json.load(f)
+        if {k: plan.get(k) for k in ident} != ident:
+            raise ValueError(f"{out_dir} holds a backfill of another input ({plan.get('input')}); use a new --out-dir")
+        return [Shard(**s) for s in plan["shards"]]
+    plan_list = plan_shards(input_path, shards)
+    os.makedirs(out_dir, exist_ok=True)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump({**ident, "shards": [asdict(s) for s in plan_list]}, f, indent=1)
+    os.replace(path + ".tmp", path)
+    return plan_list
+
+def shard_paths(out_dir: str, shard: Shard) -> Dict[str, str]:
+    base = os.path.join(out_dir, shard.name)
+    return {"output": base + ".jsonl", "checkpoint": base + ".ckpt", "done": base + ".done"}
+
+def shard_done(out_dir: str, shard: Shard) -> Optional[Dict[str, Any]]:
+    try:
+        with open(shard_paths(out_dir, shard)["done"], encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+# estado de cada proceso del pool (fijado por el initializer)
+_worker: Dict[str, Any] = {}
+
+def _init_worker(limiters) -> None:
+    _worker["limiters"] = limiters
+
+def _analyzer(cache_path: str, use_rag: bool = False):
+    from src.orchestrator.cache import ResponseCache
+    from src.orchestrator.multimodel_analyzer import MultiModelAnalyzer
+    from src.pipelines.news_analyzer import FinancialNewsAnalyzer
+    # caché explícita (ni LLM_CACHE=off ni un TTL corto en .env la desactivan): es lo que evita
+    # volver a pagar lo escrito tras el último checkpoint. Escritura síncrona (flush_every=1):
+    # cada respuesta pagada está en disco antes de usarse, aunque el worker muera con SIGKILL
+    cache = ResponseCache(sqlite_path=cache_path, ttl_s=None, flush_every=1)
+    mm = MultiModelAnalyzer(cache=cache, limiters=_worker.get("limiters"))
+    retriever = None
+    if use_rag:
+        from src.pipelines.rag_index import make_retriever
+        # sólo lectura: el padre ya dejó el índice al día (prepare_index)
+        retriever = make_retriever(sync=False)
+    return FinancialNewsAnalyzer(mm=mm, retriever=retriever), mm
+
+def prepare_index() -> None:
+    """Build or sync the RAG index (RAG_BACKEND) once, before the workers open it read-only."""
+    from src.pipelines.rag_index import make_retriever
+    make_retriever().warm_up().close()
+
+def failed(line: Dict[str, Any]) -> bool:
+    """Output line of a record that got no usable model answer (exception or ok=False)."""
+    if "error" in line:
+        return True
+    resp = ((line.get("result") or {}).get("model_result") or {}).get("response") or {}
+    return resp.get("ok") is False
+
+def retry_failed(input_path: str, out_dir: str, shard: Shard, *, cache_path: str, provider: str,
+                 use_rag: bool, window: int, text_field: str) -> int:
+    """Process again the failed records of a finished shard and replace their lines in its
+    output (atomically). Unreadable input lines are not retried. Returns the number retried.
+    The output is streamed twice (failed offsets, then the rewrite): only the retried lines
+    are held in memory."""
+    path = shard_paths(out_dir, shard)["output"]
+    with open(path, encoding="utf-8") as f:
+        todo = sorted(l["offset"] for l in map(json.loads, filter(str.strip, f))
+                      if failed(l) and l.get("error_type") not in ("JSONDecodeError", "UnicodeDecodeError"))
+    if not todo:
+        return 0
+    wanted = set(todo)
+    records = (r for r in read_records(input_path, fmt="jsonl", text_field=text_field, start=todo[0], end=todo[-1] + 1)
+               if r[0] in wanted and READ_ERROR not in r[2])
+    analyzer, mm = _analyzer(cache_path, use_rag)
+    buf = io.StringIO()
+    try:
+        stats = asyncio.run(closing_pools(run_stream(records, analyzer, buf, provider=provider, use_rag=use_rag,
+                                                     window=window, text_field=text_field)))
+    finally:
+        mm.cache.close()
+    redone = {l["offset"]: l for l in map(json.loads, buf.getvalue().splitlines())}
+    del buf
+    with open(path, encoding="utf-8") as src, open(path + ".tmp", "w", encoding="utf-8") as f:
+        for line in src:
+            if not line.strip():
+                continue
+            l = redone.get(json.loads(line)["offset"])
+            if l is not None:
+                line = json.dumps(l, ensure_ascii=False, default=str)
+            f.write(line if line.endswith("\n") else line + "\n")
+        f.flush(); os.fsync(f.fileno())
+    os.replace(path + ".tmp", path)
+    return stats["written"]
+
+def run_shard(input_path: str, out_dir: str, shard: Shard, *, cache_path: str, provider: str, use_rag: bool,
+              window: int, text_field: str, checkpoint_every: int, retry_errors: bool = False) -> Dict[str, Any]:
+    """Process one shard (in a pool worker), resuming from its checkpoint.
+
+    Lines written after the last checkpoint are discarded and their records processed
+    again; their model calls are answered by the SQLite response cache, not re-paid.
+    Failed records count as done; `retry_errors` sends them again once the shard is complete.
+    """
+    paths = shard_paths(out_dir, shard)
+    done = shard_done(out_dir, shard)
+    if done is None:
+        done = _process_shard(input_path, shard, paths, cache_path=cache_path, provider=provider, use_rag=use_rag,
+                              window=window, text_field=text_field, checkpoint_every=checkpoint_every)
+    elif not retry_errors:
+        return done
+    if retry_errors:
+        retried = retry_failed(input_path, out_dir, shard, cache_path=cache_path, provider=provider,
+                               use_rag=use_rag, window=window, text_field=text_field)
+        if retried:
+            with open(paths["output"], encoding="utf-8") as f:
+                errors = sum(failed(json.loads(l)) for l in f if l.strip())
+            done = {**done, "retried": done.get("retried", 0) + retried, "errors": errors}
+    with open(paths["done"] + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(done, f)
+    os.replace(paths["done"] + ".tmp", paths["done"])
+    return done
+
+def _process_shard(input_path: str, shard: Shard, paths: Dict[str, str], *, cache_path: str, provider: str,
+                   use_rag: bool, window: int, text_field: str, checkpoint_every: int) -> Dict[str, Any]:
+    resuming = os.path.exists(paths["checkpoint"]) and os.path.exists(paths["output"])
+    ckpt = Checkpoint(paths["checkpoint"]) if resuming else Checkpoint.fresh(paths["checkpoint"])
+    if resuming:
+        with open(paths["output"], "r+b") as f:
+            f.truncate(ckpt.out_bytes)
+    start = max(shard.start, ckpt.watermark)
+    records = read_records(input_path, fmt="jsonl", text_field=text_field, start=start, end=shard.end)
+    # analizador nuevo por shard: los clientes HTTP quedan ligados al event loop de asyncio.run
+    analyzer, mm = _analyzer(cache_path, use_rag)
+    t0 = time.perf_counter()
+    with open(paths["output"], "a" if resuming else "w", encoding="utf-8") as out:
+        try:
+            stats = asyncio.run(closing_pools(run_stream(
+                records, analyzer, out, provider=provider, use_rag=use_rag,
+                window=window, text_field=text_field, checkpoint=ckpt, checkpoint_every=checkpoint_every,
+            )))
+        finally:
+            cache = mm.cache.stats()
+            mm.cache.close()
+        out.flush()
+        os.fsync(out.fileno())
+    stats.update(shard=shard.index, pid=os.getpid(), resumed=resuming, cache_hits=cache.get("hits", 0),
+                 elapsed_s=round(time.perf_counter() - t0, 2))
+    return stats
+
+
+def merge(out_dir: str, shards: List[Shard], output: str) -> Dict[str, Any]:
+    """Concatenate shard outputs in input order (shard by shard, lines by offset) into
+    `output`. The same archive always merges to the same line order."""
+    lines = cost = 0
+    with open(output + ".tmp", "w", encoding="utf-8") as dst:
+        for shard in shards:
+            by_offset: Dict[int, str] = {}
+            with open(shard_paths(out_dir, shard)["output"], encoding="utf-8") as src:
+                for line in src:
+                    if line.strip():
+                        obj = json.loads(line)
+                        by_offset[obj["offset"]] = line if line.endswith("\n") else line + "\n"
+                        resp = ((obj.get("result") or {}).get("model_result") or {}).get("response") or {}
+                        cost += resp.get("cost_usd") or 0.0
+            for offset in sorted(by_offset):
+                dst.write(by_offset[offset])
+            lines += len(by_offset)
+    os.replace(output + ".tmp", output)
+    return {"output": output, "lines": lines, "cost_usd": round(cost, 6)}
+
+def backfill(
+    input_path: str,
+    out_dir: str,
+    *,
+    output: Optional[str] = None,
+    workers: int = 4,
+    shards: Optional[int] = None,
+    provider: str = "stub",
+    use_rag: bool = False,
+    window: int = 16,
+    text_field: str = "text",
+    checkpoint_every: int = 20,
+    max_restarts: int = 3,
+    retry_errors: bool = False,
+    log=None,
+) -> Dict[str, Any]:
+    """Run (or resume) a sharded backfill of a JSONL archive and merge the results.
+
+    Shards already marked done are skipped; the others resume from their checkpoints.
+    A crashed worker breaks the pool: unfinished shards are resubmitted to a new pool,
+    up to `max_restarts` times. PROVIDER_RPM/TPM limits hold for all workers combined.
+    Model responses always go through a SQLite cache (LLM_CACHE_PATH, default
+    <out_dir>/responses.sqlite) whatever LLM_CACHE says. `retry_errors` sends the failed
+    records of every shard again, including shards finished by an earlier run.
+    """
+    from src.clients.registry import PROVIDERS
+    from src.orchestrator.ratelimit import limiters_from_env
+
+    plan = load_plan(input_path, out_dir, shards or workers*4)
+    # caché de respuestas en disco compartida por los workers: lo procesado tras el último
+    # checkpoint de un worker caído sale de la caché al reanudar (sin volver a pagarlo)
+    cache_path = os.getenv("LLM_CACHE_PATH") or os.path.join(out_dir, "responses.sqlite")
+    limiters = limiters_from_env(PROVIDERS, shared=True)
+    if use_rag:
+        prepare_index()
+    kw = dict(cache_path=cache_path, provider=provider, use_rag=use_rag, window=window, text_field=text_field,
+              checkpoint_every=checkpoint_every, retry_errors=retry_errors)
+    # con --retry-errors también se reabren los shards terminados en ejecuciones anteriores
+    retry = {s.index for s in plan} if retry_errors else set()
+    results: Dict[int, Dict[str, Any]] = {}
+    failures: List[str] = []
+    rounds = 0
+    t0 = time.perf_counter()
+    while True:
+        pending = []
+        for s in plan:
+            done = shard_done(out_dir, s)
+            if done is not None and s.index not in retry:
+                results.setdefault(s.index, {**done, "previous_run": True})
+            else:
+                pending.append(s)
+        if not pending:
+            break
+        if rounds > max_restarts:
+            raise RuntimeError(f"{len(pending)} shards still failing after {max_restarts} restarts: {failures[-3:]}")
+        with ProcessPoolExecutor(max_workers=min(workers, len(pending)), initializer=_init_worker,
+                                 initargs=(limiters,)) as pool:
+            futures = {pool.submit(run_shard, input_path, out_dir, s, **kw): s for s in pending}
+            for fut in as_completed(futures):
+                s = futures[fut]
+                try:
+                    results[s.index] = fut.result()
+                    retry.discard(s.index)
+                except Exception as e:
+                    # BrokenProcessPool incluido: el resto del pool también falla y se reintenta
+                    failures.append(f"{s.name}: {type(e).__name__}: {e}")
+                    continue
+                if log:
+                    log(json.dumps({k: results[s.index].get(k) for k in ("shard", "written", "errors", "cache_hits", "elapsed_s")}))
+        rounds += 1
+    totals = {k: sum(r.get(k, 0) for r in results.values()) for k in ("read", "written", "skipped", "errors", "cache_hits")}
+    merged = merge(out_dir, plan, output or os.path.join(out_dir, "results.jsonl"))
+    return {"shards": len(plan), "workers": workers, "restarts": max(0, rounds - 1), "failures": failures,
+            **totals, **merged, "elapsed_s": round(time.perf_counter() - t0, 2)}
+
+
+def main():
+    import argparse
+    from src.clients.registry import load_env
+    ap = argparse.ArgumentParser(description="Sharded multi-process backfill of a JSONL news archive (resumable).")
+    ap.add_argument("--input", required=True, help="JSONL archive (one headline object or line per row)")
+    ap.add_argument("--out-dir", required=True, help="shard outputs, checkpoints, plan and response cache")
+    ap.add_argument("--output", default=None, help="merged JSONL (default: <out-dir>/results.jsonl)")
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 4)
+    ap.add_argument("--shards", type=int, default=None, help="default: 4 per worker (fixed on the first run)")
+    ap.add_argument("--text-field", default="text")
+    ap.add_argument("--provider", default="stub")
+    ap.add_argument("--use-rag", action="store_true")
+    ap.add_argument("--window", type=int, default=16, help="max requests in flight per worker")
+    ap.add_argument("--checkpoint-every", type=int, default=20)
+    ap.add_argument("--max-restarts", type=int, default=3)
+    ap.add_argument("--retry-errors", action="store_true", help="send failed records again (also in finished shards)")
+    args = ap.parse_args()
+    if args.input.lower().endswith(".csv") or args.input == "-":
+        ap.error("--input must be a JSONL file (shards are byte ranges)")
+    load_env()
+    stats = backfill(
+        args.input, args.out_dir, output=args.output, workers=args.workers, shards=args.shards,
+        provider=args.provider, use_rag=args.use_rag, window=args.window, text_field=args.text_field,
+        checkpoint_every=args.checkpoint_every, max_restarts=args.max_restarts, retry_errors=args.retry_errors,
+        log=lambda line: print(line, file=sys.stderr, flush=True),
+    )
+    print(json.dumps(stats, indent=2))
+
+if __name__ == "__main__":
+    main()
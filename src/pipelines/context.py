@@ -0,0 +1,138 @@
+import os, re
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Sequence, Set, Tuple
+from src.orchestrator.router import estimate_tokens
+
+# Ensamblado del bloque CONTEXT para RAG: presupuesto de tokens, sin duplicados, recorte por frases
+CHUNK_SEP = "\n---\n"
+DEFAULT_CONTEXT_TOKENS = 400
+DEFAULT_DEDUP_THRESHOLD = 0.8
+SHINGLE = 3
+
+_SENTENCE = re.compile(r"(?<=[.!?;])\s+|\n+")
+_WORD = re.compile(r"\w+", re.UNICODE)
+
+@dataclass
+class ContextConfig:
+    """Budget for the CONTEXT block of a RAG prompt.
+
+    `max_tokens` is the default budget; PROVIDER_RAG_CONTEXT_TOKENS overrides it for one
+    provider (e.g. OPENAI_RAG_CONTEXT_TOKENS). With a routing mode ("auto", "cascade", ...)
+    the prompt may reach any configured provider, so the smallest of their budgets applies.
+    Chunks whose word shingles overlap a
+    better-ranked chunk by `dedup_threshold` or more are dropped.
+    """
+    max_tokens: int = DEFAULT_CONTEXT_TOKENS
+    dedup_threshold: float = DEFAULT_DEDUP_THRESHOLD
+    max_chunks: int = 3
+
+    @classmethod
+    def from_env(cls) -> "ContextConfig":
+        return cls(
+            max_tokens=int(os.getenv("RAG_CONTEXT_TOKENS", DEFAULT_CONTEXT_TOKENS)),
+            dedup_threshold=float(os.getenv("RAG_CONTEXT_DEDUP", DEFAULT_DEDUP_THRESHOLD)),
+            max_chunks=int(os.getenv("RAG_CONTEXT_CHUNKS", 3)),
+        )
+
+    def budget_for(self, provider: Optional[str]) -> int:
+        from src.clients.registry import PROVIDERS, configured
+        if provider and provider not in PROVIDERS and provider != "stub":
+            # modo de enrutado: el proveedor se decide después, vale el menor presupuesto posible
+            return min((self.budget_for(p) for p in configured()), default=self.max_tokens)
+        raw = os.getenv(f"{provider.upper()}_RAG_CONTEXT_TOKENS") if provider else None
+        return int(raw) if raw else self.max_tokens
+
+
+def _words(text: str) -> List[str]:
+    return _WORD.findall(text.lower())
+
+def _shingles(text: str) -> Set[Tuple[str, ...]]:
+    w = _words(text)
+    if len(w) < SHINGLE:
+        return {tuple(w)} if w else set()
+    return {tuple(w[i:i + SHINGLE]) for i in range(len(w) - SHINGLE + 1)}
+
+def overlap(a: Set, b: Set) -> float:
+    """Containment of the smaller shingle set in the larger one: 1.0 for a duplicate or a
+    chunk that is a slice of the other (overlapping windows), ~0 for unrelated text."""
+    if not a or not b:
+        return 0.0
+    return len(a & b)/min(len(a), len(b))
+
+def dedup(chunks: Sequence[str], threshold: float = DEFAULT_DEDUP_THRESHOLD) -> Tuple[List[str], int]:
+    """Keep chunks in rank order, dropping those that overlap an already kept one."""
+    kept: List[str] = []
+    seen: List[Set] = []
+    dropped = 0
+    for c in chunks:
+        sh = _shingles(c)
+        if not sh or any(overlap(sh, s) >= threshold for s in seen):
+            dropped += 1
+            continue
+        kept.append(c)
+        seen.append(sh)
+    return kept, dropped
+
+def split_sentences(text: str) -> List[str]:
+    return [s.strip() for s in _SENTENCE.split(text) if s.strip()]
+
+def truncate(text: str, query: str, budget: int, count: Callable[[str], int] = estimate_tokens) -> str:
+    """Best sentences of `text` that fit in `budget` tokens, in their original order.
+
+    Sentences are ranked by the share of query words they contain (ties: earlier first)
+    and added greedily; a sentence is never cut in half and repeated sentences are kept once.
+    """
+    sents = split_sentences(text)
+    q = set(_words(query))
+    def relevance(i: int) -> Tuple[float, int]:
+        w = set(_words(sents[i]))
+        return (-(len(w & q)/len(w) if w else 0.0), i)
+    chosen: List[int] = []
+    seen: Set[str] = set()
+    for i in sorted(range(len(sents)), key=relevance):
+        key = " ".join(_words(sents[i]))
+        if key in seen:
+            continue
+        trial = sorted(chosen + [i])
+        if count(" ".join(sents[j] for j in trial)) <= budget:
+            chosen = trial
+            seen.add(key)
+    return " ".join(sents[i] for i in chosen)
+
+def pack_context(
+    query: str,
+    chunks: Sequence[str],
+    max_tokens: int = DEFAULT_CONTEXT_TOKENS,
+    *,
+    dedup_threshold: float = DEFAULT_DEDUP_THRESHOLD,
+    max_chunks: Optional[int] = None,
+    count: Callable[[str], int] = estimate_tokens,
+) -> Tuple[str, Dict[str, Any]]:
+    """CONTEXT blob for `query` from retrieval-ranked `chunks`, within `max_tokens`.
+
+    Whole chunks are taken in rank order while they fit; the first one that does not is
+    cut at sentence boundaries into the remaining budget and packing stops there.
+    Returns the blob and {tokens, budget, chunks_in, chunks_used, duplicates, truncated}.
+    """
+    kept, dups = dedup(chunks, dedup_threshold)
+    if max_chunks:
+        kept = kept[:max_chunks]
+    sep = count(CHUNK_SEP)
+    parts: List[str] = []
+    used, truncated = 0, False
+    for c in kept:
+        cost = count(c) + (sep if parts else 0)
+        if used + cost <= max_tokens:
+            parts.append(c)
+            used += cost
+            continue
+        room = max_tokens - used - (sep if parts else 0)
+        cut = truncate(c, query, room, count) if room > 0 else ""
+        if cut:
+            parts.append(cut)
+            used += count(cut) + (sep if len(parts) > 1 else 0)
+        truncated = True
+        break
+    blob = CHUNK_SEP.join(parts)
+    return blob, {"tokens": used, "budget": max_tokens, "chunks_in": len(chunks),
+                  "chunks_used": len(parts), "duplicates": dups, "truncated": truncated}
@@ -0,0 +1,269 @@
+import os, re, time, zlib, heapq, hashlib, threading, unicodedata
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any, Dict, FrozenSet, List, Optional, Sequence, Tuple, Union
+import numpy as np
+from src.observability.metrics import inc
+
+# Agrupación de titulares casi duplicados (noticias sindicadas con pequeños cambios): una sola
+# llamada al modelo por grupo y el resultado se reparte a todos sus miembros.
+
+# palabras que no distinguen una noticia de otra (artículos, sufijos societarios)
+STOPWORDS = frozenset("""a an the of to in on for and or its it as at by with from is are was be has have
+corp corporation inc co ltd plc llc group holdings sa ag nv""".split())
+_PRIME = (1 << 31) - 1
+_WORD = re.compile(r"\w+", re.UNICODE)
+# campos de fecha de publicación que se buscan en un registro si no se indica uno
+TS_FIELDS = ("published_at", "timestamp", "ts", "date")
+
+def tokens(text: str) -> FrozenSet[str]:
+    """Normalized word set: NFKC, lower-case, punctuation and stopwords removed."""
+    words = _WORD.findall(unicodedata.normalize("NFKC", text).lower())
+    return frozenset(w for w in words if w not in STOPWORDS) or frozenset(words)
+
+def entities(text: str) -> FrozenSet[str]:
+    """Capitalized words (normalized like `tokens`): company names, tickers, places."""
+    words = _WORD.findall(unicodedata.normalize("NFKC", text))
+    return frozenset(w.lower() for w in words if w[:1].isupper() and w.lower() not in STOPWORDS)
+
+def substituted(a: FrozenSet[str], b: FrozenSet[str]) -> bool:
+    """True if each side has entities the other lacks ("Acme beats" vs "Globex beats").
+    Adding an entity ("..., Nasdaq says") is not a substitution."""
+    return bool(a - b) and bool(b - a)
+
+def parse_ts(value: Any) -> Optional[float]:
+    """Epoch seconds from an epoch number (seconds or milliseconds) or an ISO-8601 string;
+    None if it cannot be read. Naive datetimes are taken as UTC."""
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, str):
+        value = value.strip()
+        try:
+            value = float(value)
+        except ValueError:
+            try:
+                dt = datetime.fromisoformat(value[:-1] + "+00:00" if value.endswith("Z") else value)
+            except ValueError:
+                return None
+            return (dt if dt.tzinfo else dt.replace(tzinfo=timezone.utc)).timestamp()
+    if isinstance(value, (int, float)):
+        # > año 5138 en segundos: son milisegundos
+        return float(value)/1000 if value > 1e11 else float(value)
+    return None
+
+def record_ts(rec: Dict[str, Any], field: Optional[str] = None) -> Optional[float]:
+    """Publication time of a record: `field`, or the first of TS_FIELDS present."""
+    for f in ((field,) if field else TS_FIELDS):
+        if rec.get(f) not in (None, ""):
+            return parse_ts(rec[f])
+    return None
+
+def jaccard(a: FrozenSet[str], b: FrozenSet[str]) -> float:
+    return len(a & b)/len(a | b) if a or b else 1.0
+
+def lsh_bands(num_perm: int, threshold: float) -> Tuple[int, int]:
+    """(bands, rows) with bands*rows == num_perm whose LSH threshold (1/b)^(1/r) sits a bit
+    below `threshold`: candidates are verified exactly, so recall matters more."""
+    target = max(0.05, threshold - 0.1)
+    pairs = [(num_perm//r, r) for r in range(1, num_perm + 1) if num_perm % r == 0]
+    return min(pairs, key=lambda br: abs((1/br[0])**(1/br[1]) - target))
+
+@dataclass
+class DedupConfig:
+    """Near-duplicate grouping for batch and stream runs.
+
+    Two headlines share a group when the Jaccard similarity of their normalized word
+    sets is at least `threshold`, the lexicon gives them the same polarity ("beats" vs
+    "misses" never merge), neither swaps an entity for another ("Acme" vs "Globex") and
+    the group's first headline is less than `window_s` seconds apart (publication time
+    when the caller passes one, arrival time otherwise). Input need not be in time order:
+    a group is forgotten once it is more than `window_s` older than the newest headline
+    seen minus `max_lateness_s`, the delay allowed for late headlines. At most
+    `max_groups` groups are remembered (oldest by timestamp evicted first).
+    """
+    threshold: float = 0.6
+    window_s: float = 3600.0
+    num_perm: int = 64
+    max_groups: int = 100_000
+    max_lateness_s: float = 3600.0
+    # candidatos revisados por banda (los más recientes): acota el coste con buckets muy poblados
+    max_candidates: int = 32
+
+    @classmethod
+    def from_env(cls) -> "DedupConfig":
+        return cls(
+            threshold=float(os.getenv("DEDUP_THRESHOLD", 0.6)),
+            window_s=float(os.getenv("DEDUP_WINDOW_S", 3600)),
+            num_perm=int(os.getenv("DEDUP_NUM_PERM", 64)),
+            max_groups=int(os.getenv("DEDUP_MAX_GROUPS", 100_000)),
+            max_lateness_s=float(os.getenv("DEDUP_MAX_LATENESS_S", 3600)),
+            max_candidates=int(os.getenv("DEDUP_MAX_CANDIDATES", 32)),
+        )
+
+
+class _Group:
+    __slots__ = ("gid", "ts", "seq", "tokens", "entities", "label", "keys", "members", "result")
+
+    def __init__(self, gid, ts, seq, toks, ents, label, keys):
+        self.gid, self.ts, self.seq, self.tokens, self.entities, self.label, self.keys = gid, ts, seq, toks, ents, label, keys
+        self.members = 1
+        self.result = None
+
+
+class NearDupIndex:
+    """MinHash signatures + banded LSH over the representatives (first headline) of the
+    groups seen in the time window.
+
+    Memory is bounded by `max_groups` representatives (their word set, band keys and,
+    optionally, the model result to fan out); members are never stored.
+    """
+
+    def __init__(self, config: Optional[DedupConfig] = None, seed: int = 1):
+        self.config = config or DedupConfig.from_env()
+        self.bands, self.rows = lsh_bands(self.config.num_perm, self.config.threshold)
+        n = self.bands*self.rows
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, _PRIME, size=n, dtype=np.uint64)
+        self._b = rng.integers(0, _PRIME, size=n, dtype=np.uint64)
+        self._groups: "OrderedDict[str, _Group]" = OrderedDict()
+        # (ts, seq, gid) de cada grupo: se desaloja por marca de tiempo, no por orden de llegada;
+        # las entradas de grupos ya borrados se descartan al salir del heap
+        self._heap: List[Tuple[float, int, str]] = []
+        self._seq = 0
+        # publicación más reciente vista: el horizonte se mide desde aquí
+        self._watermark = float("-inf")
+        # banda -> clave -> grupos (dict ordenado por inserción: borrado O(1), recorrido del más reciente)
+        self._buckets: List[Dict[bytes, Dict[str, None]]] = [{} for _ in range(self.bands)]
+        self._lock = threading.Lock()
+        self.stats = {"seen": 0, "new": 0, "duplicates": 0, "evicted": 0}
+
+    def signature(self, toks: FrozenSet[str]) -> np.ndarray:
+        x = np.fromiter((zlib.crc32(t.encode()) & 0x7FFFFFFF for t in toks), dtype=np.uint64, count=len(toks))
+        if not len(x):
+            x = np.zeros(1, dtype=np.uint64)
+        # (a*x + b) mod p con a, x < 2^31: cabe en uint64 sin desbordar
+        return ((self._a[:, None]*x[None, :] + self._b[:, None]) % _PRIME).min(axis=1)
+
+    def _band_keys(self, sig: np.ndarray) -> List[bytes]:
+        return [sig[i*self.rows:(i + 1)*self.rows].tobytes() for i in range(self.bands)]
+
+    def _pop_oldest(self) -> Optional[_Group]:
+        while self._heap:
+            ts, seq, gid = heapq.heappop(self._heap)
+            g = self._groups.get(gid)
+            if g is not None and g.seq == seq:
+                return g
+        return None
+
+    def _remove(self, g: _Group) -> None:
+        del self._groups[g.gid]
+        for band, key in zip(self._buckets, g.keys):
+            ids = band.get(key)
+            if ids is not None:
+                ids.pop(g.gid, None)
+                if not ids:
+                    del band[key]
+        self.stats["evicted"] += 1
+
+    def _evict(self) -> None:
+        horizon = self._watermark - self.config.max_lateness_s - self.config.window_s
+        while self._heap and (self._heap[0][0] < horizon or len(self._groups) > self.config.max_groups):
+            g = self._pop_oldest()
+            if g is None:
+                break
+            self._remove(g)
+
+    def assign_batch(self, texts: Sequence[str], ts: Union[None, float, Sequence[Optional[float]]] = None,
+                     labels: Optional[Sequence[int]] = None) -> List[Tuple[str, bool]]:
+        """(group_id, is_new) per text, in order. Texts earlier in the same batch count as
+        already seen. `ts` is the publication time of the batch or of each text (None: now).
+        `labels` (lexicon polarity) are computed in one vectorized pass if absent."""
+        if labels is None:
+            from src.pipelines.lexicon import default_lexicon
+            labels = default_lexicon().score_batch(list(texts))["label"].tolist() if len(texts) else []
+        now = time.time()
+        if ts is None or isinstance(ts, (int, float)):
+            times = [now if ts is None else float(ts)]*len(texts)
+        else:
+            times = [now if t is None else float(t) for t in ts]
+        out: List[Tuple[str, bool]] = []
+        with self._lock:
+            self._watermark = max([self._watermark, *times])
+            self._evict()
+            for text, label, t in zip(texts, labels, times):
+                out.append(self._assign(text, int(label), t))
+        return out
+
+    def assign(self, text: str, ts: Optional[float] = None) -> Tuple[str, bool]:
+        return self.assign_batch([text], ts)[0]
+
+    def _assign(self, text: str, label: int, now: float) -> Tuple[str, bool]:
+        toks = tokens(text)
+        ents = entities(text)
+        keys = self._band_keys(self.signature(toks))
+        self.stats["seen"] += 1
+        best, best_sim = None, self.config.threshold
+        checked = set()
+        for band, key in zip(self._buckets, keys):
+            ids = band.get(key)
+            if not ids:
+                continue
+            for n, gid in enumerate(reversed(ids)):
+                if n >= self.config.max_candidates:
+                    break
+                if gid in checked:
+                    continue
+                checked.add(gid)
+                g = self._groups[gid]
+                # en un archivo histórico el orden de llegada no es el de publicación
+                if abs(now - g.ts) > self.config.window_s:
+                    continue
+                if g.label != label or substituted(ents, g.entities):
+                    continue
+                sim = jaccard(toks, g.tokens)
+                if sim >= best_sim:
+                    best, best_sim = g, sim
+        if best is not None:
+            best.members += 1
+            self.stats["duplicates"] += 1
+            inc("dedup_total", result="duplicate")
+            return best.gid, False
+        gid = "g" + hashlib.blake2b(" ".join(sorted(toks)).encode() + str(now).encode(), digest_size=6).hexdigest()
+        self._seq += 1
+        if gid in self._groups:
+            # mismas palabras y marca de tiempo que un grupo con el que no casó (otra polaridad)
+            gid += f"-{self._seq}"
+        self._groups[gid] = _Group(gid, now, self._seq, toks, ents, label, keys)
+        heapq.heappush(self._heap, (now, self._seq, gid))
+        for band, key in zip(self._buckets, keys):
+            band.setdefault(key, {})[gid] = None
+        self.stats["new"] += 1
+        inc("dedup_total", result="new")
+        if len(self._groups) > self.config.max_groups:
+            self._evict()
+        return gid, True
+
+    # resultado del representante, para repartirlo a los duplicados que lleguen más tarde
+    def remember(self, gid: str, result: Dict[str, Any]) -> None:
+        with self._lock:
+            g = self._groups.get(gid)
+            if g is not None:
+                g.result = result
+
+    def result(self, gid: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            g = self._groups.get(gid)
+            return g.result if g is not None else None
+
+    def __len__(self) -> int:
+        return len(self._groups)
+
+
+def member_result(routed: Dict[str, Any], gid: str) -> Dict[str, Any]:
+    """Copy of a representative's routed result ({"response": ...}) for another member of
+    its group: same verdict, no cost (nothing was paid for it)."""
+    resp = dict(routed.get("response") or {})
+    if resp.get("cost_usd") is not None:
+        resp["cost_usd"] = 0.0
+    return {**routed, "response": resp, "dedup": {"group": gid, "representative": False}}
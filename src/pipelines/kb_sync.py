@@ -0,0 +1,224 @@
+import os, json, time, hashlib
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+from src.observability.metrics import inc, traced
+from src.pipelines.vector_index import NUMPY_DIR, Embedder, NumpyIndex, embedder_name, kb_files, load_embedder
+
+# Ingesta incremental del KB: manifiesto {ruta relativa: sha256, tamaño, mtime} por backend.
+# Sólo se trocean y embeben los ficheros nuevos o modificados; los borrados se quitan del índice.
+LLAMA_MANIFEST = "storage/llamaindex/kb_manifest.json"
+
+def embed_batch_size() -> int:
+    return int(os.getenv("RAG_EMBED_BATCH", 256))
+
+def file_sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+@dataclass
+class Changes:
+    added: List[str] = field(default_factory=list)
+    modified: List[str] = field(default_factory=list)
+    deleted: List[str] = field(default_factory=list)
+    unchanged: int = 0
+    # manifiesto resultante una vez aplicados los cambios
+    manifest: Dict[str, Dict[str, Any]] = field(default_factory=dict)
+
+    def __bool__(self) -> bool:
+        return bool(self.added or self.modified or self.deleted)
+
+    def summary(self) -> Dict[str, int]:
+        return {"added": len(self.added), "modified": len(self.modified),
+                "deleted": len(self.deleted), "unchanged": self.unchanged}
+
+def diff(data_dir: str, manifest: Dict[str, Dict[str, Any]]) -> Changes:
+    """Compare `data_dir` against `manifest`. Files whose size and mtime match are not read;
+    a file that was only touched (same hash) counts as unchanged."""
+    ch = Changes()
+    for path in kb_files(data_dir):
+        rel = os.path.relpath(path, data_dir)
+        st = os.stat(path)
+        old = manifest.get(rel)
+        if old and old.get("size") == st.st_size and old.get("mtime_ns") == st.st_mtime_ns:
+            ch.manifest[rel] = old
+            ch.unchanged += 1
+            continue
+        digest = file_sha256(path)
+        ch.manifest[rel] = {**(old or {}), "sha256": digest, "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+        if old is None:
+            ch.added.append(rel)
+        elif old.get("sha256") != digest:
+            ch.modified.append(rel)
+        else:
+            ch.unchanged += 1
+    ch.deleted = sorted(set(manifest) - set(ch.manifest))
+    return ch
+
+def _count(backend: str, ch: Changes) -> None:
+    for kind, n in ch.summary().items():
+        if n:
+            inc("kb_sync_files_total", n, backend=backend, change=kind)
+
+
+@traced("kb_sync.numpy")
+def sync_numpy(data_dir: str = "kb", embedder: Optional[Embedder] = None, path: str = NUMPY_DIR,
+               full: bool = False) -> Tuple[NumpyIndex, Dict[str, Any]]:
+    """Bring the NumPy index at `path` up to date with `data_dir`.
+
+    A missing or inconsistent index, or a different embedder, means a full build;
+    otherwise rows of modified/deleted files are dropped and only added/modified files
+    are embedded (in RAG_EMBED_BATCH batches).
+    """
+    embedder = embedder or load_embedder()
+    batch = embed_batch_size()
+    index = None
+    if not full:
+        try:
+            index = NumpyIndex.load(path)
+        except (OSError, ValueError):
+            index = None
+    if index is None or index.meta.get("embedder") != embedder_name(embedder):
+        ch = diff(data_dir, {})
+        _count("numpy", ch)
+        return NumpyIndex.build(data_dir, embedder, path, batch, ch.manifest), {"full": True, **ch.summary()}
+    ch = diff(data_dir, index.meta.get("manifest") or {})
+    _count("numpy", ch)
+    if not ch:
+        if ch.manifest != index.meta.get("manifest"):
+            # sólo cambió el mtime: se guarda para no volver a leer esos ficheros
+            index = NumpyIndex.write(path, index.vectors, index.chunks, embedder, ch.manifest)
+        return index, {"full": False, **ch.summary()}
+    # los añadidos también se purgan: reaplicar una sincronización interrumpida no duplica filas
+    index = index.update(data_dir, embedder, path, drop=ch.added + ch.modified + ch.deleted,
+                         add=ch.added + ch.modified, manifest=ch.manifest, batch_size=batch)
+    return index, {"full": False, **ch.summary()}
+
+
+def _rel(file_path: str, data_dir: str) -> str:
+    return os.path.relpath(os.path.abspath(file_path), os.path.abspath(data_dir))
+
+def record_docs(manifest: Dict[str, Dict[str, Any]], docs, data_dir: str) -> Dict[str, Dict[str, Any]]:
+    """Attach the LlamaIndex doc ids of `docs` to their files in `manifest`."""
+    for rel in {_rel(d.metadata["file_path"], data_dir) for d in docs}:
+        if rel in manifest:
+            manifest[rel]["doc_ids"] = []
+    for d in docs:
+        manifest.setdefault(_rel(d.metadata["file_path"], data_dir), {}).setdefault("doc_ids", []).append(d.doc_id)
+    return manifest
+
+def apply_llama_embed_batch_size() -> int:
+    """Set embed_batch_size() on LlamaIndex's global Settings.embed_model; returns it."""
+    from llama_index.core import Settings
+    size = embed_batch_size()
+    Settings.embed_model.embed_batch_size = size
+    return size
+
+@traced("kb_sync.llamaindex")
+def sync_llamaindex(index, data_dir: str = "kb", manifest_path: str = LLAMA_MANIFEST) -> Dict[str, Any]:
+    """Apply KB changes to a loaded LlamaIndex/Chroma index in place and persist it.
+
+    Documents are read with filename_as_id=True and their ids kept in the manifest, so a
+    modified or deleted file is removed with delete_ref_doc before its new version is
+    inserted. New nodes go through a single insert_nodes (embedded in batches).
+    """
+    from llama_index.core import Settings, SimpleDirectoryReader
+    from src.pipelines.rag_index import PERSIST_DIR
+
+    manifest = read_manifest(manifest_path)
+    ch = diff(data_dir, manifest)
+    _count("llamaindex", ch)
+    if not ch:
+        if ch.manifest != manifest:
+            write_manifest(manifest_path, ch.manifest)
+        return {"full": False, **ch.summary()}
+
+    for rel in ch.added + ch.modified + ch.deleted:
+        for doc_id in (manifest.get(rel) or {}).get("doc_ids") or []:
+            index.delete_ref_doc(doc_id, delete_from_docstore=True)
+    changed = ch.added + ch.modified
+    if changed:
+        docs = SimpleDirectoryReader(input_files=[os.path.join(data_dir, r) for r in changed], filename_as_id=True).load_data()
+        record_docs(ch.manifest, docs, data_dir)
+        apply_llama_embed_batch_size()
+        index.insert_nodes(Settings.node_parser.get_nodes_from_documents(docs))
+    index.storage_context.persist(persist_dir=PERSIST_DIR)
+    write_manifest(manifest_path, ch.manifest)
+    return {"full": False, **ch.summary()}
+
+
+def read_manifest(path: str) -> Dict:
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def write_manifest(path: str, obj: Dict) -> None:
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(obj, f, indent=1)
+    os.replace(path + ".tmp", path)
+
+
+def sync(data_dir: str = "kb", backend: Optional[str] = None, full: bool = False) -> Dict[str, Any]:
+    backend = (backend or os.getenv("RAG_BACKEND", "llamaindex")).lower()
+    start = time.perf_counter()
+    if backend == "numpy":
+        index, stats = sync_numpy(data_dir, full=full)
+        stats["chunks"] = len(index)
+    else:
+        from src.pipelines.rag_index import build_or_load_index
+        if full and os.path.exists(LLAMA_MANIFEST):
+            # sin manifiesto build_or_load_index reconstruye la colección desde cero
+            os.remove(LLAMA_MANIFEST)
+        stats: Dict[str, Any] = {}
+        build_or_load_index(data_dir, stats=stats)
+    return {"backend": backend, **stats, "elapsed_ms": round((time.perf_counter() - start)*1000, 1)}
+
+def stored_manifest(backend: Optional[str] = None, path: str = NUMPY_DIR) -> Dict:
+    """Manifest of the persisted index (without loading it); {} if there is none."""
+    backend = (backend or os.getenv("RAG_BACKEND", "llamaindex")).lower()
+    if backend == "numpy":
+        return read_manifest(os.path.join(path, "meta.json")).get("manifest") or {}
+    return read_manifest(LLAMA_MANIFEST)
+
+def watch(data_dir: str = "kb", backend: Optional[str] = None, interval: float = 5.0) -> None:
+    """Poll `data_dir` every `interval` seconds and sync when something changed.
+    Each poll only diffs the directory against the manifest (one stat() per unchanged
+    file); the index is opened only when there is something to sync."""
+    print(json.dumps(sync(data_dir, backend)))
+    manifest = stored_manifest(backend)
+    while True:
+        time.sleep(interval)
+        ch = diff(data_dir, manifest)
+        if not ch:
+            # sólo cambiaron mtimes: se recuerdan para no volver a leer esos ficheros
+            manifest = ch.manifest
+            continue
+        print(json.dumps(sync(data_dir, backend)), flush=True)
+        manifest = stored_manifest(backend)
+
+def main():
+    import argparse
+    from src.clients.registry import load_env
+    ap = argparse.ArgumentParser(description="Incremental KB ingestion (only new/changed files are embedded).")
+    ap.add_argument("--data-dir", default="kb")
+    ap.add_argument("--backend", choices=["llamaindex", "numpy"], default=None, help="default: RAG_BACKEND")
+    ap.add_argument("--full", action="store_true", help="ignore the manifest and re-embed everything")
+    ap.add_argument("--watch", action="store_true", help="keep polling the KB directory")
+    ap.add_argument("--interval", type=float, default=5.0)
+    args = ap.parse_args()
+    load_env()
+    if args.watch:
+        try:
+            watch(args.data_dir, args.backend, args.interval)
+        except KeyboardInterrupt:
+            pass
+    else:
+        print(json.dumps(sync(args.data_dir, args.backend, args.full), indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+import os, string
+from functools import lru_cache
+from itertools import repeat
+from typing import Dict, Iterable, List, Optional, Sequence
+import numpy as np
+
+DEFAULT_LEXICON = os.path.join(os.path.dirname(__file__), "lexicon.tsv")
+NEGATION_WINDOW = 3
+
+# Puntuación -> espacio (se conserva el apóstrofo: "didn't"); los guiones separan palabras ("record-high")
+_PUNCT = str.maketrans({c: " " for c in string.punctuation if c != "'"})
+_SEP = "\x00"
+LABELS = {-1: "bearish", 0: "neutral", 1: "bullish"}
+
+class Lexicon:
+    """Weighted lexicon scorer with whole-word matching and negation.
+
+    The lexicon is compiled once into a word vocabulary plus integer codes for every
+    (multi-word) term and negator. A batch is lower-cased, stripped of punctuation and
+    split by C string routines; matching, longest-term-first selection, negation and the
+    per-text sums are then NumPy array operations over all tokens at once.
+
+    A negator ("not", "fails to", ...) flips the sign of the first term that starts at
+    most `negation_window` words after it, within the same text.
+    """
+
+    def __init__(self, weights: Dict[str, float], negators: Iterable[str] = (), negation_window: int = NEGATION_WINDOW):
+        self.weights = {self._norm(k): float(v) for k, v in weights.items()}
+        self.negators = {self._norm(n) for n in negators}
+        self.negation_window = negation_window
+        words = sorted({w for t in (*self.weights, *self.negators) for w in t.split()})
+        self.vocab = {w: i + 1 for i, w in enumerate(words)}
+        self._sep_id = len(words) + 1
+        self.vocab[_SEP] = self._sep_id
+        self._base = len(words) + 2
+        self._terms = self._compile(self.weights)
+        self._negs = self._compile({n: 0.0 for n in self.negators})
+
+    @staticmethod
+    def _norm(term: str) -> str:
+        return " ".join(term.lower().translate(_PUNCT).split())
+
+    def _compile(self, table: Dict[str, float]):
+        # longitud en palabras -> (códigos ordenados, pesos alineados)
+        by_len: Dict[int, Dict[int, float]] = {}
+        for term, w in table.items():
+            code = 0
+            for word in term.split():
+                code = code*self._base + self.vocab[word]
+            by_len.setdefault(len(term.split()), {})[code] = w
+        out = {}
+        for n, codes in sorted(by_len.items(), reverse=True):
+            keys = np.array(sorted(codes), dtype=np.int64)
+            out[n] = (keys, np.array([codes[k] for k in keys], dtype=np.float32))
+        return out
+
+    @classmethod
+    def load(cls, path: str = DEFAULT_LEXICON, **kw) -> "Lexicon":
+        weights, negators = {}, []
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith("#"):
+                    continue
+                term, _, w = line.rpartition("\t")
+                if w.strip().upper() == "NEG":
+                    negators.append(term)
+                else:
+                    weights[term] = float(w)
+        return cls(weights, negators, **kw)
+
+    def _find(self, ids: np.ndarray, table, taken: np.ndarray):
+        """Start positions, lengths and weights of non-overlapping matches, longest first."""
+        starts, lens, ws = [], [], []
+        N = len(ids)
+        for n, (keys, weights) in table.items():
+            if N < n:
+                continue
+            code = ids[:N-n+1].copy()
+            for k in range(1, n):
+                code = code*self._base + ids[k:N-n+1+k]
+            pos = np.searchsorted(keys, code)
+            pos[pos == len(keys)] = 0
+            hit = np.flatnonzero(keys[pos] == code)
+            if hit.size and n > 1:
+                # sin solapes: ni con términos más largos ya elegidos ni entre sí (gana el de la izquierda)
+                free = [i for i in hit.tolist() if not taken[i:i+n].any()]
+                keep, last_end = [], -1
+                for i in free:
+                    if i >= last_end:
+                        keep.append(i); last_end = i + n
+                hit = np.array(keep, dtype=np.int64)
+            elif hit.size:
+                hit = hit[~taken[hit]]
+            if hit.size:
+                for k in range(n):
+                    taken[hit + k] = True
+                starts.append(hit); lens.append(np.full(hit.size, n)); ws.append(weights[pos[hit]])
+        if not starts:
+            e = np.zeros(0, dtype=np.int64)
+            return e, e, np.zeros(0, dtype=np.float32)
+        starts, lens, ws = np.concatenate(starts), np.concatenate(lens), np.concatenate(ws)
+        order = np.argsort(starts, kind="stable")
+        return starts[order], lens[order], ws[order]
+
+    def score_batch(self, texts: Sequence[str]) -> Dict[str, np.ndarray]:
+        """Score many texts at once.
+
+        Returns float32 arrays `score`, `pos`, `neg`, `confidence`, int32 `hits` and int8
+        `label` (-1 bearish, 0 neutral, 1 bullish), aligned with `texts`.
+        """
+        n = len(texts)
+        pos = np.zeros(n, dtype=np.float32)
+        neg = np.zeros(n, dtype=np.float32)
+        hits = np.zeros(n, dtype=np.int32)
+        if n:
+            toks = f" {_SEP} ".join(texts).lower().translate(_PUNCT).split()
+            ids = np.fromiter(map(self.vocab.get, toks, repeat(0)), dtype=np.int64, count=len(toks))
+            owner = np.cumsum(ids == self._sep_id)
+            taken = ids == self._sep_id
+            t_start, _, t_w = self._find(ids, self._terms, taken)
+            n_start, n_len, _ = self._find(ids, self._negs, taken)
+            if t_start.size:
+                w = t_w.copy()
+                if n_start.size:
+                    # último negador que termina antes de cada término (y el término previo)
+                    n_end = n_start + n_len
+                    j = np.searchsorted(n_end, t_start, side="right") - 1
+                    last_end = np.where(j >= 0, n_end[np.maximum(j, 0)], -1)
+                    prev_start = np.r_[-1, t_start[:-1]]
+                    negated = ((j >= 0) & (t_start - last_end <= self.negation_window)
+                               & (prev_start < last_end) & (owner[np.maximum(last_end - 1, 0)] == owner[t_start]))
+                    w[negated] *= -1
+                idx = owner[t_start]
+                pos = np.bincount(idx, weights=np.where(w > 0, w, 0), minlength=n).astype(np.float32)
+                neg = np.bincount(idx, weights=np.where(w < 0, -w, 0), minlength=n).astype(np.float32)
+                hits = np.bincount(idx, minlength=n).astype(np.int32)
+        score = pos - neg
+        return {
+            "score": score,
+            "pos": pos,
+            "neg": neg,
+            "hits": hits,
+            "confidence": np.abs(score)/(pos + neg + 1.0),
+            "label": np.sign(score).astype(np.int8),
+        }
+
+    def score(self, text: str) -> Dict[str, float]:
+        b = self.score_batch([text])
+        return {
+            "sentiment": LABELS[int(b["label"][0])],
+            "score": round(float(b["score"][0]), 3),
+            "confidence": round(float(b["confidence"][0]), 3),
+            "hits": int(b["hits"][0]),
+        }
+
+
+@lru_cache(maxsize=4)
+def default_lexicon(path: Optional[str] = None) -> Lexicon:
+    return Lexicon.load(path or os.getenv("LEXICON_PATH") or DEFAULT_LEXICON)
+
+def labels_of(batch: Dict[str, np.ndarray]) -> List[str]:
+    return [LABELS[int(v)] for v in batch["label"]]
@@ -1,30 +1,83 @@
-from typing import Dict, Any
+import asyncio
+from typing import TYPE_CHECKING, Dict, Any, List, Optional
 from src.orchestrator.multimodel_analyzer import MultiModelAnalyzer
-from src.pipelines.rag_index import retrieve_context
+from src.pipelines.context import ContextConfig, pack_context
+from src.pipelines.lexicon import default_lexicon, labels_of
+
+if TYPE_CHECKING:
+    from src.pipelines.rag_index import KBRetriever
 
 class FinancialNewsAnalyzer:
-    def __init__(self):
-        self.mm = MultiModelAnalyzer()
+    def __init__(
+        self,
+        retriever: Optional["KBRetriever"] = None,
+        mm: Optional[MultiModelAnalyzer] = None,
+        context: Optional[ContextConfig] = None,
+    ):
+        self.mm = mm or MultiModelAnalyzer()
+        self._retriever = retriever
+        self.context = context or ContextConfig.from_env()
+
+    @property
+    def retriever(self) -> "KBRetriever":
+        # llama_index/chromadb sólo se importan cuando se pide RAG
+        if self._retriever is None:
+            from src.pipelines.rag_index import get_retriever
+            self._retriever = get_retriever()
+        return self._retriever
 
     def _rule_based(self, text: str):
-        t = text.lower()
-        pos = ["beat","beats","growth","record","surge","bullish","upgrade","profit"]
-        neg = ["miss","misses","downgrade","loss","decline","bearish","probe","fraud"]
-        score = sum(w in t for w in pos) - sum(w in t for w in neg)
-        s = "neutral"
-        if score > 0: s = "bullish"
-        if score < 0: s = "bearish"
-        return {"sentiment": s, "score": score}
+        return default_lexicon().score(text)
+
+    def rule_based_batch(self, texts: List[str]) -> List[Dict[str, Any]]:
+        """Lexicon verdicts for many texts in one vectorized pass (cheap prefilter before any LLM call)."""
+        b = default_lexicon().score_batch(texts)
+        return [
+            {"sentiment": s, "score": round(float(sc), 3), "confidence": round(float(c), 3), "hits": int(h)}
+            for s, sc, c, h in zip(labels_of(b), b["score"], b["confidence"], b["hits"])
+        ]
 
     async def analyze_sentiment(self, text: str, provider: str = "stub", use_rag: bool = False) -> Dict[str, Any]:
         q = text
-        ctx_used = []
+        ctx_info = None
         if use_rag:
-            ctx = retrieve_context(text)
+            # se piden algunos fragmentos de más para cubrir los que se descarten por duplicados
+            ctx = await self.retriever.aretrieve(text, self.context.max_chunks + 2)
             if ctx:
-                ctx_used = ctx
-                ctx_blob = "\n---\n".join(ctx[:3])
-                q = f"CONTEXT:\n{ctx_blob}\n\nTEXT:\n{text}"
+                ctx_blob, ctx_info = pack_context(
+                    text, ctx, self.context.budget_for(provider),
+                    dedup_threshold=self.context.dedup_threshold, max_chunks=self.context.max_chunks,
+                )
+                if ctx_blob:
+                    q = f"CONTEXT:\n{ctx_blob}\n\nTEXT:\n{text}"
         rb = self._rule_based(text)
         routed = await self.mm.analyze_with_routing(q, task_type="news", provider=provider)
-        return {"rule_based": rb, "provider": provider, "model_result": routed}
+        out = {"rule_based": rb, "provider": provider, "model_result": routed}
+        if ctx_info is not None:
+            out["context"] = ctx_info
+        return out
+
+    async def analyze_batch(
+        self,
+        texts: List[str],
+        provider: str = "stub",
+        use_rag: bool = False,
+        concurrency: int = 8,
+    ) -> List[Dict[str, Any]]:
+        sem = asyncio.Semaphore(max(1, concurrency))
+
+        async def one(text: str) -> Dict[str, Any]:
+            async with sem:
+                try:
+                    return await self.analyze_sentiment(text, provider=provider, use_rag=use_rag)
+                except Exception as e:
+                    return {
+                        "rule_based": self._rule_based(text),
+                        "provider": provider,
+                        "model_result": {
+                            "router_decision": provider,
+                            "response": {"ok": False, "provider": provider, "error": str(e), "error_type": type(e).__name__},
+                        },
+                    }
+
+        return await asyncio.gather(*(one(t) for t in texts))
@@ -1,38 +1,167 @@
-import os
-from typing import List
-from llama_index.core import SimpleDirectoryReader, VectorStoreIndex, StorageContext, load_index_from_storage
-from llama_index.vector_stores.chroma import ChromaVectorStore
-import chromadb
+import os, time, asyncio, threading
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Union
+from src.observability.metrics import observe, span, traced
 
 PERSIST_DIR = "storage/llamaindex"
 CHROMA_DIR = "storage/chroma"
 COLLECTION = "lab1_kb"
 
-def build_or_load_index (data_dir: str = "kb"):
+# RAG_BACKEND: "llamaindex" (Chroma + LlamaIndex) o "numpy" (matriz en memoria, ver vector_index.py)
+BACKENDS = ("llamaindex", "numpy")
+
+if TYPE_CHECKING:
+    from src.pipelines.vector_index import NumpyRetriever
+
+@traced("rag.build_or_load_index")
+def build_or_load_index (data_dir: str = "kb", stats: Optional[Dict[str, Any]] = None):
+    """Persisted index brought up to date with `data_dir` through kb_sync (only new or
+    changed files are embedded). Without a manifest the collection is rebuilt once."""
+    # llama_index/chromadb sólo se importan si se usa este backend
+    from llama_index.core import SimpleDirectoryReader, VectorStoreIndex, StorageContext, load_index_from_storage
+    from llama_index.vector_stores.chroma import ChromaVectorStore
+    import chromadb
+    from src.pipelines import kb_sync
     os.makedirs(CHROMA_DIR, exist_ok=True)
     os.makedirs(PERSIST_DIR, exist_ok=True)
     chroma_client = chromadb.PersistentClient(path=CHROMA_DIR)
-    collection = chroma_client.get_or_create_collection(COLLECTION)
-    vector_store = ChromaVectorStore(chroma_collection=collection)
-
-    try:
-        storage_context = StorageContext.from_defaults(persist_dir=PERSIST_DIR, vector_store=vector_store)
-        index = load_index_from_storage(storage_context)
-        return index
-    except Exception:
-        pass
-
-    docs = SimpleDirectoryReader(data_dir).load_data()
-    storage_context = StorageContext.from_defaults(vector_store=vector_store)
-    index = VectorStoreIndex.from_documents(docs, storage_context=storage_context)
-    index.storage_context.persist(persist_dir=PERSIST_DIR)
+
+    index = None
+    if os.path.exists(kb_sync.LLAMA_MANIFEST):
+        collection = chroma_client.get_or_create_collection(COLLECTION)
+        vector_store = ChromaVectorStore(chroma_collection=collection)
+        try:
+            storage_context = StorageContext.from_defaults(persist_dir=PERSIST_DIR, vector_store=vector_store)
+            index = load_index_from_storage(storage_context)
+        except Exception:
+            index = None
+    if index is not None:
+        result = kb_sync.sync_llamaindex(index, data_dir)
+    else:
+        # índice sin ids estables por fichero (o inexistente): se reconstruye la colección entera
+        try:
+            chroma_client.delete_collection(COLLECTION)
+        except Exception:
+            pass
+        collection = chroma_client.get_or_create_collection(COLLECTION)
+        vector_store = ChromaVectorStore(chroma_collection=collection)
+        changes = kb_sync.diff(data_dir, {})
+        docs = SimpleDirectoryReader(data_dir, filename_as_id=True).load_data()
+        kb_sync.apply_llama_embed_batch_size()
+        storage_context = StorageContext.from_defaults(vector_store=vector_store)
+        index = VectorStoreIndex.from_documents(docs, storage_context=storage_context)
+        index.storage_context.persist(persist_dir=PERSIST_DIR)
+        kb_sync.write_manifest(kb_sync.LLAMA_MANIFEST, kb_sync.record_docs(changes.manifest, docs, data_dir))
+        result = {"full": True, **changes.summary()}
+    if stats is not None:
+        stats.update(result)
     return index
 
+
+def load_index ():
+    """Persisted index exactly as it is on disk: no kb_sync and nothing written, so several
+    processes can open it at once (build it first with build_or_load_index)."""
+    from llama_index.core import StorageContext, load_index_from_storage
+    from llama_index.vector_stores.chroma import ChromaVectorStore
+    import chromadb
+    chroma_client = chromadb.PersistentClient(path=CHROMA_DIR)
+    vector_store = ChromaVectorStore(chroma_collection=chroma_client.get_collection(COLLECTION))
+    storage_context = StorageContext.from_defaults(persist_dir=PERSIST_DIR, vector_store=vector_store)
+    return load_index_from_storage(storage_context)
+
+
+class KBRetriever:
+    """Long-lived retriever over the KB index.
+
+    The index (Chroma client, vector store, storage context) is built once and
+    reused across queries. Only the top-k source chunks are returned, so no
+    answer is synthesized by the LLM. With sync=False the persisted index is only
+    opened (load_index), never synced with `data_dir`.
+    """
+
+    def __init__(self, data_dir: str = "kb", k: int = 3, sync: bool = True):
+        self.data_dir = data_dir
+        self.k = k
+        self.sync = sync
+        self._lock = threading.Lock()
+        self._index = None
+        self._retrievers = {}
+
+    def warm_up(self) -> "KBRetriever":
+        with self._lock:
+            self._load()
+        return self
+
+    def _load(self):
+        # llamar con self._lock: comprobación y carga en la misma sección crítica (close/reload concurrentes)
+        if self._index is None:
+            self._index = self._open()
+        return self._index
+
+    def _open(self):
+        return build_or_load_index(self.data_dir) if self.sync else load_index()
+
+    def reload(self) -> "KBRetriever":
+        # Se construye el índice nuevo antes de sustituir el actual: las consultas en curso no se bloquean
+        index = self._open()
+        with self._lock:
+            self._index = index
+            self._retrievers = {}
+        return self
+
+    def close(self) -> None:
+        with self._lock:
+            self._index = None
+            self._retrievers = {}
+
+    def _retriever(self, k: int):
+        with self._lock:
+            r = self._retrievers.get(k)
+            if r is None:
+                r = self._load().as_retriever(similarity_top_k=k)
+                self._retrievers[k] = r
+            return r
+
+    def retrieve(self, query: str, k: Optional[int] = None) -> List[str]:
+        k = k or self.k
+        with span("rag.retrieve", k=k, backend="llamaindex"):
+            nodes = self._retriever(k).retrieve(query)
+        return [n.get_text() for n in nodes[:k]]
+
+    async def aretrieve(self, query: str, k: Optional[int] = None) -> List[str]:
+        submitted = time.perf_counter()
+
+        def run():
+            # espera en la cola del pool de hilos antes de empezar la búsqueda
+            observe("rag_threadpool_queue_ms", (time.perf_counter() - submitted)*1000)
+            return self.retrieve(query, k)
+
+        return await asyncio.to_thread(run)
+
+    def retrieve_batch(self, queries: List[str], k: Optional[int] = None) -> List[List[str]]:
+        return [self.retrieve(q, k) for q in queries]
+
+
+def make_retriever (data_dir: str = "kb", backend: Optional[str] = None, **kw) -> Union[KBRetriever, "NumpyRetriever"]:
+    backend = (backend or os.getenv("RAG_BACKEND", "llamaindex")).lower()
+    if backend not in BACKENDS:
+        raise ValueError(f"RAG_BACKEND must be one of {BACKENDS}, got {backend!r}")
+    if backend == "numpy":
+        from src.pipelines.vector_index import NumpyRetriever
+        return NumpyRetriever(data_dir, **kw)
+    return KBRetriever(data_dir, **kw)
+
+# un retriever por directorio de KB (ruta absoluta)
+_shared: Dict[str, Union[KBRetriever, "NumpyRetriever"]] = {}
+_shared_lock = threading.Lock()
+
+def get_retriever (data_dir: str = "kb"):
+    """Process-wide retriever for `data_dir`, shared by every analyzer (backend from RAG_BACKEND)."""
+    key = os.path.abspath(data_dir)
+    with _shared_lock:
+        r = _shared.get(key)
+        if r is None:
+            r = _shared[key] = make_retriever(data_dir)
+        return r
+
 def retrieve_context (query: str, k: int = 3) -> List[str]:
-    index = build_or_load_index()
-    qe = index.as_query_engine(similarity_top_k=k)
-    res = qe.query(query)
-    chunks = []
-    for sn in getattr(res, "source_models", [])[:k]:
-        chunks.append(sn.get_text())
-    return chunks
+    return get_retriever().retrieve(query, k)
@@ -0,0 +1,283 @@
+import os, sys, csv, json, asyncio, time
+from typing import TYPE_CHECKING, Any, Dict, IO, Iterator, List, Optional, Set, Tuple
+from src.clients.transport import closing_pools
+from src.pipelines.news_analyzer import FinancialNewsAnalyzer
+
+if TYPE_CHECKING:
+    from src.pipelines.dedup import NearDupIndex
+
+# (offset, next_offset, record). En ficheros JSONL el offset es la posición en bytes del inicio
+# de la línea (permite reanudar con seek); en CSV y stdin es el índice del registro.
+Record = Tuple[int, int, Dict[str, Any]]
+# clave del registro que sustituye a una línea ilegible (JSON roto, UTF-8 inválido): su offset
+# se escribe como error y la lectura sigue con la línea siguiente
+READ_ERROR = "_read_error"
+
+def _as_record(line: str, text_field: str) -> Optional[Dict[str, Any]]:
+    line = line.strip()
+    if not line:
+        return None
+    if line.startswith("{"):
+        obj = json.loads(line)
+        return obj if isinstance(obj, dict) else {text_field: str(obj)}
+    return {text_field: line}
+
+def _parse_line(raw: bytes, text_field: str) -> Optional[Dict[str, Any]]:
+    try:
+        return _as_record(raw.decode("utf-8"), text_field)
+    except ValueError as e:
+        # UnicodeDecodeError y JSONDecodeError son ValueError
+        return {READ_ERROR: {"error": str(e), "error_type": type(e).__name__}}
+
+def read_records(path: str, *, fmt: Optional[str] = None, text_field: str = "text", start: int = 0,
+                 end: Optional[int] = None) -> Iterator[Record]:
+    """Records from `start` on; in JSONL files `end` (a byte offset) stops before the first
+    line that starts at or after it. An unreadable line yields {READ_ERROR: {...}}."""
+    fmt = fmt or ("csv" if path.lower().endswith(".csv") else "jsonl")
+    if fmt == "csv":
+        f = sys.stdin if path == "-" else open(path, newline="", encoding="utf-8")
+        try:
+            for i, row in enumerate(csv.DictReader(f)):
+                if i >= start:
+                    yield i, i+1, row
+        finally:
+            if f is not sys.stdin:
+                f.close()
+    elif path == "-":
+        for i, line in enumerate(sys.stdin.buffer):
+            rec = _parse_line(line, text_field)
+            if i >= start and rec is not None:
+                yield i, i+1, rec
+    else:
+        with open(path, "rb") as f:
+            f.seek(start)
+            pos = start
+            for raw in f:
+                if end is not None and pos >= end:
+                    break
+                nxt = pos + len(raw)
+                rec = _parse_line(raw, text_field)
+                if rec is not None:
+                    yield pos, nxt, rec
+                pos = nxt
+
+
+class Checkpoint:
+    """Resume state: every input offset below `watermark` and every offset in `done` has
+    its result in the output file, which is exactly `out_bytes` long at that point."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.watermark = 0
+        self.done: Set[int] = set()
+        self.out_bytes = 0
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                state = json.load(f)
+            self.watermark = state["watermark"]
+            self.done = set(state.get("done", []))
+            self.out_bytes = state.get("out_bytes", 0)
+
+    @classmethod
+    def fresh(cls, path: str) -> "Checkpoint":
+        if os.path.exists(path):
+            os.remove(path)
+        return cls(path)
+
+    def save(self, watermark: int, done: Set[int], out_bytes: int) -> None:
+        self.watermark, self.out_bytes = watermark, out_bytes
+        self.done = {o for o in done if o >= watermark}
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"watermark": watermark, "done": sorted(self.done), "out_bytes": out_bytes}, f)
+            f.flush(); os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+
+
+async def run_stream(
+    records: Iterator[Record],
+    analyzer: FinancialNewsAnalyzer,
+    out: IO[str],
+    *,
+    provider: str = "stub",
+    use_rag: bool = False,
+    window: int = 16,
+    text_field: str = "text",
+    checkpoint: Optional[Checkpoint] = None,
+    checkpoint_every: int = 50,
+    dedup: Optional["NearDupIndex"] = None,
+    ts_field: Optional[str] = None,
+) -> Dict[str, Any]:
+    """Analyze `records` with at most `window` calls in flight, writing each result as
+    a JSONL line as soon as it completes (completion order, tagged with `offset`).
+
+    With `dedup`, a near-duplicate of a headline already answered (or in flight) in the
+    index's time window is not sent again: it gets a copy of that result, tagged with
+    its group id, when the representative's call completes. The window is measured on
+    the record's publication time (`ts_field`, or the first of dedup.TS_FIELDS present),
+    so replaying an archive groups headlines as they were published."""
+    skip = set(checkpoint.done) if checkpoint else set()
+    done: Set[int] = set(skip)
+    inflight: Dict[asyncio.Task, int] = {}
+    # grupo -> tarea del representante / miembros que esperan su resultado
+    group_task: Dict[str, asyncio.Task] = {}
+    task_group: Dict[asyncio.Task, str] = {}
+    waiting: Dict[str, List[Tuple[int, Dict[str, Any]]]] = {}
+    next_unread = checkpoint.watermark if checkpoint else 0
+    stats = {"read": 0, "written": 0, "skipped": 0, "errors": 0, "deduped": 0}
+    if dedup is not None:
+        from src.pipelines.dedup import record_ts
+    since_ckpt = 0
+    exhausted = False
+    it = iter(records)
+
+    def watermark() -> int:
+        pending = list(inflight.values()) + [o for members in waiting.values() for o, _ in members]
+        return min(pending) if pending else next_unread
+
+    def emit(line: Dict[str, Any], offset: int) -> None:
+        nonlocal since_ckpt
+        out.write(json.dumps(line, ensure_ascii=False, default=str) + "\n")
+        done.add(offset)
+        stats["written"] += 1
+        since_ckpt += 1
+
+    def fan_out(offset: int, rec: Dict[str, Any], res: Dict[str, Any], gid: str) -> Dict[str, Any]:
+        from src.pipelines.dedup import member_result
+        text = str(rec.get(text_field, ""))
+        routed = member_result(res["model_result"], gid)
+        return {"offset": offset, "input": rec, "result": {
+            **res, "rule_based": analyzer._rule_based(text), "model_result": routed, "dedup": routed["dedup"]}}
+
+    def save() -> None:
+        if checkpoint is not None:
+            # respuestas pendientes de la caché en disco antes del checkpoint
+            cache = getattr(analyzer.mm, "cache", None)
+            if cache is not None:
+                cache.flush()
+            out.flush(); os.fsync(out.fileno())
+            checkpoint.save(watermark(), done, out.tell())
+
+    async def one(offset: int, rec: Dict[str, Any]) -> Tuple[int, Dict[str, Any], Dict[str, Any]]:
+        res = await analyzer.analyze_sentiment(str(rec.get(text_field, "")), provider=provider, use_rag=use_rag)
+        return offset, rec, res
+
+    try:
+        while True:
+            while not exhausted and len(inflight) < window:
+                # la lectura puede bloquear (stdin): fuera del event loop
+                item = await asyncio.to_thread(next, it, None)
+                if item is None:
+                    exhausted = True
+                    break
+                offset, next_unread, rec = item
+                if offset in skip:
+                    stats["skipped"] += 1
+                    continue
+                stats["read"] += 1
+                if READ_ERROR in rec:
+                    stats["errors"] += 1
+                    emit({"offset": offset, **rec[READ_ERROR]}, offset)
+                    continue
+                gid = None
+                if dedup is not None:
+                    gid, _ = dedup.assign(str(rec.get(text_field, "")), ts=record_ts(rec, ts_field))
+                    known = dedup.result(gid)
+                    if known is not None:
+                        stats["deduped"] += 1
+                        emit(fan_out(offset, rec, known, gid), offset)
+                        continue
+                    if gid in group_task:
+                        stats["deduped"] += 1
+                        waiting[gid].append((offset, rec))
+                        continue
+                task = asyncio.create_task(one(offset, rec))
+                inflight[task] = offset
+                if gid is not None:
+                    group_task[gid], task_group[task] = task, gid
+                    waiting[gid] = []
+            if not inflight:
+                break
+            finished, _ = await asyncio.wait(inflight, return_when=asyncio.FIRST_COMPLETED)
+            for task in finished:
+                offset = inflight.pop(task)
+                gid = task_group.pop(task, None)
+                members = waiting.pop(gid, []) if gid is not None else []
+                if gid is not None:
+                    group_task.pop(gid, None)
+                try:
+                    _, rec, res = task.result()
+                    if gid is not None:
+                        res = {**res, "dedup": {"group": gid, "representative": True, "members": len(members) + 1}}
+                        if ((res.get("model_result") or {}).get("response") or {}).get("ok"):
+                            dedup.remember(gid, res)
+                    emit({"offset": offset, "input": rec, "result": res}, offset)
+                    for m_offset, m_rec in members:
+                        emit(fan_out(m_offset, m_rec, res, gid), m_offset)
+                except Exception as e:
+                    stats["errors"] += 1 + len(members)
+                    err = {"error": str(e), "error_type": type(e).__name__}
+                    for o in [offset] + [o for o, _ in members]:
+                        emit({"offset": o, **err, **({"dedup": {"group": gid}} if gid else {})}, o)
+            out.flush()
+            if since_ckpt >= checkpoint_every:
+                w = watermark()
+                done = {o for o in done if o >= w}
+                save()
+                since_ckpt = 0
+    finally:
+        for task in inflight:
+            task.cancel()
+        save()
+    return stats
+
+
+def main():
+    import argparse
+    ap = argparse.ArgumentParser(description="Stream headlines (JSONL/CSV/stdin) through FinancialNewsAnalyzer into JSONL.")
+    ap.add_argument("--input", default="-", help="JSONL/CSV path or '-' for stdin")
+    ap.add_argument("--output", default="-", help="JSONL path or '-' for stdout")
+    ap.add_argument("--format", choices=["jsonl", "csv"], default=None)
+    ap.add_argument("--text-field", default="text")
+    ap.add_argument("--provider", default="stub")
+    ap.add_argument("--use-rag", action="store_true")
+    ap.add_argument("--window", type=int, default=16, help="max requests in flight")
+    ap.add_argument("--checkpoint", default=None, help="checkpoint path (default: <output>.ckpt)")
+    ap.add_argument("--checkpoint-every", type=int, default=50)
+    ap.add_argument("--dedup", action="store_true", help="one model call per group of near-duplicate headlines (DEDUP_*)")
+    ap.add_argument("--ts-field", default=None, help="publication time field for --dedup (default: first of published_at/timestamp/ts/date)")
+    args = ap.parse_args()
+
+    ckpt = None
+    if args.output != "-":
+        ckpt_path = args.checkpoint or args.output + ".ckpt"
+        resuming = os.path.exists(ckpt_path) and os.path.exists(args.output)
+        ckpt = Checkpoint(ckpt_path) if resuming else Checkpoint.fresh(ckpt_path)
+        if resuming:
+            # se descarta lo escrito después del último checkpoint: esos offsets se vuelven a procesar
+            with open(args.output, "r+b") as f:
+                f.truncate(ckpt.out_bytes)
+        out = open(args.output, "a" if resuming else "w", encoding="utf-8")
+    else:
+        out = sys.stdout
+
+    if args.dedup:
+        from src.pipelines.dedup import NearDupIndex
+    start = ckpt.watermark if ckpt else 0
+    records = read_records(args.input, fmt=args.format, text_field=args.text_field, start=start)
+    t0 = time.perf_counter()
+    try:
+        stats = asyncio.run(closing_pools(run_stream(
+            records, FinancialNewsAnalyzer(), out,
+            provider=args.provider, use_rag=args.use_rag, window=args.window,
+            text_field=args.text_field, checkpoint=ckpt, checkpoint_every=args.checkpoint_every,
+            dedup=NearDupIndex() if args.dedup else None, ts_field=args.ts_field,
+        )))
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    stats["elapsed_s"] = round(time.perf_counter()-t0, 2)
+    print(json.dumps(stats), file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,271 @@
+import os, re, json, time, asyncio, hashlib, importlib, threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+import numpy as np
+from src.observability.metrics import inc, observe, span, traced
+
+# Backend "numpy" de rag_index: sin Chroma ni LlamaIndex, sólo una matriz float32 en disco
+NUMPY_DIR = "storage/numpy_index"
+KB_EXTENSIONS = (".md", ".txt")
+CHUNK_WORDS = 120
+
+Embedder = Callable[[Sequence[str]], np.ndarray]
+
+_TOKEN = re.compile(r"\w+", re.UNICODE)
+
+class HashingEmbedder:
+    """Offline embedding: hashed word unigrams and bigrams, L2-normalized.
+
+    Deterministic across processes (blake2b, not `hash()`), so an index built once can be
+    memory-mapped by any later run. Any callable `texts -> (n, dim) float32` can replace it.
+    """
+
+    def __init__(self, dim: int = 512):
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    def _slot(self, feature: str) -> Tuple[int, float]:
+        h = int.from_bytes(hashlib.blake2b(feature.encode(), digest_size=8).digest(), "little")
+        return h % self.dim, (1.0 if (h >> 63) & 1 else -1.0)
+
+    def __call__(self, texts: Sequence[str]) -> np.ndarray:
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for i, text in enumerate(texts):
+            words = _TOKEN.findall(text.lower())
+            for f in words + [a + " " + b for a, b in zip(words, words[1:])]:
+                j, sign = self._slot(f)
+                out[i, j] += sign
+        return normalize(out)
+
+def normalize(m: np.ndarray) -> np.ndarray:
+    m = np.ascontiguousarray(m, dtype=np.float32)
+    norms = np.linalg.norm(m, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return m / norms
+
+def load_embedder(spec: Optional[str] = None) -> Embedder:
+    """RAG_EMBEDDER: "hashing[:dim]" (default) or "module:attr" naming a factory/callable."""
+    spec = spec or os.getenv("RAG_EMBEDDER", "hashing")
+    if spec.split(":")[0] == "hashing":
+        return HashingEmbedder(int(spec.split(":")[1]) if ":" in spec else 512)
+    module, attr = spec.split(":", 1)
+    obj = getattr(importlib.import_module(module), attr)
+    return obj() if isinstance(obj, type) else obj
+
+def embedder_name(embedder: Embedder) -> str:
+    return getattr(embedder, "name", None) or getattr(embedder, "__qualname__", type(embedder).__name__)
+
+
+def chunk_text(text: str, max_words: int = CHUNK_WORDS) -> List[str]:
+    """Paragraph chunks; paragraphs longer than `max_words` are cut into word windows."""
+    out = []
+    for para in re.split(r"\n\s*\n", text):
+        words = para.split()
+        for i in range(0, len(words), max_words):
+            out.append(" ".join(words[i:i + max_words]))
+    return [c for c in out if c]
+
+def kb_files(data_dir: str) -> List[str]:
+    paths = []
+    for root, _, files in os.walk(data_dir):
+        paths += [os.path.join(root, f) for f in files if f.endswith(KB_EXTENSIONS)]
+    return sorted(paths)
+
+def embed_batched(embedder: Embedder, texts: Sequence[str], batch_size: int = 256) -> np.ndarray:
+    """Embed `texts` `batch_size` at a time (bounded memory, one embedder call per batch)."""
+    dim = getattr(embedder, "dim", 1)
+    parts = [normalize(embedder(texts[i:i + batch_size])) for i in range(0, len(texts), max(1, batch_size))]
+    return np.concatenate(parts) if parts else np.zeros((0, dim), np.float32)
+
+def read_chunks(data_dir: str, path: str) -> List[Dict[str, str]]:
+    with open(path, encoding="utf-8") as f:
+        return [{"text": c, "source": os.path.relpath(path, data_dir)} for c in chunk_text(f.read())]
+
+
+class NumpyIndex:
+    """Normalized chunk embeddings in one contiguous (n, dim) float32 matrix.
+
+    Files under `path`: vectors.npy (opened with mmap_mode="r"), chunks.json (text and
+    source file of each row) and meta.json (embedder, dim, per-file manifest; see kb_sync).
+    """
+
+    def __init__(self, vectors: np.ndarray, chunks: List[Dict[str, str]], meta: Dict):
+        self.vectors = vectors
+        self.chunks = chunks
+        self.meta = meta
+
+    def __len__(self) -> int:
+        return len(self.chunks)
+
+    @classmethod
+    @traced("rag.numpy.build")
+    def build(cls, data_dir: str, embedder: Embedder, path: str = NUMPY_DIR,
+              batch_size: int = 256, manifest: Optional[Dict] = None) -> "NumpyIndex":
+        chunks = [c for p in kb_files(data_dir) for c in read_chunks(data_dir, p)]
+        vectors = embed_batched(embedder, [c["text"] for c in chunks], batch_size)
+        return cls.write(path, vectors, chunks, embedder, manifest or {})
+
+    @classmethod
+    def write(cls, path: str, vectors: np.ndarray, chunks: List[Dict[str, str]], embedder: Embedder,
+              manifest: Dict) -> "NumpyIndex":
+        meta = {"embedder": embedder_name(embedder), "dim": int(vectors.shape[1]), "n": len(chunks),
+                "built_at": time.time(), "manifest": manifest}
+        os.makedirs(path, exist_ok=True)
+        # escritura atómica por fichero; meta.json (con el manifiesto) va el último
+        np.save(os.path.join(path, "vectors.tmp.npy"), np.ascontiguousarray(vectors, dtype=np.float32))
+        os.replace(os.path.join(path, "vectors.tmp.npy"), os.path.join(path, "vectors.npy"))
+        for name, obj in (("chunks.json", chunks), ("meta.json", meta)):
+            with open(os.path.join(path, name + ".tmp"), "w", encoding="utf-8") as f:
+                json.dump(obj, f, ensure_ascii=False)
+            os.replace(os.path.join(path, name + ".tmp"), os.path.join(path, name))
+        return cls.load(path)
+
+    @classmethod
+    def load(cls, path: str = NUMPY_DIR) -> "NumpyIndex":
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        with open(os.path.join(path, "chunks.json"), encoding="utf-8") as f:
+            chunks = json.load(f)
+        vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r")
+        if len(vectors) != len(chunks) or meta.get("n") != len(chunks):
+            raise ValueError(f"inconsistent numpy index at {path}")
+        return cls(vectors, chunks, meta)
+
+    def update(self, data_dir: str, embedder: Embedder, path: str, drop: Sequence[str], add: Sequence[str],
+               manifest: Dict, batch_size: int = 256) -> "NumpyIndex":
+        """New index without the rows of the `drop` sources plus freshly embedded chunks of
+        the `add` files; untouched rows are copied, never re-embedded."""
+        drop_set = set(drop)
+        keep = np.array([c["source"] not in drop_set for c in self.chunks], dtype=bool)
+        new_chunks = [c for p in add for c in read_chunks(data_dir, os.path.join(data_dir, p))]
+        new_vecs = embed_batched(embedder, [c["text"] for c in new_chunks], batch_size)
+        vectors = np.concatenate([np.asarray(self.vectors)[keep], new_vecs]) if len(self) else new_vecs
+        chunks = [c for c, k in zip(self.chunks, keep) if k] + new_chunks
+        return self.write(path, vectors, chunks, embedder, manifest)
+
+    @classmethod
+    def build_or_load(cls, data_dir: str, embedder: Embedder, path: str = NUMPY_DIR) -> "NumpyIndex":
+        """On-disk index brought up to date with `data_dir` (only changed files are embedded)."""
+        from src.pipelines.kb_sync import sync_numpy
+        return sync_numpy(data_dir, embedder, path)[0]
+
+    def search(self, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Top-k rows for each (normalized) query: one matrix product plus argpartition.
+        Returns (ids, scores), both (n_queries, k) and sorted by descending score."""
+        k = min(k, len(self))
+        if k <= 0:
+            empty = np.zeros((len(queries), 0))
+            return empty.astype(np.int64), empty.astype(np.float32)
+        scores = queries @ self.vectors.T
+        if k < scores.shape[1]:
+            ids = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        else:
+            ids = np.broadcast_to(np.arange(scores.shape[1]), scores.shape).copy()
+        top = np.take_along_axis(scores, ids, axis=1)
+        order = np.argsort(-top, axis=1, kind="stable")
+        return np.take_along_axis(ids, order, axis=1), np.take_along_axis(top, order, axis=1)
+
+
+class NumpyRetriever:
+    """Drop-in for KBRetriever (retrieve/aretrieve/warm_up/reload/close) over a NumpyIndex.
+
+    Query embeddings are kept in an LRU keyed by text (RAG_QUERY_CACHE entries), so
+    repeated headlines skip the embedder; `retrieve_batch` embeds only the misses and
+    answers every query with a single matrix product. With sync=False the index at
+    `path` is only loaded (NumpyIndex.load), never synced with `data_dir`.
+    """
+
+    def __init__(self, data_dir: str = "kb", k: int = 3, embedder: Optional[Embedder] = None,
+                 path: str = NUMPY_DIR, cache_size: Optional[int] = None, sync: bool = True):
+        self.data_dir = data_dir
+        self.k = k
+        self.path = path
+        self.sync = sync
+        self.embedder = embedder or load_embedder()
+        self.cache_size = cache_size if cache_size is not None else int(os.getenv("RAG_QUERY_CACHE", 4096))
+        self._lock = threading.Lock()
+        self._index: Optional[NumpyIndex] = None
+        self._qcache: "OrderedDict[str, np.ndarray]" = OrderedDict()
+
+    def warm_up(self) -> "NumpyRetriever":
+        self._current()
+        return self
+
+    def _current(self) -> NumpyIndex:
+        # comprobación y carga bajo el lock; se devuelve una referencia local (close/reload concurrentes)
+        with self._lock:
+            if self._index is None:
+                self._index = self._open()
+            return self._index
+
+    def _open(self) -> NumpyIndex:
+        if self.sync:
+            return NumpyIndex.build_or_load(self.data_dir, self.embedder, self.path)
+        return NumpyIndex.load(self.path)
+
+    def reload(self) -> "NumpyRetriever":
+        index = self._open()
+        with self._lock:
+            self._index = index
+        return self
+
+    def close(self) -> None:
+        with self._lock:
+            self._index = None
+            self._qcache.clear()
+
+    def _embed(self, queries: Sequence[str]) -> np.ndarray:
+        out: List[Optional[np.ndarray]] = [None]*len(queries)
+        missing: Dict[str, List[int]] = {}
+        with self._lock:
+            for i, q in enumerate(queries):
+                v = self._qcache.get(q)
+                if v is None:
+                    missing.setdefault(q, []).append(i)
+                else:
+                    self._qcache.move_to_end(q)
+                    out[i] = v
+        inc("rag_query_embed_cache_total", len(queries) - sum(map(len, missing.values())), result="hit")
+        if missing:
+            inc("rag_query_embed_cache_total", sum(map(len, missing.values())), result="miss")
+            texts = list(missing)
+            vecs = normalize(self.embedder(texts))
+            with self._lock:
+                for q, v in zip(texts, vecs):
+                    for i in missing[q]:
+                        out[i] = v
+                    if self.cache_size > 0:
+                        self._qcache[q] = v
+                        self._qcache.move_to_end(q)
+                while len(self._qcache) > self.cache_size:
+                    self._qcache.popitem(last=False)
+        return np.stack(out) if out else np.zeros((0, getattr(self.embedder, "dim", 1)), np.float32)
+
+    def retrieve_batch(self, queries: Sequence[str], k: Optional[int] = None) -> List[List[str]]:
+        k = k or self.k
+        index = self._current()
+        with span("rag.retrieve", k=k, backend="numpy", batch=len(queries)):
+            if not queries or not len(index):
+                return [[] for _ in queries]
+            ids, _ = index.search(self._embed(queries), k)
+        return [[index.chunks[j]["text"] for j in row] for row in ids]
+
+    def retrieve(self, query: str, k: Optional[int] = None) -> List[str]:
+        return self.retrieve_batch([query], k)[0]
+
+    async def aretrieve(self, query: str, k: Optional[int] = None) -> List[str]:
+        # sub-milisegundo: más barato responder en el bucle que pasar por el pool de hilos
+        if self._index is not None:
+            return self.retrieve(query, k)
+        submitted = time.perf_counter()
+
+        def run():
+            observe("rag_threadpool_queue_ms", (time.perf_counter() - submitted)*1000)
+            return self.retrieve(query, k)
+
+        return await asyncio.to_thread(run)
+
+    async def aretrieve_batch(self, queries: Sequence[str], k: Optional[int] = None) -> List[List[str]]:
+        if self._index is not None:
+            return self.retrieve_batch(queries, k)
+        return await asyncio.to_thread(self.retrieve_batch, queries, k)
@@ -1,16 +1,37 @@
-import os, sys, asyncio
-from dotenv import load_dotenv
+import os, sys, asyncio, threading
 
 ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
 if ROOT not in sys.path:
     sys.path.append(ROOT)
 
-load_dotenv(".env", override=True)
+from src.clients.registry import load_env
+load_env()
 
 import streamlit as st
 from src.clients.base import env_keys_status
 from src.pipelines.news_analyzer import FinancialNewsAnalyzer
 from src.orchestrator.multimodel_analyzer import MultiModelAnalyzer
+from src.orchestrator.ensemble import tally
+
+# Un único analizador por proceso de Streamlit (clientes, pools HTTP, caché y breakers se reutilizan)
+# y un único event loop en su propio hilo donde corren todas sus llamadas: el estado ligado al loop
+# (pools, limitadores, breakers, micro-lotes) no se comparte entre los hilos de las sesiones
+@st.cache_resource
+def get_loop() -> asyncio.AbstractEventLoop:
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, name="ui-event-loop", daemon=True).start()
+    return loop
+
+def run(coro):
+    return asyncio.run_coroutine_threadsafe(coro, get_loop()).result()
+
+@st.cache_resource
+def get_mm() -> MultiModelAnalyzer:
+    return MultiModelAnalyzer()
+
+@st.cache_resource
+def get_analyzer() -> FinancialNewsAnalyzer:
+    return FinancialNewsAnalyzer(mm=get_mm())
 
 st.set_page_config(page_title="Lab1 — Multi-Model Analyzer", layout="wide")
 st.title("Lab1 — Multi-Model Financial Analyzer")
@@ -22,7 +43,7 @@ st.sidebar.json(env_keys_status())
 text = st.text_area("Pega una noticia / titular financiero",
                     "Acme Corp beats earnings expectations amid record growth.")
 
-mode = st.radio("Proveedor (single run)", ["stub (rule-based)", "openai", "anthropic", "deepseek", "auto", "cost-aware"],
+mode = st.radio("Proveedor (single run)", ["stub (rule-based)", "openai", "anthropic", "deepseek", "local", "auto", "cost-aware", "cascade", "ensemble"],
                  index=1, horizontal=True)
 
 provider = "stub" if mode.startswith("stub") else mode
@@ -30,20 +51,25 @@ provider = "stub" if mode.startswith("stub") else mode
 col1, col2 = st.columns([1,1])
 with col1:
     if st.button("Analizar (single)"):
-        analyzer = FinancialNewsAnalyzer()
-        res = asyncio.run(analyzer.analyze_sentiment(text, provider=provider))
+        analyzer = get_analyzer()
+        res = run(analyzer.analyze_sentiment(text, provider=provider))
         st.subheader("Resultado (single)")
         st.json(res)
         meta = res.get("model_result", {}).get("routing_meta")
-        if meta:
+        if meta and "stage" in meta:
+            st.info(
+                f"Cascade answered at **{meta.get('stage')}** ({meta.get('answered_by')})"
+                f". total cost: ${meta.get('total_cost_usd', 0):.8f} . stages: {len(meta.get('stages', []))}"
+            )
+        elif meta:
             st.info(
                 f"Router chose **{meta.get('provider')}**({meta.get('model')})"
                 f". estimated cost: ${meta.get('est_cost_usd', 0):.8f} . reason: {meta.get('reason')}"
             )
 with col2:
     if st.button("Comparar (3)"):
-        mm = MultiModelAnalyzer()
-        allres = asyncio.run(mm.analyze_all_providers(text))
+        mm = get_mm()
+        allres = run(mm.analyze_all_providers(text))
         st.write("Available providers in compare:", allres.get("available"))
         st.write("Keys status:", allres.get("keys_status"))
         st.subheader("Resultados por proveedor")
@@ -66,22 +92,15 @@ with col2:
                         if r.get("cost_usd") is not None:
                             st.metric("Coste (USD)", f"{r['cost_usd']:.6f}")
 
-        # Ensemble sencillo (voto ponderado por confidence)
+        # Ensemble (voto ponderado por confidence, pesos calibrados si los hay)
         votes = {}
         for prov, r in allres.get("results", {}).items():
             if r.get("ok") and r.get("parsed"):
                 p = r["parsed"]
                 votes[prov] = (p.get("sentiment"), float(p.get("confidence", 0.0)))
         if votes:
-            weights = {"openai":0.4, "anthropic":0.35, "deepseek":0.25}
-            scores = {"bullish":0.0,"bearish":0.0,"neutral":0.0}
-            for prov, (label, conf) in votes.items():
-                w = weights.get(prov, 0.3)
-                scores[label] += w * (0.5 + 0.5*conf)
-            label = max(scores, key=scores.get)
-            reliability = max(scores.values()) - sorted(scores.values())[-2]
             st.subheader("Ensemble")
-            st.write({"label": label, "reliability": round(reliability,3), "scores": {k:round(v,3) for k,v in scores.items()}})
+            st.write(tally(votes, mm.ensemble_weights))
         else:
             st.info("No hay resultados válidos para calcular ensemble.")
 
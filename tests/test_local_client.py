@@ -0,0 +1,37 @@
+import asyncio
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+from src.clients.base import validate_sentiment
+from src.clients.local_client import LocalClient, LocalConfig, tiny_model
+
+
+@pytest.fixture(scope="module")
+def model_dir(tmp_path_factory):
+    return tiny_model(str(tmp_path_factory.mktemp("tiny-bert")))
+
+
+@pytest.mark.parametrize("quantize", ["off", "int8"])
+def test_local_client_micro_batches(model_dir, quantize, monkeypatch):
+    monkeypatch.setenv("LOCAL_QUANTIZE", quantize)
+    client = LocalClient(model_dir, LocalConfig.from_env())
+    texts = [f"Company {i} beats Q3 earnings and raises guidance" for i in range(24)]
+
+    async def run():
+        return await asyncio.gather(*(client.analyze(t) for t in texts))
+
+    try:
+        res = asyncio.run(run())
+    finally:
+        client.batcher.close()
+
+    assert all(r["ok"] for r in res), [r.get("error") for r in res if not r["ok"]]
+    for r in res:
+        assert r["provider"] == "local"
+        assert r["cost_usd"] == 0.0
+        assert validate_sentiment(r["parsed"])
+        assert r["usage"]["prompt"] > 0
+    assert max(r["batch_size"] for r in res) > 1
+    assert client._model.config.quantize == quantize